@@ -1,12 +1,23 @@
 #!/bin/env python
+# with APF_FAKE_HTCONDOR set, libfactory gets the in-process fake htcondor
+from autopyfactory_tools.lib import fakehtcondor
+fakehtcondor.installfromenv()
+
 import argparse
+import json
 import libfactory
 import logging
+import os
+import signal
+import socket
 import sys
+import time
 import traceback
 from pprint import pprint
+from autopyfactory_tools.lib.cachelib import SnapshotCache
+from autopyfactory_tools.lib.eventloglib import EventLogState
+from autopyfactory_tools.lib.historylib import History
 from libfactory.htcondorlib import HTCondorSchedd, HTCondorPool
-from libfactory.info import StatusInfo, IndexByKey, AnalyzerFilter, AnalyzerMap, Count
 
 '''
   JOB STATUS
@@ -14,29 +25,8 @@ from libfactory.info import StatusInfo, IndexByKey, AnalyzerFilter, AnalyzerMap,
   running = 2
 '''
 
-class IdleOnlyFilter(AnalyzerFilter):
-    def filter(self, job):
-        isidle = False
-        try:
-            jobstatus = int(job['jobstatus'])
-            if jobstatus == 1:
-                isidle = True
-        except:
-            print(traceback.format_exc(None))   
-        return isidle
-
-
-class RunningOnlyFilter(AnalyzerFilter):
-    def filter(self, job):
-        isrunning = False
-        try:
-            jobstatus = int(job['jobstatus'])
-            if jobstatus == 2:
-                isrunning = True
-        except:
-            print(traceback.format_exc(None))   
-            
-        return isrunning
+IDLE = 1
+RUNNING = 2
 
 
 class TargetInfo(object):
@@ -45,6 +35,9 @@ class TargetInfo(object):
         self.howfull = None        #floating value 0 - 1.0 ; 1.0 totally full ; 0 = empty
         self.newestrunning = None    # classad object of most recent running job
         self.oldestidle = None     #Classad object of oldest idle job
+        self.nrunning = 0          # number of running jobs
+        self.nidle = 0             # number of idle jobs
+        self.nstarted = None       # number of jobs started since the previous run, if known
     
 
     def __repr__(self):
@@ -60,10 +53,12 @@ class TargetInfo(object):
         except:
             pass
         
-        s = "TargetInfo: isfull=%s ,howfull=%s , newestrunning[age]=%s , oldestidle[age]=%s " % (self.isfull,
+        s = "TargetInfo: isfull=%s ,howfull=%s , newestrunning[age]=%s , oldestidle[age]=%s , nrunning=%s , nidle=%s " % (self.isfull,
                                                                            self.howfull,
                                                                            nr,
                                                                            oi,
+                                                                           self.nrunning,
+                                                                           self.nidle,
                                                                            )
         return s
 
@@ -71,13 +66,47 @@ class TargetStatus(object):
     '''
       Class to store and process the congestion status of HTCondor queues/targets.  
       Configuration parameters for heuristics provided on init, same for all targets. 
+
+      If logsdir is given, the jobs are read from their event logs in that 
+      directory, with the state kept in statefile, instead of querying the schedd.
+
+      Jobs are grouped by the value of key.
+
+      If historyfile is given, a sample of the status of each queue is 
+      kept there on each run, and howfull is calculated from the last 
+      nsamples of them, instead of only the current one.
+
+      A queue is full when its oldest idle job has been idle for more than 
+      idlethreshold seconds, unless a job started less than 
+      runningthreshold seconds ago. 
+      Older samples weigh less in howfull: their weight is halved 
+      every halflife seconds.
       
     '''
-    def __init__(self):
+    def __init__(self, logsdir=None, statefile=None, key='MATCH_APF_QUEUE', 
+                 historyfile=None, nsamples=60, 
+                 idlethreshold=360, runningthreshold=120, halflife=600):
         self.log = logging.getLogger()
+        self.logsdir = logsdir
+        self.statefile = statefile
+        self.key = key
+        self.historyfile = historyfile
+        self.nsamples = nsamples
+        self.idlethreshold = idlethreshold
+        self.runningthreshold = runningthreshold
+        self.halflife = halflife
+        self.history = None
+        # kept between calls, in --watch mode
+        self.eventlogstate = None
+        self.schedd = None
+        # False when the state of the event logs is written by save( ) instead
+        self.savestate = True
+        # True to fetch only the jobs that changed since the previous call
+        self.delta = False
+        self.cache = None
 
 
-    def get_howfull(self):
+    def get_howfull(self, queuedict=None):
         '''
         Returns a value between 0 and 1 for how full the target is for all targets.  
         
@@ -85,10 +114,18 @@ class TargetStatus(object):
            'queuelabel2' : .33 ,
            'queuelabel2' : .02 , 
         }
+
+        queuedict is the result of get_isfull( ) in the same cycle, if any, 
+        so the jobs are not read again. 
+        Otherwise, they are, but no sample is added to the history: 
+        that is only done by get_isfull( ), once per cycle.
         '''
+        if queuedict is None:
+            queuedict = self.get_isfull(record=False)
+        return dict([(q, ti.howfull) for q, ti in queuedict.iteritems()])
 
 
-    def get_isfull(self):
+    def get_isfull(self, record=True):
         '''
         For each queue decide if it is full. 
         
@@ -98,8 +135,8 @@ class TargetStatus(object):
                 the last job to start was more than Z seconds ago
         
         
-        X = 360
-        Y = 2000
+        X = runningthreshold (120)
+        Y = idlethreshold (360)
         
         if Q does not have idle:
             FULL = False
@@ -119,61 +156,195 @@ class TargetStatus(object):
         queuedict = {}
         
         try:
-            #pool = HTCondorPool(hostname='localhost', port='9618')
-            sd = HTCondorSchedd()
-            attlist = ['jobstatus','MATCH_APF_QUEUE','qdate','enteredcurrentstatus','clusterid','procid','serverTime']
-            cq = sd.condor_q(attribute_l = attlist)
-            
-            rrdict = self.get_recentrunning(cq)      
-            self.log.debug('####################### rrdict ####################' )
-            self.log.debug(rrdict)
+            queuedict = self.calculate(record)
+        except:
+            self.log.debug(traceback.format_exc(None))   
+        return queuedict
+
+
+    def calculate(self, record=True):
+        '''
+        same as get_isfull( ), but errors are raised, 
+        so callers can tell a failure from an empty schedd.
+        With record False, the current samples are used for howfull, 
+        but not added to the history.
+        '''
+        try:
+            cq = self.get_jobs()
             
-            oidict = self.get_oldestidle(cq)
-            self.log.debug('####################### oidcit ####################' )
-            self.log.debug(oidict)
-            queuedict = self._build_queuedict(rrdict, oidict)
+            since = None
+            if self.historyfile:
+                self.history = History(self.historyfile, self.nsamples)
+                self.history.open()
+                since = self.history.lastupdate() or None
+            queuedict = self._reduce(cq, since)
             self.log.debug('###################### queuedict one ####################')
             self.log.debug(queuedict)
             queuedict = self._calc_isfull(queuedict)
             self.log.debug('##################### queuedict after isfull calc ####################')
             self.log.debug(queuedict)
-            queuedict = self._calc_howfull(queuedict)
+            queuedict = self._calc_howfull(queuedict, record)
             self.log.debug('#################### queuedict after howfull calc ####################')
             self.log.debug(queuedict)
-            
-        except:
-            self.log.debug(traceback.format_exc(None))   
-        return queuedict
+            return queuedict
+        finally:
+            if self.history is not None:
+                self.history.close()
+                self.history = None
 
-    def _build_queuedict(self, runningdict, idledict):
+
+    def save(self):
         '''
-        queuedict = 
-        
+        writes the state of the event logs, 
+        when it is not written after every update
+        '''
+        if self.eventlogstate is not None:
+            self.eventlogstate.save()
+
+
+    def get_jobs(self):
+        '''
+        list of jobs, either from the schedd or from the event logs
+        '''
+        if self.logsdir:
+            if self.eventlogstate is None:
+                self.eventlogstate = EventLogState(self.logsdir, self.statefile)
+            state = self.eventlogstate
+            state.update(self.savestate)
+            now = int(time.time())
+            return [self._job(ad, now) for ad in state.classads()]
+
+        if self.delta:
+            return self._deltajobs()
+
+        #pool = HTCondorPool(hostname='localhost', port='9618')
+        if self.schedd is None:
+            self.schedd = HTCondorSchedd()
+        attlist = ['jobstatus','MATCH_APF_QUEUE','qdate','enteredcurrentstatus','clusterid','procid','serverTime']
+        return self.schedd.condor_q(attribute_l = attlist)
+
+
+    def _deltajobs(self):
+        '''
+        list of jobs from the local schedd, in --watch mode.
+        They are kept in a snapshot of cachelib, and each call only 
+        the jobs that changed since the previous one are fetched, 
+        with SnapshotCache.delta( ), instead of all of them.
+        '''
+        if self.cache is None:
+            import htcondor
+            self.schedd = htcondor.Schedd()
+            self.cache = SnapshotCache(ttl=0)
+        schedd = self.schedd
+        query = lambda constraint, attributes: schedd.xquery(constraint, attributes)
+        attributes = ['ClusterId', 'ProcId', 'JobStatus', 'QDate', 'EnteredCurrentStatus', self.key]
+        now = int(time.time())
+        return [self._job(ad, now) for ad in self.cache.delta('schedd local', 'true', attributes, query)]
+
+
+    def _job(self, ad, now):
+        '''
+        job, as returned by condor_q( ), from a ClassAd 
+        of the event logs or of a snapshot
+        '''
+        job = {'jobstatus'            : ad['JobStatus'],
+               'qdate'                : ad['QDate'],
+               'enteredcurrentstatus' : ad['EnteredCurrentStatus'],
+               'clusterid'            : ad['ClusterId'],
+               'procid'               : ad['ProcId'],
+               'ServerTime'           : now,
+               'MyType'               : 'Job',
+               'TargetType'           : 'Machine'}
+        if self.key in ad:
+            job[self.key] = ad[self.key]
+        return job
+
+
+    def _reduce(self, cq, since=None):
+        '''
+        single pass over the jobs, building 
+
           {      
-             'queuelabel1' : [ isFull, howFull, newestrunningjob, oldestidlejob ] 
-             'queuelabel2' : [ isFull, howFull, newestrunningjob, oldestidlejob ] 
-          }
-          
+             'queuelabel1' : TargetInfo, 
+             'queuelabel2' : TargetInfo, 
           }
-        
-        
+
+        with, for each queue, the number of idle and running jobs, 
+        the running job with the largest EnteredCurrentStatus (newestrunning)
+        and the idle job with the smallest one (oldestidle). 
+        Each value is converted to integer only once, 
+        and only the two selected jobs are copied. 
+
+        If since is given, the running jobs that started after it
+        are counted too.
         '''
-        # build empty structure containing all queues. 
+        key = self.key
+        # queue -> [ nidle, nrunning, 
+        #            EnteredCurrentStatus of oldest idle, oldest idle job, 
+        #            EnteredCurrentStatus of newest running, newest running job,
+        #            nstarted ]
+        reduced = {}
+        nbad = 0
+        for job in cq:
+            try:
+                jobstatus = int(job['jobstatus'])
+                if jobstatus != IDLE and jobstatus != RUNNING:
+                    continue
+                entered = int(job['enteredcurrentstatus'])
+                q = job[key]
+            except (KeyError, TypeError, ValueError):
+                nbad += 1
+                continue
+
+            r = reduced.get(q)
+            if r is None:
+                r = [0, 0, None, None, None, None, 0]
+                reduced[q] = r
+            if jobstatus == IDLE:
+                r[0] += 1
+                if r[2] is None or entered < r[2]:
+                    r[2] = entered
+                    r[3] = job
+            else:
+                r[1] += 1
+                if r[4] is None or entered > r[4]:
+                    r[4] = entered
+                    r[5] = job
+                if since is not None and entered > since:
+                    r[6] += 1
+
+        if nbad:
+            self.log.debug('%d jobs without valid jobstatus, enteredcurrentstatus or %s ignored' %(nbad, key))
+
         queuedict = {}
-        for q in runningdict.keys():
-            queuedict[q] = TargetInfo()
-        for q in idledict.keys():
-            queuedict[q] = TargetInfo()
-        # fill in values
-        
-        for q in runningdict.keys():
-            queuedict[q].newestrunning = runningdict[q]
-            
-        for q in idledict.keys():
-            queuedict[q].oldestidle = idledict[q]
+        for q, (nidle, nrunning, idleentered, idlejob, runningentered, runningjob, nstarted) in reduced.iteritems():
+            ti = TargetInfo()
+            ti.nidle = nidle
+            ti.nrunning = nrunning
+            if since is not None:
+                ti.nstarted = nstarted
+            if idlejob is not None:
+                ti.oldestidle = self._selected(idlejob, idleentered)
+            if runningjob is not None:
+                ti.newestrunning = self._selected(runningjob, runningentered)
+            queuedict[q] = ti
         return queuedict
 
 
+    def _selected(self, job, entered):
+        '''
+        copy of a job selected by _reduce( ), with its age.
+        ServerTime is read before copying, as the lookups in
+        the ClassAd are case insensitive, but not in the copy
+        '''
+        servertime = int(job['ServerTime'])
+        job = dict(job)
+        job.pop('MyType', None)
+        job.pop('TargetType', None)
+        job['age'] = servertime - entered
+        return job
+
+
     def _calc_isfull(self, queuedict):
         for q in queuedict.keys():
             ti = queuedict[q]
@@ -185,91 +356,232 @@ class TargetStatus(object):
             else:
                 try:
                     agestr = ti.oldestidle['age'] 
-                    if int( agestr  ) > 360 :
+                    if int( agestr  ) > self.idlethreshold :
                         ti.isfull = True 
                     
                     agestr = ti.newestrunning['age'] 
-                    if int(agestr) < 120 :
+                    if int(agestr) < self.runningthreshold :
                         ti.isfull = False
                 except:
                     pass
         return queuedict
 
-    def _calc_howfull(self, queuedict):
-        
+    def _calc_howfull(self, queuedict, record=True):
+        '''
+        howfull is the weighted average of the score of the samples 
+        in the history of the queue, including the current one. 
+        Without history, it is just the score of the current status.
+        The current sample is appended to the history only if record is True.
+        '''
+        now = time.time()
+        for q in queuedict.keys():
+            ti = queuedict[q]
+            sample = (now, 
+                      ti.nidle, 
+                      ti.nrunning, 
+                      _known(ti.nstarted),
+                      _known(ti.oldestidle and ti.oldestidle['age']),
+                      _known(ti.newestrunning and ti.newestrunning['age']))
+            if self.history is None:
+                ti.howfull = self._score(sample, None)
+                continue
+            if record:
+                self.history.append(q, sample)
+                samples = self.history.samples(q)
+            else:
+                samples = (self.history.samples(q) + [sample])[-self.nsamples:]
+            total = weights = 0.0
+            previous = None
+            for s in samples:
+                weight = 0.5 ** ((now - s[0]) / self.halflife)
+                total += weight * self._score(s, previous)
+                weights += weight
+                previous = s
+            ti.howfull = total / weights
+        if self.history is not None and record:
+            self.history.setlastupdate(now)
         return queuedict
 
 
+    def _score(self, sample, previous):
+        '''
+        how full a queue is according to one sample, between 0 and 1:
+
+            how long the oldest idle job has been waiting, 
+            relative to idlethreshold,
+          x how long it would take to start all idle jobs 
+            at the start rate since the previous sample, 
+            relative to idlethreshold (1 when the rate is not known),
+          x how long ago the last job started, relative to runningthreshold
+        '''
+        t, nidle, nrunning, nstarted, oldestidle, newestrunning = sample
+        if nidle <= 0 or oldestidle < 0:
+            return 0.0
+        score = min(float(oldestidle) / self.idlethreshold, 1.0)
+        if previous is not None and nstarted > 0 and t > previous[0]:
+            rate = nstarted / (t - previous[0])
+            score *= min(nidle / rate / self.idlethreshold, 1.0)
+        if newestrunning >= 0:
+            score *= min(float(newestrunning) / self.runningthreshold, 1.0)
+        return score
+
+
 
     def get_recentrunning(self, cq):
         '''
          Get the most recently started job for each queue by key. 
             
-          {  'queuelabel1' : '1544551885',   # largest epoch time of all jobs in queue  
-             'queuelabel2' : False 
+          {  'queuelabel1' : {... 'enteredcurrentstatus' : 1544551885, 'age' : 120, ...},   # largest epoch time of all jobs in queue  
           }
     
         '''
-        si  = StatusInfo(cq)
-        runningfilter = RunningOnlyFilter() 
-        si = si.filter(runningfilter)
-        si = si.indexby(IndexByKey('MATCH_APF_QUEUE'))    
-        jobdict = si.getraw()
-        
-        for q in jobdict.keys():
-            newest = None
-            joblist = jobdict[q]
-            for j in joblist:
-                if not newest:
-                    newest = j
-                else:
-                    if int( j['enteredcurrentstatus'] ) > int( newest['enteredcurrentstatus'] ):
-                        newest = j
-            # newest is now  [ jobstatus = 1; MATCH_APF_QUEUE = "ANALY_BNL_SHORT-gridgk07.racf.bnl.gov"; ServerTime = 1544627506; enteredcurrentstatus = 1544627388; clusterid = 398446; procid = 0; qdate = 1544627388; MyType = "Job"; TargetType = "Machine" ]
-            #print("Type of job is %s" % type(newest))
-            del newest['MyType']
-            del newest['TargetType']
-            newest['age'] = int(newest['ServerTime']) - int(newest['enteredcurrentstatus'])
-            jobdict[q] = newest
-        return jobdict
+        queuedict = self._reduce(cq)
+        return dict([(q, ti.newestrunning) for q, ti in queuedict.iteritems() if ti.newestrunning is not None])
 
 
     def get_oldestidle(self, cq):
         '''
         Determine how old the oldest idle job is for each queue given by key.
-        Determine when the last job to start started.  
          
-        EnteredCurrentStatus = 1544551885  
-        QDate  = 1544551885
-    
-          {  'queuelabel1' : '1544551885',   # smallest epoch time of all jobs in queue  
-             'queuelabel2' : False 
+          {  'queuelabel1' : {... 'enteredcurrentstatus' : 1544551885, 'age' : 3600, ...},   # smallest epoch time of all jobs in queue  
           }    
         
-        
         '''
-        si  = StatusInfo(cq)
-        idlefilter = IdleOnlyFilter() 
-        si = si.filter(idlefilter)    
-        si = si.indexby(IndexByKey('MATCH_APF_QUEUE'))    
-        jobdict = si.getraw()
-        
-        for q in jobdict.keys():
-            oldest = None
-            joblist = jobdict[q]
-            for j in joblist:
-                if not oldest:
-                    oldest = j
-                else:
-                    if int( j['enteredcurrentstatus'] ) > int( oldest['enteredcurrentstatus'] ):
-                        oldest = j
-            # newest is now  [ jobstatus = 1; MATCH_APF_QUEUE = "ANALY_BNL_SHORT-gridgk07.racf.bnl.gov"; ServerTime = 1544627506; enteredcurrentstatus = 1544627388; clusterid = 398446; procid = 0; qdate = 1544627388; MyType = "Job"; TargetType = "Machine" ]
-            #print("Type of job is %s" % type(oldest))
-            del oldest['MyType']
-            del oldest['TargetType']
-            oldest['age'] = int(oldest['ServerTime']) - int(oldest['enteredcurrentstatus'])
-            jobdict[q] = oldest
-        return jobdict
+        queuedict = self._reduce(cq)
+        return dict([(q, ti.oldestidle) for q, ti in queuedict.iteritems() if ti.oldestidle is not None])
+
+
+
+class Notifier(object):
+    '''
+    writes one JSON object per line to 
+        -                 stdout
+        unix:PATH         a Unix domain socket
+        tcp:HOST:PORT     a TCP socket
+        anything else     a file, opened in append mode
+    Sockets are reconnected when the connection is lost.
+    '''
+    def __init__(self, output='-'):
+        self.log = logging.getLogger()
+        self.output = output
+        self.f = None
+        self.sock = None
+
+
+    def send(self, event):
+        line = json.dumps(event, sort_keys=True) + '\n'
+        if self.output.startswith('unix:') or self.output.startswith('tcp:'):
+            self._sendsocket(line)
+            return
+        if self.f is None:
+            if self.output == '-':
+                self.f = sys.stdout
+            else:
+                self.f = open(self.output, 'a')
+        self.f.write(line)
+        self.f.flush()
+
+
+    def _sendsocket(self, line):
+        for attempt in range(2):
+            try:
+                if self.sock is None:
+                    self.sock = self._connect()
+                self.sock.sendall(line)
+                return
+            except socket.error, ex:
+                self.log.error('sending to %s failed: %s' %(self.output, ex))
+                if self.sock is not None:
+                    self.sock.close()
+                    self.sock = None
+
+
+    def _connect(self):
+        kind, address = self.output.split(':', 1)
+        if kind == 'unix':
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(address)
+        else:
+            host, port = address.rsplit(':', 1)
+            sock = socket.create_connection((host, int(port)))
+        return sock
+
+
+
+def watch(ts, interval, notifier, savecycles=10):
+    '''
+    recalculates isfull every interval seconds, forever, 
+    and notifies only the queues whose isfull changed. 
+    The first time, all queues are notified, with previous = None.
+    A queue with no idle nor running jobs anymore is not full.
+    The state of the event logs is kept in memory, and written
+    every savecycles cycles and on exit.
+    Without event logs, the jobs are kept in a snapshot, and each
+    cycle only the ones that changed are fetched from the schedd.
+    '''
+    log = logging.getLogger()
+    previous = {}
+    ts.savestate = False
+    ts.delta = True
+    cycle = 0
+    try:
+        while True:
+            start = time.time()
+            try:
+                queuedict = ts.calculate()
+            except Exception, ex:
+                # a failed query must not look like all queues became empty
+                log.error('calculating isfull failed: %s' %ex)
+                queuedict = None
+
+            if queuedict is not None:
+                now = int(time.time())
+                for q in sorted(queuedict.keys()):
+                    ti = queuedict[q]
+                    if q in previous and previous[q] == ti.isfull:
+                        continue
+                    notifier.send({'time'          : now,
+                                   'queue'         : q,
+                                   'isfull'        : ti.isfull,
+                                   'previous'      : previous.get(q),
+                                   'howfull'       : ti.howfull,
+                                   'nidle'         : ti.nidle,
+                                   'nrunning'      : ti.nrunning,
+                                   'oldestidle'    : ti.oldestidle and ti.oldestidle['age'],
+                                   'newestrunning' : ti.newestrunning and ti.newestrunning['age']})
+                    previous[q] = ti.isfull
+                for q in sorted(previous.keys()):
+                    if q not in queuedict:
+                        if previous[q]:
+                            notifier.send({'time'          : now,
+                                           'queue'         : q,
+                                           'isfull'        : False,
+                                           'previous'      : previous[q],
+                                           'howfull'       : 0.0,
+                                           'nidle'         : 0,
+                                           'nrunning'      : 0,
+                                           'oldestidle'    : None,
+                                           'newestrunning' : None})
+                        del previous[q]
+                log.debug('cycle done in %.2f seconds, %d queues' %(time.time() - start, len(queuedict)))
+
+            cycle += 1
+            if cycle % savecycles == 0:
+                ts.save()
+
+            time.sleep(max(interval - (time.time() - start), 1))
+    finally:
+        ts.save()
+
+
+
+def _known(value):
+    '''
+    -1 for unknown values in the history
+    '''
+    if value is None:
+        return -1
+    return int(value)
 
 
 
@@ -285,10 +597,69 @@ if __name__ == '__main__':
                     dest='key', 
                     required=False, 
                     default='MATCH_APF_QUEUE')
+    parser.add_argument("--from-logs",
+                    help="Reads the jobs from their event logs in this directory (the APF logs directory), instead of querying the schedd",
+                    action="store",
+                    dest='logsdir',
+                    required=False,
+                    default=None)
+    parser.add_argument("--logs-state",
+                    help="File to keep the status of the jobs between runs when using --from-logs",
+                    action="store",
+                    dest='statefile',
+                    required=False,
+                    default='/tmp/apf-calc-isfull-eventlog-state-%d.json' %os.getuid())
+    parser.add_argument("--history",
+                    help="File to keep the recent history of each queue between runs, to calculate howfull from it",
+                    action="store",
+                    dest='historyfile',
+                    required=False,
+                    default=None)
+    parser.add_argument("--samples",
+                    help="Number of samples kept per queue in the history file [60]",
+                    action="store",
+                    type=int,
+                    default=60)
+    parser.add_argument("--idle-threshold",
+                    help="Seconds the oldest idle job must wait for the queue to be full [360]",
+                    action="store",
+                    type=int,
+                    default=360)
+    parser.add_argument("--running-threshold",
+                    help="A queue where a job started less than this number of seconds ago is not full [120]",
+                    action="store",
+                    type=int,
+                    default=120)
+    parser.add_argument("--halflife",
+                    help="Seconds for the weight of a sample of the history in howfull to be halved [600]",
+                    action="store",
+                    type=float,
+                    default=600)
+    parser.add_argument("-w", "--watch",
+                    help="Runs forever, recalculating isfull every WATCH seconds, and writing only the queues that became full or not full, as one JSON object per line. Without --from-logs, each cycle only the jobs that changed are fetched from the schedd",
+                    action="store",
+                    type=float,
+                    metavar="INTERVAL",
+                    default=None)
+    parser.add_argument("-o", "--output",
+                    help="Where the --watch notifications are written: - for stdout, unix:PATH or tcp:HOST:PORT for a socket, or a file [-]",
+                    action="store",
+                    default='-')
     args = parser.parse_args()
     
-    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    if args.watch:
+        # stdout is for the notifications
+        logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+    else:
+        logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
 
-    ts = TargetStatus()
-    pprint(ts.get_isfull())
+    ts = TargetStatus(args.logsdir, args.statefile, args.key, 
+                      args.historyfile, args.samples, 
+                      args.idle_threshold, args.running_threshold, args.halflife)
+    if args.watch:
+        # so the state of the event logs is written when stopped
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        watch(ts, args.watch, Notifier(args.output))
+    else:
+        pprint(ts.get_isfull())
 
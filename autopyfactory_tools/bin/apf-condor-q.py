@@ -1,15 +1,52 @@
 #!/bin/env python
 
-from autopyfactory_tools.lib.querylib import condorq
+from autopyfactory_tools.lib.querylib import condorq, Job, sortfields
+from autopyfactory_tools.lib import timinglib
 
 import argparse
+import sys
 
 parser = argparse.ArgumentParser(description='Prints information about the current pilots')
 parser.add_argument("-H", "--headers", help="Prints the header of each column", action="store_true")
+parser.add_argument("-c", "--constraint", help="ClassAd expression to select the jobs. It is evaluated by the schedd.", default="true")
+parser.add_argument("-S", "--stream", help="Prints each job as soon as it is received from the schedd. Output is neither sorted nor aligned.", action="store_true")
+parser.add_argument("-A", "--all-schedds", help="Queries all schedds known by the collector, concurrently", action="store_true")
+parser.add_argument("-P", "--pool", help="Queries all schedds known by the collector in this pool (host[:port]), concurrently")
+parser.add_argument("-T", "--timeout", help="Maximum time, in seconds, to wait for each schedd when querying several of them", type=float, default=60)
+parser.add_argument("-F", "--format", help="Output format. ndjson, csv and bin keep the type of the values, and are written as the ClassAds are received [text]", choices=['text', 'ndjson', 'csv', 'bin'], default='text')
+parser.add_argument("--no-align", help="Separates the fields with a tab instead of aligning them. Better when the output is processed by other programs.", action="store_true")
+parser.add_argument("--cache-ttl", help="Reuses the output of an identical query done less than this number of seconds ago, by any of the APF tools. Default is 0, no cache.", type=float, default=0)
+parser.add_argument("--cache-dir", help="Directory for the query cache")
+parser.add_argument("--delta", help="Keeps a snapshot of the queue in the cache directory, and only fetches from the schedd the jobs that changed since the previous run", action="store_true")
+parser.add_argument("--broker", help="Socket of the query broker, used when it is running")
+parser.add_argument("--no-broker", help="Queries HTCondor directly, even if the query broker is running", action="store_true")
+parser.add_argument("-s", "--sort-by", help="Comma separated list of fields to sort the jobs by. A leading - means descending order, like qdate,-enteredcurrentstatus (use --sort-by=-field when the first one is descending). Only for the text output." )
+parser.add_argument("-n", "--limit", help="Displays only the first N jobs after sorting. The others are never formatted nor stored. With the other output formats, the first N received.", type=int)
+parser.add_argument("--timing", help="Prints to stderr the wall and CPU time, number of items and bytes of each phase of the query and the output", action="store_true")
+parser.add_argument("--profile", help="Runs the query under cProfile, and writes the stats into this file")
 args = parser.parse_args()
 
+try:
+    sortfields(Job, args)
+except ValueError, ex:
+    parser.error(str(ex))
 
-cq = condorq(args)
-cq.run()
-print cq.printable()
+
+if args.timing:
+    timinglib.addhook(timinglib.report)
+
+def main():
+    cq = condorq(args)
+    if args.format != 'text':
+        cq.writerecords(args.format, sys.stdout)
+    elif args.stream:
+        cq.writestream(sys.stdout)
+    else:
+        cq.run()
+        cq.write(sys.stdout)
+    return cq
+
+cq = timinglib.profiled(args.profile, main)
+if cq.timer is not None:
+    cq.timer.finish()
 
@@ -1,17 +1,49 @@
 #!/bin/env python
 
-from autopyfactory_tools.lib.querylib import condorstatus
+from autopyfactory_tools.lib.querylib import condorstatus, Slot, sortfields
+from autopyfactory_tools.lib import timinglib
 
 import argparse
+import sys
 
 parser = argparse.ArgumentParser(description='Prints information about the condor slots')
 parser.add_argument("-H", "--headers", help="Prints the header of each column", action="store_true")
+parser.add_argument("-P", "--pool", help="Pool to query, as a comma separated list of high availability collectors. Can be used several times, all pools are queried concurrently. Default is COLLECTOR_HOST.", action="append")
+parser.add_argument("-T", "--timeout", help="Maximum time, in seconds, to wait for all pools", type=float, default=60)
+parser.add_argument("--ha-timeout", help="Maximum time, in seconds, to wait for each collector before trying the next one in the same pool", type=float, default=10)
+parser.add_argument("-F", "--format", help="Output format. ndjson, csv and bin keep the type of the values, and are written as the ClassAds are received [text]", choices=['text', 'ndjson', 'csv', 'bin'], default='text')
+parser.add_argument("--no-align", help="Separates the fields with a tab instead of aligning them. Better when the output is processed by other programs.", action="store_true")
+parser.add_argument("--cache-ttl", help="Reuses the output of an identical query done less than this number of seconds ago, by any of the APF tools. Default is 0, no cache.", type=float, default=0)
+parser.add_argument("--cache-dir", help="Directory for the query cache")
+parser.add_argument("--broker", help="Socket of the query broker, used when it is running")
+parser.add_argument("--no-broker", help="Queries HTCondor directly, even if the query broker is running", action="store_true")
+parser.add_argument("-s", "--sort-by", help="Comma separated list of fields to sort the slots by. A leading - means descending order, like state,-loadavg (use --sort-by=-field when the first one is descending). Only for the text output." )
+parser.add_argument("-n", "--limit", help="Displays only the first N slots after sorting. The others are never formatted nor stored. With the other output formats, the first N received.", type=int)
+parser.add_argument("--timing", help="Prints to stderr the wall and CPU time, number of items and bytes of each phase of the query and the output", action="store_true")
+parser.add_argument("--profile", help="Runs the query under cProfile, and writes the stats into this file")
 args = parser.parse_args()
 
+try:
+    sortfields(Slot, args)
+except ValueError, ex:
+    parser.error(str(ex))
 
 
 
-cs = condorstatus(args)
-cs.run()
-print cs.printable()
+
+if args.timing:
+    timinglib.addhook(timinglib.report)
+
+def main():
+    cs = condorstatus(args)
+    if args.format != 'text':
+        cs.writerecords(args.format, sys.stdout)
+    else:
+        cs.run()
+        cs.write(sys.stdout)
+    return cs
+
+cs = timinglib.profiled(args.profile, main)
+if cs.timer is not None:
+    cs.timer.finish()
 
@@ -0,0 +1,259 @@
+#!/bin/env python
+
+"""
+What-if evaluation of the isfull thresholds of apf-calc-isfull,
+replaying recorded condor_q snapshots.
+
+Snapshots are recorded, for example from cron, with
+
+    apf-condor-q -F bin > /var/tmp/snapshots/$(date +%s).bin
+
+(-F ndjson works too, but it is bigger and slower to read).
+The query cache files from --cache-ttl are also valid snapshots.
+
+For every snapshot, the age of the oldest idle job and of the newest
+running job of each queue are calculated, and isfull is decided for
+every pair of thresholds at once, with numpy:
+
+    full = oldest idle age > idle threshold
+           and not newest running age < running threshold
+
+Results, for each pair of thresholds:
+
+    flips:           number of times a queue changed between full and not full
+    detections:      number of times a queue became full
+    time to detect:  how long the queue had been stuck -with idle jobs,
+                     and no job started- when it became full, on average
+    full:            fraction of the queue snapshots that were full
+"""
+
+import argparse
+import array
+import json
+import os
+import sys
+
+from autopyfactory_tools.lib import cachelib
+
+
+def snapshottime(path):
+    """
+    time of a snapshot, from its header, without reading the jobs
+    """
+    if path.endswith('.ndjson') or path.endswith('.json'):
+        return os.stat(path).st_mtime
+    f = open(path, 'rb')
+    try:
+        return cachelib.readheader(f)[0]
+    finally:
+        f.close()
+
+
+def readsnapshot(path):
+    """
+    returns (time, queues, jobstatus, enteredcurrentstatus) of a snapshot,
+    the last three as lists with one item per job
+    """
+    queues = []
+    jobstatus = array.array('i')
+    entered = array.array('d')
+
+    f = open(path, 'rb')
+    try:
+        if path.endswith('.ndjson') or path.endswith('.json'):
+            t = os.fstat(f.fileno()).st_mtime
+            classads = (json.loads(line) for line in f if line.strip())
+        else:
+            t, attributes = cachelib.readheader(f)
+            classads = cachelib.readstream(f, attributes)
+
+        names = None
+        for classad in classads:
+            if names is None:
+                # attribute names are case insensitive
+                names = dict([(attr.lower(), attr) for attr in classad.keys()])
+            try:
+                status = int(classad[names['jobstatus']])
+                if status != 1 and status != 2:
+                    continue
+                queue = classad[names['match_apf_queue']]
+                ecs = float(classad[names['enteredcurrentstatus']])
+            except (KeyError, TypeError, ValueError):
+                continue
+            queues.append(queue)
+            jobstatus.append(status)
+            entered.append(ecs)
+    finally:
+        f.close()
+    return t, queues, jobstatus, entered
+
+
+class Evaluation(object):
+
+    def __init__(self, idlethresholds, runningthresholds):
+
+        self.idle = numpy.array(idlethresholds, dtype=float)
+        self.running = numpy.array(runningthresholds, dtype=float)
+        self.shape = (len(self.idle), len(self.running))
+
+        # queue name -> row in the arrays
+        self.index = {}
+        self.previous = self._zeros(bool)
+        self.seen = numpy.zeros(0, dtype=bool)
+        self.flips = self._zeros(int)
+        self.detections = self._zeros(int)
+        self.delay = self._zeros(float)
+        self.fulls = self._zeros(int)
+        self.samples = numpy.zeros(0, dtype=int)
+        self.nsnapshots = 0
+
+
+    def add(self, t, queues, jobstatus, entered):
+        """
+        processes one snapshot
+        """
+        setdefault = self.index.setdefault
+        codes = numpy.array([setdefault(queue, len(self.index)) for queue in queues], dtype=int)
+        self._grow(len(self.index))
+        nqueues = len(self.index)
+
+        jobstatus = numpy.frombuffer(jobstatus, dtype=numpy.int32) if len(jobstatus) else numpy.zeros(0, dtype=int)
+        entered = numpy.frombuffer(entered, dtype=float) if len(entered) else numpy.zeros(0)
+        idle = jobstatus == 1
+        running = jobstatus == 2
+
+        oldestidle = numpy.full(nqueues, numpy.inf)
+        numpy.minimum.at(oldestidle, codes[idle], entered[idle])
+        newestrunning = numpy.full(nqueues, -numpy.inf)
+        numpy.maximum.at(newestrunning, codes[running], entered[running])
+        # -inf when there are no idle jobs, +inf when there are no running jobs
+        idleage = t - oldestidle
+        runningage = t - newestrunning
+        # how long the queue has had idle jobs, without starting any
+        stuck = numpy.maximum(numpy.minimum(idleage, runningage), 0)
+
+        full = (idleage[:, None, None] > self.idle[None, :, None]) & \
+               ~(runningage[:, None, None] < self.running[None, None, :])
+
+        present = numpy.bincount(codes, minlength=nqueues) > 0
+        seen = self.seen[:, None, None]
+        self.flips += (full != self.previous) & seen
+        became = full & ~self.previous & seen
+        self.detections += became
+        self.delay += became * stuck[:, None, None]
+        self.fulls += full
+        self.samples += present
+
+        self.previous = full
+        self.seen[:] = True
+        self.nsnapshots += 1
+
+
+    def summary(self):
+        """
+        list of (idle threshold, running threshold, flips, detections,
+                 mean time to detect, fraction of full samples)
+        """
+        out = []
+        samples = max(self.samples.sum(), 1)
+        for i, idle in enumerate(self.idle):
+            for r, running in enumerate(self.running):
+                detections = self.detections[:, i, r].sum()
+                delay = detections and self.delay[:, i, r].sum() / detections or 0.0
+                out.append((idle, running,
+                            self.flips[:, i, r].sum(), detections, delay,
+                            float(self.fulls[:, i, r].sum()) / samples))
+        return out
+
+
+    def perqueue(self):
+        """
+        generator of (queue, idle threshold, running threshold, flips,
+                      detections, mean time to detect, fraction of full samples)
+        """
+        for queue in sorted(self.index.keys()):
+            q = self.index[queue]
+            samples = max(self.samples[q], 1)
+            for i, idle in enumerate(self.idle):
+                for r, running in enumerate(self.running):
+                    detections = self.detections[q, i, r]
+                    delay = detections and self.delay[q, i, r] / detections or 0.0
+                    yield (queue, idle, running,
+                           self.flips[q, i, r], detections, delay,
+                           float(self.fulls[q, i, r]) / samples)
+
+
+    def _zeros(self, dtype, nqueues=0):
+        return numpy.zeros((nqueues,) + self.shape, dtype=dtype)
+
+
+    def _grow(self, nqueues):
+        """
+        adds rows for the queues seen for the first time
+        """
+        n = nqueues - len(self.seen)
+        if n <= 0:
+            return
+        self.previous = numpy.concatenate([self.previous, self._zeros(bool, n)])
+        self.flips = numpy.concatenate([self.flips, self._zeros(int, n)])
+        self.detections = numpy.concatenate([self.detections, self._zeros(int, n)])
+        self.delay = numpy.concatenate([self.delay, self._zeros(float, n)])
+        self.fulls = numpy.concatenate([self.fulls, self._zeros(int, n)])
+        self.seen = numpy.concatenate([self.seen, numpy.zeros(n, dtype=bool)])
+        self.samples = numpy.concatenate([self.samples, numpy.zeros(n, dtype=int)])
+
+
+def thresholds(value):
+    return [float(x) for x in value.split(',') if x.strip()]
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Evaluates the isfull thresholds of apf-calc-isfull over recorded condor_q snapshots')
+    parser.add_argument("snapshots", help="Directory with the snapshots, recorded with apf-condor-q -F bin (or -F ndjson, with extension .ndjson)")
+    parser.add_argument("-i", "--idle-thresholds", help="Comma separated list of idle thresholds, in seconds [120,240,360,600,900,1800]", default='120,240,360,600,900,1800')
+    parser.add_argument("-r", "--running-thresholds", help="Comma separated list of running thresholds, in seconds [30,60,120,300,600]", default='30,60,120,300,600')
+    parser.add_argument("-q", "--per-queue", help="Writes the results for each queue and pair of thresholds into this CSV file")
+    args = parser.parse_args()
+
+    try:
+        import numpy
+    except ImportError:
+        sys.stderr.write('apf-isfull-whatif needs numpy. Install the python-numpy (or numpy) package\n')
+        sys.exit(1)
+
+    # the snapshots are sorted by the time in their headers,
+    # then read and evaluated one by one, so only one is in memory
+    paths = []
+    for name in os.listdir(args.snapshots):
+        if name.startswith('.'):
+            continue
+        path = os.path.join(args.snapshots, name)
+        try:
+            paths.append((snapshottime(path), path))
+        except (IOError, OSError), ex:
+            sys.stderr.write('ignoring %s: %s\n' %(path, ex))
+    paths.sort()
+
+    evaluation = Evaluation(thresholds(args.idle_thresholds), thresholds(args.running_thresholds))
+    for t, path in paths:
+        try:
+            snapshot = readsnapshot(path)
+        except IOError, ex:
+            sys.stderr.write('ignoring %s: %s\n' %(path, ex))
+            continue
+        evaluation.add(*snapshot)
+
+    print('%d snapshots, %d queues' %(evaluation.nsnapshots, len(evaluation.index)))
+    print('%8s %8s %8s %11s %15s %8s' %('idle', 'running', 'flips', 'detections', 'time to detect', 'full'))
+    for idle, running, flips, detections, delay, full in evaluation.summary():
+        # the current thresholds of apf-calc-isfull
+        mark = (idle, running) == (360, 120) and '*' or ''
+        print('%8d %8d %8d %11d %15d %7.1f%% %s' %(idle, running, flips, detections, delay, full * 100, mark))
+
+    if args.per_queue:
+        f = open(args.per_queue, 'w')
+        f.write('queue,idle,running,flips,detections,time_to_detect,full\n')
+        for queue, idle, running, flips, detections, delay, full in evaluation.perqueue():
+            f.write('%s,%d,%d,%d,%d,%d,%.4f\n' %(queue, idle, running, flips, detections, delay, full))
+        f.close()
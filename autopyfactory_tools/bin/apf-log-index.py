@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+"""
+Builds and queries an index of the error messages in the pilot logs,
+to know which queues, dates and jobs had a given error
+without searching the whole tree of logs.
+
+The messages are indexed by their signature: the line with the numbers,
+hostnames, paths and job ids masked, so
+
+    2013-06-07 10:04:42 job 57368.0 FAILED on wn042.example.com
+
+is indexed as
+
+    <N>-<N>-<N> <N>:<N>:<N> job <JOB> FAILED on <HOST>
+
+Examples:
+
+    # update the index, for example from cron
+    apf-log-index -i /var/lib/apf/apf-log-index.db -b /home/apf/factory/logs
+
+    # which queues started failing with "stage-in failed" this week
+    apf-log-index -i /var/lib/apf/apf-log-index.db -q "stage-in failed" --since 7
+
+    # most frequent errors of a queue
+    apf-log-index -i /var/lib/apf/apf-log-index.db --signatures --queue BNL_CLOUD-sl6
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from autopyfactory_tools.lib import logindexlib, logslib
+
+
+INDEXFILE = '/var/lib/apf/apf-log-index.db'
+
+
+def sincedate(value):
+    """
+    a date YYYY-MM-DD, or a number of days ago
+    """
+    if value is None or logslib.DATE_RE.match(value):
+        return value
+    return time.strftime('%Y-%m-%d', time.localtime(time.time() - float(value) * 24*3600))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Builds and queries an index of the error messages in the pilot logs')
+    parser.add_argument("-i", "--index", help="SQLite file with the index [%s]" %INDEXFILE, default=INDEXFILE)
+    parser.add_argument("-b", "--basedir", help="Directory with the logs [/home/apf/factory/logs]", default='/home/apf/factory/logs')
+    parser.add_argument("-u", "--update", help="Updates the index before the query. Default when there is no query", action="store_true")
+    parser.add_argument("-q", "--query", help="Prints the queues with errors including this text, with the number of errors and the first and last date")
+    parser.add_argument("--signatures", help="Prints the signatures, with the number of errors and queues, instead of the queues", action="store_true")
+    parser.add_argument("--postings", help="Prints every error, as path:offset signature, instead of the queues", action="store_true")
+    parser.add_argument("--since", help="Only errors in the logs of this date (YYYY-MM-DD) or this number of days ago, or later")
+    parser.add_argument("--queue", help="Only errors of this queue")
+    parser.add_argument("--pattern", help="Regular expression of the lines indexed. Only used when the index is created [%s]" %logindexlib.PATTERN, default=logindexlib.PATTERN)
+    parser.add_argument("--max-job-days", help="Maximum number of days a pilot runs, writing its logs [%s]" %logslib.MAXJOBDAYS, type=float, default=logslib.MAXJOBDAYS)
+    parser.add_argument("--nice", help="Increment of the niceness of the process when updating [10]", type=int, default=10)
+    parser.add_argument("--max-workers", help="Number of files read at the same time when updating [4]", type=int, default=4)
+    parser.add_argument("--max-rate", help="Maximum bytes read per second when updating, 0 is no limit [0]", type=float, default=0)
+    args = parser.parse_args()
+
+    query = args.query or args.signatures or args.postings
+    index = logindexlib.LogIndex(args.index, args.pattern)
+    try:
+        if args.update or not query:
+            budget = logslib.Budget(args.nice, args.max_workers, args.max_rate)
+            budget.apply()
+            tree = logslib.LogTree(args.basedir, maxjobdays=args.max_job_days)
+            start = time.time()
+            n = index.update(tree, budget)
+            sys.stderr.write('%d new errors indexed in %.1f seconds\n' %(n, time.time() - start))
+
+        since = sincedate(args.since)
+        if args.postings:
+            for queue, date, job, suffix, offset, signature in index.postings(args.query, since, args.queue):
+                path = os.path.join(args.basedir, date, queue, '%s.%s' %(job, suffix))
+                print('%s:%d %s' %(path, offset, signature))
+        elif args.signatures:
+            print('%8s %7s %-10s %-10s %s' %('errors', 'queues', 'first', 'last', 'signature'))
+            for signature, n, nqueues, first, last in index.signatures(args.query, since, args.queue):
+                print('%8d %7d %-10s %-10s %s' %(n, nqueues, first, last, signature))
+        elif args.query:
+            print('%-40s %8s %-10s %-10s' %('queue', 'errors', 'first', 'last'))
+            for queue, n, first, last in index.queues(args.query, since, args.queue):
+                print('%-40s %8d %-10s %-10s' %(queue, n, first, last))
+    finally:
+        index.close()
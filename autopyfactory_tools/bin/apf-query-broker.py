@@ -0,0 +1,34 @@
+#!/bin/env python
+
+import argparse
+import logging
+import sys
+import threading
+
+from autopyfactory_tools.lib.brokerlib import QueryBroker, BrokerServer, default_socket
+
+
+parser = argparse.ArgumentParser(description='Daemon performing the HTCondor queries on behalf of apf-condor-q, apf-condor-status and apf-queue-status')
+parser.add_argument("-s", "--socket", help="Path of the Unix domain socket to listen on [%s]" %default_socket(), default=default_socket())
+parser.add_argument("-i", "--interval", help="Seconds between refreshes of each query [60]", type=float, default=60)
+parser.add_argument("-e", "--expire", help="Queries not requested during this number of seconds are not refreshed anymore [600]", type=float, default=600)
+parser.add_argument("-d", "--debug", help="Prints debug messages", action="store_true")
+args = parser.parse_args()
+
+if args.debug:
+    logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+else:
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+
+broker = QueryBroker(args.interval, args.expire)
+server = BrokerServer(args.socket, broker)
+
+t = threading.Thread(target=broker.run)
+t.daemon = True
+t.start()
+
+logging.getLogger().info('listening on %s' %args.socket)
+try:
+    server.serve_forever()
+finally:
+    server.server_close()
@@ -0,0 +1,218 @@
+#!/bin/env python
+
+"""
+Benchmark of the querylib pipeline: condorq, condorstatus and queuestatus,
+with synthetic ClassAds from synthlib, so it runs without HTCondor.
+
+Each phase of CondorQuery.run( ), plus the output, is timed separately.
+The synthetic ClassAds are generated while _store( ) consumes them,
+as they are received from HTCondor, so no list of them is kept in memory.
+Their generation ('query') and _clean( ) are timed with a timinglib.Timer,
+and subtracted from the _store( ) phase.
+Every tool and scale runs in its own child process, so the peak RSS
+reported is the one of that run only.
+
+Results are written as JSON, to be compared with the ones
+from other releases with --compare.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import traceback
+
+from autopyfactory_tools.lib import querylib, synthlib, timinglib
+
+
+def options():
+    """
+    options for the query classes
+    """
+    return argparse.Namespace(headers=False,
+                              longest=True,
+                              new=True,
+                              no_broker=True,
+                              format='text')
+
+
+class Phases(object):
+    """
+    accumulates wall time, CPU time and peak RSS for each phase
+    """
+
+    def __init__(self):
+        self.results = []
+
+    def run(self, name, function, *args):
+        t0 = time.time()
+        c0 = sum(os.times()[:2])
+        out = function(*args)
+        c1 = sum(os.times()[:2])
+        t1 = time.time()
+        # ru_maxrss is in KB on Linux
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+        self.results.append({'phase'       : name,
+                             'wall'        : round(t1 - t0, 4),
+                             'cpu'         : round(c1 - c0, 4),
+                             'peak_rss_mb' : round(rss, 1)})
+        return out
+
+
+    def split(self, timer):
+        """
+        reports the phases of timer, nested in the last phase,
+        as separate phases, subtracting their times from it
+        """
+        last = self.results.pop()
+        for record in timer.records():
+            last['wall'] -= record['wall']
+            last['cpu'] -= record['cpu']
+            self.results.append({'phase'       : record['phase'],
+                                 'wall'        : round(record['wall'], 4),
+                                 'cpu'         : round(record['cpu'], 4),
+                                 'peak_rss_mb' : last['peak_rss_mb']})
+        last['wall'] = round(last['wall'], 4)
+        last['cpu'] = round(last['cpu'], 4)
+        self.results.append(last)
+
+
+def timed(q):
+    """
+    gives the query a Timer that times each call to _clean( )
+    """
+    q.timer = timinglib.Timer(q.__class__.__name__)
+    q._clean = q.timer.function('_clean', q._clean)
+    return q.timer
+
+
+def bench_condorq(n, devnull):
+    phases = Phases()
+    q = querylib.condorq(options())
+    timer = timed(q)
+    q.out = timer.wrap('query', synthlib.jobs(n))
+    phases.run('_store', q._store)
+    phases.split(timer)
+    phases.run('_sort', q._sort)
+    phases.run('write', q.write, devnull)
+    return phases.results
+
+
+def bench_condorstatus(n, devnull):
+    phases = Phases()
+    q = querylib.condorstatus(options())
+    timer = timed(q)
+    q.out = timer.wrap('query', synthlib.slots(n))
+    phases.run('_store', q._store)
+    phases.split(timer)
+    phases.run('_sort', q._sort)
+    phases.run('write', q.write, devnull)
+    return phases.results
+
+
+def bench_queuestatus(n, devnull):
+    phases = Phases()
+    q = querylib.queuestatus(options())
+    timer = timinglib.Timer('queuestatus')
+    phases.run('_aggregateinfo', q._aggregateinfo, timer.wrap('query', synthlib.jobs(n)))
+    phases.split(timer)
+    phases.run('_store', q._store)
+    phases.run('_sort', q._sort)
+    phases.run('write', q.write, devnull)
+    return phases.results
+
+
+BENCHMARKS = {'condorq'      : bench_condorq,
+              'condorstatus' : bench_condorstatus,
+              'queuestatus'  : bench_queuestatus}
+
+
+def runchild(tool, n):
+    """
+    runs one benchmark in a child process, and returns its results
+    """
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        devnull = open(os.devnull, 'w')
+        try:
+            results = BENCHMARKS[tool](n, devnull)
+            os.write(w, json.dumps(results))
+        except BaseException:
+            traceback.print_exc()
+            sys.stderr.flush()
+            os._exit(1)
+        os._exit(0)
+    os.close(w)
+    data = ''
+    while True:
+        chunk = os.read(r, 65536)
+        if not chunk:
+            break
+        data += chunk
+    os.close(r)
+    os.waitpid(pid, 0)
+    if not data:
+        raise Exception('benchmark %s with %d ClassAds failed' %(tool, n))
+    return json.loads(data)
+
+
+def compare(results, oldfile):
+    """
+    prints the ratio between the wall times of results
+    and the ones in a previous results file
+    """
+    old = json.load(open(oldfile))
+    oldtimes = {}
+    for run in old['runs']:
+        for phase in run['phases']:
+            oldtimes[(run['tool'], run['n'], phase['phase'])] = phase['wall']
+    print('')
+    print('compared with %s (%s):' %(oldfile, old.get('label')))
+    for run in results['runs']:
+        for phase in run['phases']:
+            key = (run['tool'], run['n'], phase['phase'])
+            if key in oldtimes and oldtimes[key] > 0:
+                print('%-14s %8d  %-16s x%.2f' %(key[0], key[1], key[2], phase['wall'] / oldtimes[key]))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark of the querylib pipeline with synthetic ClassAds')
+    parser.add_argument("-s", "--scales", help="Comma separated list of numbers of ClassAds [1000,10000,100000,1000000]", default='1000,10000,100000,1000000')
+    parser.add_argument("-t", "--tools", help="Comma separated list of tools to benchmark [%s]" %','.join(sorted(BENCHMARKS)), default=','.join(sorted(BENCHMARKS)))
+    parser.add_argument("-o", "--output", help="JSON file for the results [apf-querylib-bench-<time>.json]")
+    parser.add_argument("-l", "--label", help="Label stored with the results, for example the release")
+    parser.add_argument("-c", "--compare", help="Previous results file to compare with")
+    args = parser.parse_args()
+
+    scales = [int(n) for n in args.scales.split(',')]
+    tools = args.tools.split(',')
+
+    results = {'label'    : args.label,
+               'date'     : time.strftime('%Y-%m-%d %H:%M:%S'),
+               'host'     : platform.node(),
+               'python'   : platform.python_version(),
+               'runs'     : []}
+
+    print('%-14s %8s  %-16s %9s %9s %12s' %('tool', 'n', 'phase', 'wall(s)', 'cpu(s)', 'peakrss(MB)'))
+    for tool in tools:
+        for n in scales:
+            phases = runchild(tool, n)
+            results['runs'].append({'tool': tool, 'n': n, 'phases': phases})
+            for phase in phases:
+                print('%-14s %8d  %-16s %9.3f %9.3f %12.1f' %(tool, n, phase['phase'], phase['wall'], phase['cpu'], phase['peak_rss_mb']))
+            sys.stdout.flush()
+
+    output = args.output or 'apf-querylib-bench-%s.json' %time.strftime('%Y%m%d-%H%M%S')
+    f = open(output, 'w')
+    json.dump(results, f, indent=2)
+    f.close()
+    print('results written to %s' %output)
+
+    if args.compare:
+        compare(results, args.compare)
@@ -1,7 +1,9 @@
 #!/bin/env python
 
 import argparse
-from autopyfactory_tools.lib.querylib import queuestatus
+import sys
+from autopyfactory_tools.lib.querylib import queuestatus, Queue, sortfields
+from autopyfactory_tools.lib import timinglib
 
 
 
@@ -9,13 +11,52 @@ parser = argparse.ArgumentParser(description='Prints aggregated status info queu
 parser.add_argument("-N", "--new", help="Makes the output to be displayed in new format", action="store_true")
 parser.add_argument("-H", "--headers", help="Prints the header of each column. Triggers the new output format.", action="store_true")
 parser.add_argument("-L", "--longest", help="Prints two additional columns with the longest waiting and running times. Triggers the new output format.", action="store_true")
+parser.add_argument("-A", "--all-schedds", help="Queries all schedds known by the collector, concurrently", action="store_true")
+parser.add_argument("-P", "--pool", help="Queries all schedds known by the collector in this pool (host[:port]), concurrently")
+parser.add_argument("-T", "--timeout", help="Maximum time, in seconds, to wait for each schedd when querying several of them", type=float, default=60)
+parser.add_argument("--from-logs", help="Calculates the status from the job event logs in this directory (the APF logs directory), without querying the schedd")
+parser.add_argument("--logs-state", help="File to keep the status of the jobs between runs when using --from-logs")
+parser.add_argument("-F", "--format", help="Output format. ndjson, csv and bin keep the type of the values, and are written as the ClassAds are received [text]", choices=['text', 'ndjson', 'csv', 'bin'], default='text')
+parser.add_argument("--no-align", help="Separates the fields with a tab instead of aligning them. Better when the output is processed by other programs.", action="store_true")
+parser.add_argument("--cache-ttl", help="Reuses the output of an identical query done less than this number of seconds ago, by any of the APF tools. Default is 0, no cache.", type=float, default=0)
+parser.add_argument("--cache-dir", help="Directory for the query cache")
+parser.add_argument("-E", "--exporter", help="Serves the status as Prometheus metrics on [host:]port, instead of printing it once")
+parser.add_argument("-I", "--interval", help="Seconds between refreshes of the status in --exporter mode [60]", type=float, default=60)
+parser.add_argument("--broker", help="Socket of the query broker, used when it is running")
+parser.add_argument("--no-broker", help="Queries HTCondor directly, even if the query broker is running", action="store_true")
+parser.add_argument("--sort-by", help="Comma separated list of fields to sort the queues by. A leading - means descending order, like --sort-by=-idle,qname. By default, by name." )
+parser.add_argument("--limit", help="Displays only the first N queues after sorting. The others are never formatted nor stored.", type=int)
+parser.add_argument("--timing", help="Prints to stderr the wall and CPU time, number of items and bytes of each phase of the query and the output", action="store_true")
+parser.add_argument("--profile", help="Runs the query under cProfile, and writes the stats into this file")
 args = parser.parse_args()
 
 if args.headers or args.longest:
     args.__dict__['new'] = True
 
+try:
+    sortfields(Queue, args)
+except ValueError, ex:
+    parser.error(str(ex))
+
+
+if args.exporter:
+    from autopyfactory_tools.lib import metricslib
+    metricslib.serve(args, args.exporter, args.interval)
+
+if args.timing:
+    timinglib.addhook(timinglib.report)
+
+def main():
+    qs = queuestatus(args)
+    if args.format != 'text':
+        qs.writerecords(args.format, sys.stdout)
+    else:
+        qs.run()
+        qs.write(sys.stdout)
+    return qs
+
+qs = timinglib.profiled(args.profile, main)
+if qs.timer is not None:
+    qs.timer.finish()
 
-qs = queuestatus(args)
-qs.run()
-print qs.printable()
 
@@ -3,16 +3,19 @@
 import commands
 import getopt
 import os
-import re
 import sys
 
+from autopyfactory_tools.lib import logslib
+
 
 # DEFAULTS
 BASEDIR = '/home/autopyfactory/factory/logs'
 NEWDIR = '/tmp/apf-reverse-logstree'
+# the queues of the old dates are kept in this file, so they are not listed again
+INDEXFILE = None
 
 try:
-    opts, args = getopt.getopt(sys.argv[1:], "", ["basedir=", "newdir="])
+    opts, args = getopt.getopt(sys.argv[1:], "", ["basedir=", "newdir=", "index="])
 except getopt.GetoptError, err:
     print str(err)
 
@@ -21,6 +24,8 @@ for k,v in opts:
         BASEDIR=v 
     if k == "--newdir":
         NEWDIR=v 
+    if k == "--index":
+        INDEXFILE=v 
 
 # remove directory is already exists
 cmd = 'rm -rf %s' %NEWDIR
@@ -34,15 +39,15 @@ class QUEUE(object):
 
 LIST_QUEUES = {}
 
-RE = re.compile(r"(\d{4})-(\d{2})-(\d{2})?$")
+TREE = logslib.LogTree(BASEDIR, INDEXFILE)
+
+for DATE in TREE.dates():
+    for queue in TREE.queues(DATE):
+        if queue not in LIST_QUEUES:
+            LIST_QUEUES[queue] = QUEUE(queue)
+        LIST_QUEUES[queue].dates.append(DATE)
 
-for i in os.listdir(BASEDIR):
-    if RE.match(i):
-        DATE = i
-        for queue in os.listdir('%s/%s' %(BASEDIR,DATE)):
-            if queue not in LIST_QUEUES.keys():
-                LIST_QUEUES[queue] = QUEUE(queue)
-            LIST_QUEUES[queue].dates.append(DATE)
+TREE.save()
 
 for q,Q in LIST_QUEUES.iteritems():
     cmd = 'mkdir -p %s/%s' %(NEWDIR, q) 
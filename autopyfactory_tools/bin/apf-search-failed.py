@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+
+"""
+This tool searches for a given pattern in condor logs files.
+The pattern is supposed to be a meaningful error string, typically "FAILED".
+All lines including the searching string will be displayed.
+The output can be in simple ASCII or a nice HTML format.
+The configuration is read from config file /etc/apf/apf-search-failed.conf,
+and can be overridden by the command line options.
+
+The files are scanned in process, by a fixed number of threads,
+with a limit on the bytes scanned per second, and a lower priority,
+so the search does not compete with the factory on the same host.
+
+With a state file, each run only scans the bytes appended to the files
+since the previous run, and the matches found before are kept in it.
+
+Only the date and queue directories where a pilot could have written
+in the last NHOURS are searched.
+
+When there is an index of apf-log-index, and STRING is exactly one of
+the words of its pattern, like Traceback, or one of its signatures,
+the index is updated, and the lines are found with it.
+For any other STRING the files are scanned.
+
+With --summary, instead of every line, the report has, for each queue,
+the most frequent messages -with numbers, hostnames, paths... masked-,
+their number, and a few examples. The counts are kept with bounded memory,
+so the report stays small when a site fails for every job.
+"""
+
+import argparse
+import cgi
+import os
+import time
+
+from ConfigParser import SafeConfigParser
+
+from autopyfactory_tools.lib import logindexlib, logslib
+
+
+CONFFILE = '/etc/apf/apf-search-failed.conf'
+
+DEFAULTS = {'STRING'     : 'FAILED',
+            'FORMAT'     : 'html',
+            'NHOURS'     : '1',
+            'BASEDIR'    : '/home/apf/factory/logs',
+            'NICE'       : '10',
+            'MAXWORKERS' : '4',
+            'MAXRATE'    : '0',
+            'STATEFILE'  : '',
+            'INDEXFILE'  : '',
+            'MAXJOBDAYS' : str(logslib.MAXJOBDAYS),
+            'LOGINDEX'   : '',
+            'SUMMARY'    : 'no',
+            'TOPN'       : '10'}
+
+
+def readconf(path):
+    config = SafeConfigParser(DEFAULTS)
+    if os.path.exists(path):
+        config.readfp(open(path))
+    if not config.has_section('CONFIG'):
+        config.add_section('CONFIG')
+    return config
+
+
+def links(filename):
+    """
+    links to the stdout, stderr and event log of a job
+    """
+    link = '/' + '/'.join( filename.split('/')[-3:] )
+    linkerr = link[:-3]+"err"
+    linklog = link[:-3]+"log"
+    return link, linkerr, linklog
+
+
+def printhtml(lines_d):
+
+    print ('<body style="font-size:small">')
+
+    apfqueues = lines_d.keys()
+    apfqueues.sort()
+
+    for apfqueue in apfqueues:
+        print('<a href="#%s">%s</a><br>' %(apfqueue, apfqueue))
+    print('<br>')
+
+    for apfqueue in apfqueues:
+        print ('<table border="2" frame="hsides" rules="groups" style="font-size:small" width="100%">')
+        print('<tr><td bgcolor="#99FFFF">')
+        print('<a name="%s">%s</a>' %(apfqueue, apfqueue))
+        print('<TBODY>')
+        for filename, msg in lines_d[apfqueue]:
+
+            print('<tr><td>')
+            link, linkerr, linklog = links(filename)
+            print('<a href="%s">%s</a> (<a href="%s">err</a>, <a href="%s">log</a>) %s' %(link, filename, linkerr, linklog, msg))
+
+        print('</table>')
+        print('<br>')
+
+    print ('</body>')
+
+
+def printascii(dirs_d):
+
+    for dir in sorted(dirs_d.keys()):
+        print(dir)
+        for filename, msg in dirs_d[dir]:
+            print('%s:%s' %(filename, msg))
+
+
+def printhtmlsummary(summaries, top):
+
+    print ('<body style="font-size:small">')
+
+    apfqueues = summaries.keys()
+    apfqueues.sort()
+
+    for apfqueue in apfqueues:
+        print('<a href="#%s">%s</a> (%d)<br>' %(apfqueue, apfqueue, summaries[apfqueue].total))
+    print('<br>')
+
+    for apfqueue in apfqueues:
+        print ('<table border="2" frame="hsides" rules="groups" style="font-size:small" width="100%">')
+        print('<tr><td bgcolor="#99FFFF" colspan="3">')
+        print('<a name="%s">%s</a> %d lines' %(apfqueue, apfqueue, summaries[apfqueue].total))
+        print('<TBODY>')
+        for signature, count, error, examples in summaries[apfqueue].top(top):
+            # the count is approximate when there is an error
+            approx = error and '~' or ''
+            print('<tr><td align="right">%s%d</td><td>%s</td><td>' %(approx, count, cgi.escape(signature)))
+            for filename in examples:
+                link, linkerr, linklog = links(filename)
+                print('<a href="%s">%s</a> (<a href="%s">err</a>, <a href="%s">log</a>)<br>' %(link, os.path.basename(filename), linkerr, linklog))
+            print('</td>')
+        print('</table>')
+        print('<br>')
+
+    print ('</body>')
+
+
+def printasciisummary(summaries, top):
+
+    for apfqueue in sorted(summaries.keys()):
+        print('%s %d' %(apfqueue, summaries[apfqueue].total))
+        for signature, count, error, examples in summaries[apfqueue].top(top):
+            approx = error and '~' or ''
+            print('%8s %s' %(approx + str(count), signature))
+            for filename in examples:
+                print('%8s %s' %('', filename))
+
+
+if __name__ == '__main__':
+
+    # the configuration file gives the defaults for the options
+    confparser = argparse.ArgumentParser(add_help=False)
+    confparser.add_argument("-c", "--conf", help="Configuration file [%s]" %CONFFILE, default=CONFFILE)
+    config = readconf(confparser.parse_known_args()[0].conf)
+
+    parser = argparse.ArgumentParser(description='Searches for a pattern in the pilots stdout files modified recently', parents=[confparser])
+    parser.add_argument("-s", "--string", help="Regular expression to search for [STRING]", default=config.get('CONFIG', 'STRING'))
+    parser.add_argument("-f", "--format", help="Output format [FORMAT]", choices=['html', 'ascii'], default=config.get('CONFIG', 'FORMAT'))
+    parser.add_argument("-n", "--nhours", help="Searches only the files modified in the last NHOURS hours [NHOURS]", type=int, default=config.getint('CONFIG', 'NHOURS'))
+    parser.add_argument("-b", "--basedir", help="Directory with the logs [BASEDIR]", default=config.get('CONFIG', 'BASEDIR'))
+    parser.add_argument("--nice", help="Increment of the niceness of the process [NICE]", type=int, default=config.getint('CONFIG', 'NICE'))
+    parser.add_argument("--max-workers", help="Number of files scanned at the same time [MAXWORKERS]", type=int, default=config.getint('CONFIG', 'MAXWORKERS'))
+    parser.add_argument("--max-rate", help="Maximum bytes scanned per second, 0 is no limit [MAXRATE]", type=float, default=config.getfloat('CONFIG', 'MAXRATE'))
+    parser.add_argument("--state", help="File to keep the offsets scanned and the matches between runs, so each run only scans the new bytes [STATEFILE]", default=config.get('CONFIG', 'STATEFILE'))
+    parser.add_argument("--index", help="File to keep the list of queues and the newest file of each one for the dates with no running jobs, so they are not listed again. It only helps when NHOURS is longer than MAXJOBDAYS [INDEXFILE]", default=config.get('CONFIG', 'INDEXFILE'))
+    parser.add_argument("--max-job-days", help="Maximum number of days a pilot runs, writing its logs. Directories with no file created in the last NHOURS plus this number of days are not searched [MAXJOBDAYS]", type=float, default=config.getfloat('CONFIG', 'MAXJOBDAYS'))
+    parser.add_argument("--log-index", help="Index of apf-log-index. When it exists, and STRING is exactly one of the words of its pattern, or one of its signatures, the index is updated and used instead of scanning the files [LOGINDEX]", default=config.get('CONFIG', 'LOGINDEX'))
+    parser.add_argument("--summary", help="Prints the most frequent messages of each queue, with examples, instead of every line [SUMMARY]", action="store_true", default=config.getboolean('CONFIG', 'SUMMARY'))
+    parser.add_argument("--top", help="Number of messages per queue in the summary [TOPN]", type=int, default=config.getint('CONFIG', 'TOPN'))
+    parser.add_argument("--examples", help="Number of examples of each message in the summary [3]", type=int, default=3)
+    parser.add_argument("--capacity", help="Number of different messages counted per queue for the summary. Counts of the messages more frequent than 1/CAPACITY of the lines are exact [100]", type=int, default=100)
+    args = parser.parse_args()
+
+    budget = logslib.Budget(args.nice, args.max_workers, args.max_rate)
+    budget.apply()
+    scanner = logslib.Scanner(args.string, budget)
+
+    since = time.time() - args.nhours * 3600
+    # path -> (date, queue)
+    files = {}
+    tree = logslib.LogTree(args.basedir, args.index, args.max_job_days)
+    for date, apfqueue, path in tree.candidates(since):
+        files[path] = (date, apfqueue)
+    tree.save()
+
+    # queue -> list of (filename, line)
+    lines_d = {}
+    # date/queue directory -> list of (filename, line)
+    dirs_d = {}
+    # queue -> HeavyHitters
+    summaries = {}
+    index = None
+    if args.log_index and os.path.exists(args.log_index):
+        index = logindexlib.LogIndex(args.log_index)
+        if index.covers(args.string):
+            index.update(logslib.LogTree(args.basedir, maxjobdays=args.max_job_days), budget)
+        else:
+            index.close()
+            index = None
+
+    if index is not None:
+        results = index.search(args.string, files)
+    elif args.state:
+        results = logslib.ScanState(args.state).scan(scanner, files.keys())
+    else:
+        results = scanner.scan(files.keys())
+    for path, matches in results:
+        date, apfqueue = files[path]
+        dir = os.path.join(args.basedir, date, apfqueue)
+        if args.summary:
+            summary = summaries.get(apfqueue)
+            if summary is None:
+                summary = summaries[apfqueue] = logslib.HeavyHitters(max(args.capacity, args.top), args.examples)
+            for offset, line in matches:
+                summary.add(logslib.normalize(line), path)
+            continue
+        for offset, line in matches:
+            lines_d.setdefault(apfqueue, []).append((path, line))
+            dirs_d.setdefault(dir, []).append((path, line))
+
+    if index is not None:
+        index.close()
+
+    for matches in lines_d.values() + dirs_d.values():
+        # same order of the lines in each file
+        matches.sort(key=lambda match: match[0])
+
+    if args.summary and args.format == "html":
+        printhtmlsummary(summaries, args.top)
+    elif args.summary:
+        printasciisummary(summaries, args.top)
+    elif args.format == "html":
+        printhtml(lines_d)
+    else:
+        printascii(dirs_d)
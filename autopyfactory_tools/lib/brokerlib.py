@@ -0,0 +1,306 @@
+#!/bin/env python
+
+"""
+Query broker for the APF tools.
+
+The broker is a long running daemon that owns the connections
+to the schedds and collectors. It performs the HTCondor queries
+on behalf of the tools, keeps the output of each one in memory,
+refreshes it periodically, and serves it through a Unix domain socket.
+
+That way the tools do not need to import htcondor nor talk
+to the schedd, and the rate of queries to the schedd does not depend
+on how many times the tools are run.
+
+Protocol: the client sends one line with a JSON request
+
+    {"daemon": "schedd",
+     "name": "local",
+     "constraint": "true",
+     "attributes": ["ClusterId", "ProcId", ...]}
+
+where daemon is one of
+
+    schedd:    query the jobs of schedd name ('local' is the local schedd),
+               located through the collector of the optional field "pool"
+    collector: query the startds of collector name ('' is the default one)
+    locate:    locate all schedds of collector name ('' is the default one)
+
+and the broker answers with the query output,
+in the same format as the snapshot files in cachelib.
+On error, the broker just closes the connection.
+That includes queries that have been failing for a while: once the last
+good output is older than the expire time, it is not served anymore.
+"""
+
+import SocketServer
+import cStringIO
+import json
+import logging
+import os
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+from autopyfactory_tools.lib import cachelib, fakehtcondor
+
+
+def default_socket():
+    # in a private directory, created by the broker
+    return os.path.join(tempfile.gettempdir(), 'apf-query-broker-%d' %os.getuid(), 'broker.sock')
+
+
+# =============================================================================
+#           CLIENT
+# =============================================================================
+
+def query(request, path=None, timeout=30):
+    """
+    sends a request to the broker.
+    Returns a list of the ClassAds, as dictionaries,
+    or None if the broker is not running or does not answer.
+
+    The answer is read with marshal, so the socket, and the directory
+    where it is, must belong to the user. Otherwise it is not used.
+    The whole answer is read before returning, so a broken one
+    is noticed here, and the caller can query HTCondor instead.
+    """
+    path = path or default_socket()
+    if not os.path.exists(path):
+        return None
+    if not cachelib.isprivate(path, checkmode=False) or not cachelib.isprivate(os.path.dirname(os.path.abspath(path))):
+        sys.stderr.write('ignoring the query broker socket %s: it or its directory is not private to uid %d\n' %(path, os.getuid()))
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall(json.dumps(request) + '\n')
+        f = sock.makefile('rb')
+        created, attributes = cachelib.readheader(f)
+        return list(cachelib.readstream(f, attributes))
+    except (socket.error, IOError, EOFError, ValueError, TypeError, struct.error):
+        # socket.timeout is a socket.error
+        return None
+    finally:
+        # the file object from makefile( ) keeps the connection open
+        sock.close()
+
+
+# =============================================================================
+#           SERVER
+# =============================================================================
+
+class Snapshot(object):
+    """
+    output of one query, already encoded to be sent to the clients
+    """
+
+    def __init__(self, request):
+
+        self.request = request
+        self.data = None
+        self.created = 0
+        # time of the last failed refresh, so HTCondor is not 
+        # queried again until the interval has passed
+        self.failed = 0
+        self.lastused = time.time()
+        # only one thread queries HTCondor for a given snapshot
+        self.lock = threading.Lock()
+
+
+class QueryBroker(object):
+
+    def __init__(self, interval=60, expire=600):
+        """
+        interval: seconds between refreshes of each query
+        expire: queries not requested during this number
+                of seconds are not refreshed anymore,
+                and output older than this is not served
+        """
+
+        self.log = logging.getLogger()
+        self.interval = interval
+        self.expire = expire
+
+        # imported here, so the clients do not need it
+        fakehtcondor.installfromenv()
+        import htcondor
+        self.htcondor = htcondor
+
+        self.snapshots = {}
+        self.lock = threading.Lock()
+        self.schedds = {}
+        self.collectors = {}
+
+
+    def get(self, request):
+        """
+        returns the encoded output of the query,
+        performing it only if there is no recent enough snapshot
+        """
+        key = json.dumps(request, sort_keys=True)
+        with self.lock:
+            snapshot = self.snapshots.get(key)
+            if snapshot is None:
+                snapshot = Snapshot(request)
+                self.snapshots[key] = snapshot
+        snapshot.lastused = time.time()
+
+        with snapshot.lock:
+            if self._due(snapshot):
+                try:
+                    self._refresh(snapshot)
+                except Exception, ex:
+                    self.log.error('refreshing query %s failed: %s' %(request, ex))
+            if snapshot.data is None or time.time() - snapshot.created > self.expire:
+                raise Exception('query %s has no output newer than %d seconds' %(request, self.expire))
+            return snapshot.data
+
+
+    def refresh(self):
+        """
+        refreshes all snapshots recently used,
+        and forgets the ones not used for a while
+        """
+        now = time.time()
+        with self.lock:
+            for key, snapshot in self.snapshots.items():
+                if now - snapshot.lastused > self.expire:
+                    self.log.info('query %s expired' %key)
+                    del self.snapshots[key]
+            snapshots = self.snapshots.values()
+
+        for snapshot in snapshots:
+            with snapshot.lock:
+                if self._due(snapshot):
+                    try:
+                        self._refresh(snapshot)
+                    except Exception, ex:
+                        self.log.error('refreshing query %s failed: %s' %(snapshot.request, ex))
+
+
+    def run(self):
+        """
+        refreshes the snapshots forever
+        """
+        while True:
+            self.refresh()
+            time.sleep(1)
+
+
+    def _due(self, snapshot):
+        """
+        True if the snapshot must be refreshed: its output is older
+        than the interval, and so is its last failed refresh, if any
+        """
+        now = time.time()
+        return now - snapshot.created >= self.interval and now - snapshot.failed >= self.interval
+
+
+    def _refresh(self, snapshot):
+
+        request = snapshot.request
+        attributes = request['attributes']
+        start = time.time()
+        out = cStringIO.StringIO()
+        cachelib.writeheader(out, attributes)
+        n = 0
+        try:
+            for classad in self._query(request):
+                cachelib.writerecord(out, attributes, classad)
+                n += 1
+        except Exception:
+            snapshot.failed = time.time()
+            raise
+        snapshot.data = out.getvalue()
+        snapshot.created = time.time()
+        self.log.debug('query %s refreshed: %d ClassAds, %d bytes, %.2f seconds' %(request,
+                                                                                   n,
+                                                                                   len(snapshot.data),
+                                                                                   snapshot.created - start))
+
+
+    def _query(self, request):
+
+        htcondor = self.htcondor
+        daemon = request['daemon']
+        name = request.get('name')
+        constraint = request.get('constraint', 'true')
+        attributes = request['attributes']
+
+        if daemon == 'schedd':
+            return self._schedd(name, request.get('pool')).xquery(constraint, attributes)
+        if daemon == 'collector':
+            return self._collector(name).query(htcondor.AdTypes.Startd, constraint, attributes)
+        if daemon == 'locate':
+            return self._collector(name).locateAll(htcondor.DaemonTypes.Schedd)
+        raise ValueError('unknown daemon %s' %daemon)
+
+
+    def _schedd(self, name, pool=None):
+        """
+        Schedd objects are created only once
+        """
+        schedd = self.schedds.get((name, pool))
+        if schedd is None:
+            if name == 'local':
+                schedd = self.htcondor.Schedd()
+            else:
+                ad = self._collector(pool).locate(self.htcondor.DaemonTypes.Schedd, name)
+                schedd = self.htcondor.Schedd(ad)
+            self.schedds[(name, pool)] = schedd
+        return schedd
+
+
+    def _collector(self, name):
+        """
+        Collector objects are created only once
+        """
+        collector = self.collectors.get(name)
+        if collector is None:
+            if name:
+                collector = self.htcondor.Collector(name)
+            else:
+                collector = self.htcondor.Collector()
+            self.collectors[name] = collector
+        return collector
+
+
+
+class BrokerHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        broker = self.server.broker
+        try:
+            request = json.loads(self.rfile.readline())
+            data = broker.get(request)
+        except Exception, ex:
+            broker.log.error('request failed: %s' %ex)
+            return
+        self.wfile.write(data)
+
+
+class BrokerServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+
+    daemon_threads = True
+
+    def __init__(self, path, broker):
+        cachelib.privatedir(os.path.dirname(os.path.abspath(path)))
+        if os.path.exists(path):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(path)
+            except socket.error:
+                # left by a previous broker
+                os.remove(path)
+            else:
+                sock.close()
+                raise Exception('there is already a broker listening on %s' %path)
+        SocketServer.UnixStreamServer.__init__(self, path, BrokerHandler)
+        os.chmod(path, 0600)
+        self.broker = broker
@@ -0,0 +1,343 @@
+#!/bin/env python
+
+"""
+On-disk cache of the output of HTCondor queries.
+
+Each query is identified by the daemon being queried,
+the constraint and the list of attributes (projection).
+Its output is stored in a snapshot file, in a compact binary format:
+
+    header:  MAGIC
+             length of the next field (4 bytes)
+             marshal( (creation time, [attr1, attr2, ...]) )
+    records: length of the next field (4 bytes)
+             marshal( (value1, value2, ...) )
+             ...
+
+with one record per ClassAd, and the values in the same order
+as the attributes in the header. Missing attributes are None.
+
+Snapshots are read through mmap, one record at a time,
+so reading them does not need to load the whole file in memory.
+
+A lock file per snapshot guarantees that, when several processes
+find the snapshot too old at the same time, only one of them
+queries HTCondor. The others wait for it, and then read the new snapshot.
+
+Snapshots of schedd queries can also be refreshed incrementally,
+with delta( ): only the jobs that changed since the previous snapshot
+are fetched from the schedd, and merged into it.
+"""
+
+import fcntl
+import hashlib
+import marshal
+import mmap
+import os
+import stat
+import struct
+import tempfile
+import time
+
+
+MAGIC = 'APFSNAP1'
+LENGTH = struct.Struct('<I')
+
+# margin, in seconds, for clock differences with the schedd,
+# and for jobs changing while they are being queried
+DELTA_MARGIN = 60
+
+# types that can be stored as they are. Anything else is converted to string
+BASIC_TYPES = (bool, int, long, float, str, unicode)
+
+
+def default_cachedir():
+    return os.path.join(tempfile.gettempdir(), 'apf-query-cache-%d' %os.getuid())
+
+
+def isprivate(path, checkmode=True):
+    """
+    True if path is owned by the user, and it is not a symlink.
+    With checkmode, it must not be writable by the group nor by others either
+    """
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    if stat.S_ISLNK(st.st_mode) or st.st_uid != os.getuid():
+        return False
+    return not (checkmode and st.st_mode & (stat.S_IWGRP | stat.S_IWOTH))
+
+
+def privatedir(path):
+    """
+    creates the directory path, with mode 0700, if it does not exist.
+    An existing one must be private, see isprivate( ).
+    Raises IOError otherwise
+    """
+    try:
+        os.makedirs(path, 0700)
+    except OSError:
+        # maybe created by another process in the meantime
+        if not os.path.isdir(path):
+            raise
+    if not os.path.isdir(path) or not isprivate(path):
+        raise IOError('%s must be a directory owned by uid %d, and not writable by the group nor by others' %(path, os.getuid()))
+
+
+class SnapshotCache(object):
+
+    def __init__(self, cachedir=None, ttl=60):
+        """
+        cachedir: directory to store the snapshots
+        ttl: maximum age, in seconds, of a snapshot to be used
+        """
+        self.cachedir = cachedir or default_cachedir()
+        self.ttl = ttl
+        # the snapshots are read with marshal, so nobody else can write them
+        privatedir(self.cachedir)
+
+
+    def path(self, source, constraint, attributes):
+        """
+        path of the snapshot file for a given query
+        """
+        key = '%s\n%s\n%s' %(source, constraint, ','.join(attributes))
+        filename = hashlib.sha1(key).hexdigest() + '.snap'
+        return os.path.join(self.cachedir, filename)
+
+
+    def get(self, source, constraint, attributes, function):
+        """
+        returns an iterator over the ClassAds of a query, as dictionaries.
+        If there is no snapshot for that query, or it is older than ttl,
+        function( ) is called to perform the actual query,
+        and its output is stored as the new snapshot.
+        """
+        path = self.path(source, constraint, attributes)
+        if self._isfresh(path):
+            return readsnapshot(path)
+
+        lockfile = open(path + '.lock', 'a')
+        try:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            # another process may have refreshed the snapshot
+            # while we were waiting for the lock
+            if not self._isfresh(path):
+                writesnapshot(path, attributes, function())
+        finally:
+            fcntl.flock(lockfile, fcntl.LOCK_UN)
+            lockfile.close()
+        return readsnapshot(path)
+
+
+    def delta(self, source, constraint, attributes, query):
+        """
+        same as get( ), for schedd queries, but the snapshot is 
+        refreshed incrementally. Only when there is no previous
+        snapshot, all jobs are fetched.
+
+        query(constraint, attributes) performs the actual query.
+        attributes must include ClusterId and ProcId.
+
+        Two queries are done on each refresh:
+          - one with only ClusterId and ProcId, for all jobs,
+            to know which ones have left the queue.
+          - one with all attributes, only for the jobs that changed
+            status, or were submitted, since the previous snapshot.
+        """
+        path = self.path('delta ' + source, constraint, attributes)
+        if self._isfresh(path):
+            return readsnapshot(path)
+
+        lockfile = open(path + '.lock', 'a')
+        try:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            if not self._isfresh(path):
+                self._refreshdelta(path, constraint, attributes, query)
+        finally:
+            fcntl.flock(lockfile, fcntl.LOCK_UN)
+            lockfile.close()
+        return readsnapshot(path)
+
+
+    def _refreshdelta(self, path, constraint, attributes, query):
+
+        start = time.time()
+        try:
+            f = open(path, 'rb')
+            try:
+                previous, attrs = readheader(f)
+            finally:
+                f.close()
+        except (IOError, EOFError, ValueError):
+            previous = None
+
+        if previous is None:
+            writesnapshot(path, attributes, query(constraint, attributes), start)
+            return
+
+        ids = set()
+        for classad in query(constraint, ['ClusterId', 'ProcId']):
+            ids.add((classad['ClusterId'], classad['ProcId']))
+
+        since = int(previous) - DELTA_MARGIN
+        changed_constraint = '(%s) && (EnteredCurrentStatus >= %d || QDate >= %d)' %(constraint, since, since)
+        changed = {}
+        for classad in query(changed_constraint, attributes):
+            key = (classad['ClusterId'], classad['ProcId'])
+            changed[key] = classad
+            ids.add(key)
+
+        def merged():
+            # jobs in the previous snapshot, still in the queue
+            for classad in readsnapshot(path):
+                key = (classad['ClusterId'], classad['ProcId'])
+                if key in changed or key not in ids:
+                    continue
+                ids.discard(key)
+                yield classad
+            # jobs that changed, or are new
+            for key, classad in changed.iteritems():
+                ids.discard(key)
+                yield classad
+
+        writesnapshot(path, attributes, merged(), start)
+        if ids:
+            # jobs that should have been in one of the queries, 
+            # but were not. Everything is fetched again.
+            writesnapshot(path, attributes, query(constraint, attributes), start)
+
+
+    def _isfresh(self, path):
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return False
+        return time.time() - mtime < self.ttl
+
+
+
+def writesnapshot(path, attributes, classads, created=None):
+    """
+    writes the ClassAds into a new snapshot file.
+    The file is written with a temporary name and then renamed,
+    so readers never see a partial snapshot.
+    """
+    dirname = os.path.dirname(path)
+    fd, tmppath = tempfile.mkstemp(dir=dirname, prefix='.snap')
+    try:
+        f = os.fdopen(fd, 'wb')
+        try:
+            writeheader(f, attributes, created)
+            for classad in classads:
+                writerecord(f, attributes, classad)
+        finally:
+            f.close()
+        os.rename(tmppath, path)
+    except:
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+        raise
+
+
+def writeheader(f, attributes, created=None):
+    if created is None:
+        created = time.time()
+    f.write(MAGIC)
+    data = marshal.dumps((created, list(attributes)))
+    f.write(LENGTH.pack(len(data)))
+    f.write(data)
+
+
+def writerecord(f, attributes, classad):
+    values = [typedvalue(classad.get(attr)) for attr in attributes]
+    writevalues(f, values)
+
+
+def writevalues(f, values):
+    data = marshal.dumps(tuple(values))
+    f.write(LENGTH.pack(len(data)))
+    f.write(data)
+
+
+def typedvalue(value):
+    """
+    value of a ClassAd attribute as one of the BASIC_TYPES, or None.
+    ClassAd expressions, for example, are converted to string
+    """
+    if value is not None and not isinstance(value, BASIC_TYPES):
+        return str(value)
+    return value
+
+
+def readheader(f):
+    """
+    returns (creation time, attributes) from the header of a snapshot,
+    read from a file object
+    """
+    if f.read(len(MAGIC)) != MAGIC:
+        raise IOError('not a snapshot')
+    size = LENGTH.unpack(f.read(LENGTH.size))[0]
+    return marshal.loads(f.read(size))
+
+
+def readstream(f, attributes):
+    """
+    generator of the ClassAds, as dictionaries, 
+    read sequentially from a file object 
+    -a pipe or a socket, for example-
+    positioned after the header of a snapshot
+    """
+    while True:
+        data = f.read(LENGTH.size)
+        if not data:
+            break
+        if len(data) < LENGTH.size:
+            raise IOError('truncated snapshot')
+        size = LENGTH.unpack(data)[0]
+        data = f.read(size)
+        if len(data) < size:
+            raise IOError('truncated snapshot')
+        values = marshal.loads(data)
+        classad = {}
+        for attr, value in zip(attributes, values):
+            if value is not None:
+                classad[attr] = value
+        yield classad
+
+
+def readsnapshot(path):
+    """
+    generator of the ClassAds stored in a snapshot file,
+    as dictionaries. Attributes with no value are not included.
+    """
+    f = open(path, 'rb')
+    try:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        # mmap keeps its own reference to the file
+        f.close()
+
+    try:
+        if mm[:len(MAGIC)] != MAGIC:
+            raise IOError('%s is not a snapshot file' %path)
+        offset = len(MAGIC)
+        size = LENGTH.unpack_from(mm, offset)[0]
+        offset += LENGTH.size
+        created, attributes = marshal.loads(mm[offset:offset+size])
+        offset += size
+
+        end = len(mm)
+        while offset < end:
+            size = LENGTH.unpack_from(mm, offset)[0]
+            offset += LENGTH.size
+            values = marshal.loads(mm[offset:offset+size])
+            offset += size
+            classad = {}
+            for attr, value in zip(attributes, values):
+                if value is not None:
+                    classad[attr] = value
+            yield classad
+    finally:
+        mm.close()
@@ -0,0 +1,288 @@
+#!/bin/env python
+
+"""
+Status of the APF queues, calculated from the HTCondor job event logs
+instead of querying the schedd.
+
+APF writes one event log per job, like
+
+    <basedir>/2013-06-07/BNL_CLOUD-sl6/57368.0.log
+
+with the events in HTCondor user log format:
+
+    000 (57368.000.000) 06/07 10:04:42 Job submitted from host: <...>
+    ...
+    001 (57368.000.000) 06/07 10:05:08 Job executing on host: <...>
+    ...
+
+Only the first line of each event is needed.
+The directory where the log is gives the queue name.
+
+Logs are append-only, so the offset already processed for each file
+is kept in a state file, together with the current status of every
+job still in the queue. Each update only reads the bytes written
+since the previous one.
+"""
+
+import fcntl
+import json
+import os
+import re
+import time
+
+
+# event code -> new JobStatus. None means the job has left the queue
+EVENT_STATUS = {'000': 1,     # submitted
+                '001': 2,     # executing
+                '004': 1,     # evicted
+                '005': None,  # terminated
+                '007': 1,     # shadow exception
+                '009': None,  # aborted
+                '010': 7,     # suspended
+                '011': 2,     # unsuspended
+                '012': 5,     # held
+                '013': 1,     # released
+               }
+
+EVENT_RE = re.compile(r'(\d{3}) \((\d+)\.(\d+)\.\d+\) (\d{2}/\d{2}|\d{4}-\d{2}-\d{2}) (\d{2}:\d{2}:\d{2})')
+
+DATE_RE = re.compile(r"(\d{4})-(\d{2})-(\d{2})$")
+
+# margin, in seconds, when comparing the mtime of the directories
+# with the time of the previous update
+MTIME_MARGIN = 60
+
+
+class EventLogState(object):
+
+    def __init__(self, basedir, statefile, days=2):
+        """
+        basedir: the APF logs directory, with one subdirectory per date
+        statefile: file to keep the offsets and jobs between updates
+        days: new job logs are searched only in the date directories
+              of this number of most recent days.
+              Logs of jobs still in the queue are always followed.
+        """
+        self.basedir = basedir
+        self.statefile = statefile
+        self.days = days
+
+        # path -> [inode, offset]
+        self.offsets = {}
+        # time of the previous update
+        self.lastupdate = 0
+        # 'clusterid.procid' -> [queue, jobstatus, enteredcurrentstatus, qdate, path]
+        self.jobs = {}
+        # True once the state file has been read
+        self.loaded = False
+
+
+    def update(self, save=True):
+        """
+        reads the new events.
+        The state file is only read by the first update, the state is
+        kept in memory after it. It is written after every update, unless
+        save is False: callers updating in a loop can call save( ) only
+        every few updates, and when they exit.
+        """
+        lockfile = self._lock()
+        try:
+            if not self.loaded:
+                self._load()
+                self.loaded = True
+            start = time.time()
+            paths, cutoff = self._candidates()
+            for path in paths:
+                self._follow(path)
+            # offsets of files in older date directories are forgotten,
+            # unless their jobs are still in the queue
+            followed = set([job[4] for job in self.jobs.itervalues()])
+            for path in self.offsets.keys():
+                if path not in followed and logdate(path) < cutoff:
+                    del self.offsets[path]
+            self.lastupdate = start
+            if save:
+                self._save()
+        finally:
+            self._unlock(lockfile)
+
+
+    def save(self):
+        """
+        writes the state file
+        """
+        if not self.loaded:
+            return
+        lockfile = self._lock()
+        try:
+            self._save()
+        finally:
+            self._unlock(lockfile)
+
+
+    def classads(self):
+        """
+        generator of one dictionary per job in the queue,
+        with the same attributes as the schedd ClassAds
+        """
+        for jobid, (queue, jobstatus, entered, qdate, path) in self.jobs.iteritems():
+            clusterid, procid = jobid.split('.')
+            yield {'ClusterId'            : int(clusterid),
+                   'ProcId'               : int(procid),
+                   'JobStatus'            : jobstatus,
+                   'EnteredCurrentStatus' : entered,
+                   'QDate'                : qdate,
+                   'MATCH_APF_QUEUE'      : queue}
+
+
+    def _lock(self):
+        lockfile = open(self.statefile + '.lock', 'a')
+        fcntl.flock(lockfile, fcntl.LOCK_EX)
+        return lockfile
+
+
+    def _unlock(self, lockfile):
+        fcntl.flock(lockfile, fcntl.LOCK_UN)
+        lockfile.close()
+
+
+    def _load(self):
+        try:
+            f = open(self.statefile)
+        except IOError:
+            return
+        try:
+            state = json.load(f)
+        finally:
+            f.close()
+        self.offsets = state['offsets']
+        self.jobs = state['jobs']
+        self.lastupdate = state.get('lastupdate', 0)
+
+
+    def _save(self):
+        tmpfile = self.statefile + '.tmp'
+        f = open(tmpfile, 'w')
+        try:
+            json.dump({'offsets': self.offsets, 'jobs': self.jobs, 'lastupdate': self.lastupdate}, f)
+        finally:
+            f.close()
+        os.rename(tmpfile, self.statefile)
+
+
+    def _candidates(self):
+        """
+        returns (set of event logs to read, oldest date searched).
+        The logs to read are the ones of the jobs still in the queue,
+        the ones with no complete event yet,
+        and the new ones in the most recent date directories.
+        Creating a log changes the mtime of its directory, so only
+        the directories modified since the previous update are listed.
+        """
+        paths = set([job[4] for job in self.jobs.itervalues()])
+        paths.update([path for path, (inode, offset) in self.offsets.iteritems() if offset == 0])
+
+        cutoff = time.strftime('%Y-%m-%d', time.localtime(time.time() - self.days*24*3600))
+        try:
+            dates = [date for date in os.listdir(self.basedir) if DATE_RE.match(date) and date >= cutoff]
+        except OSError:
+            dates = []
+        for date in dates:
+            datedir = os.path.join(self.basedir, date)
+            for queue in os.listdir(datedir):
+                queuedir = os.path.join(datedir, queue)
+                try:
+                    if os.stat(queuedir).st_mtime < self.lastupdate - MTIME_MARGIN:
+                        continue
+                    filenames = os.listdir(queuedir)
+                except OSError:
+                    continue
+                for filename in filenames:
+                    path = os.path.join(queuedir, filename)
+                    if filename.endswith('.log') and path not in self.offsets:
+                        paths.add(path)
+        return paths, cutoff
+
+
+    def _follow(self, path):
+        """
+        processes the events written in a log since the last update.
+        Only complete lines are processed,
+        a partial last line is left for the next update.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            # the log has been removed, by logrotate for example.
+            # Its jobs would never leave the queue otherwise
+            self.offsets.pop(path, None)
+            for jobid in [jobid for jobid, job in self.jobs.iteritems() if job[4] == path]:
+                del self.jobs[jobid]
+            return
+        inode, offset = self.offsets.get(path, (st.st_ino, 0))
+        if inode != st.st_ino or st.st_size < offset:
+            # not the same file anymore
+            offset = 0
+        if st.st_size == offset:
+            self.offsets[path] = [st.st_ino, offset]
+            return
+
+        f = open(path)
+        try:
+            f.seek(offset)
+            data = f.read()
+        finally:
+            f.close()
+        end = data.rfind('\n') + 1
+        self.offsets[path] = [st.st_ino, offset + end]
+
+        # the path is  <basedir>/<date>/<queue>/<clusterid>.<procid>.log
+        datedir, queue = os.path.split(os.path.dirname(path))
+        date = os.path.basename(datedir)
+
+        for line in data[:end].splitlines():
+            m = EVENT_RE.match(line)
+            if not m:
+                continue
+            code, clusterid, procid, day, hour = m.groups()
+            if code not in EVENT_STATUS:
+                continue
+            jobid = '%d.%d' %(int(clusterid), int(procid))
+            timestamp = eventtime(day, hour, date)
+            jobstatus = EVENT_STATUS[code]
+            if jobstatus is None:
+                self.jobs.pop(jobid, None)
+            elif jobid in self.jobs:
+                job = self.jobs[jobid]
+                job[1] = jobstatus
+                job[2] = timestamp
+            else:
+                self.jobs[jobid] = [queue, jobstatus, timestamp, timestamp, path]
+
+
+def logdate(path):
+    """
+    date directory of a log  <basedir>/<date>/<queue>/<clusterid>.<procid>.log
+    """
+    return os.path.basename(os.path.dirname(os.path.dirname(path)))
+
+
+def eventtime(day, hour, date):
+    """
+    converts the date and time of an event into seconds since epoch.
+    day is either  MM/DD  or  YYYY-MM-DD.
+    In the first case, the year is taken from date,
+    the name of the directory of the log (YYYY-MM-DD)
+    """
+    if '/' in day:
+        month, dayofmonth = day.split('/')
+        m = DATE_RE.match(date)
+        if m:
+            year = int(m.group(1))
+            if int(month) < int(m.group(2)):
+                # the job was submitted in December, and the event is in January
+                year += 1
+        else:
+            year = time.localtime().tm_year
+        day = '%04d-%s-%s' %(year, month, dayofmonth)
+    return int(time.mktime(time.strptime('%s %s' %(day, hour), '%Y-%m-%d %H:%M:%S')))
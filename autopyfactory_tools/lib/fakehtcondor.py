@@ -0,0 +1,342 @@
+#!/bin/env python
+
+"""
+In-process stand-in for the htcondor python bindings,
+to run, benchmark and profile the tools without a pool.
+
+It implements the subset of the API used by the tools:
+
+    Schedd( ).query( ), Schedd( ).xquery( )
+    Collector( ).query( ), Collector( ).locateAll( ), Collector( ).locate( )
+    param, AdTypes, DaemonTypes
+
+The ClassAds are either generated by synthlib, or read from
+HTCondor XML dumps, like attic/condor_q_long.xml.
+Each call can be given a latency, and the ClassAds are returned
+no faster than a given rate, to look like a busy schedd.
+
+It is selected with the environment variable APF_FAKE_HTCONDOR,
+a comma separated list of key=value pairs:
+
+    jobs     number of jobs per schedd, or a XML dump of jobs  [10000]
+    slots    number of slots per collector, or a XML dump of slots  [1000]
+    schedds  number of schedds returned by locateAll( )  [1]
+    copies   times the ClassAds from XML dumps are repeated  [1]
+    latency  seconds before each query returns the first ClassAd  [0]
+    rate     maximum number of ClassAds returned per second, 0 is no limit  [0]
+    seed     seed for the generated ClassAds  [0]
+
+For example
+
+    APF_FAKE_HTCONDOR='jobs=1000000,schedds=4,latency=0.5,rate=50000' apf-queue-status -A
+
+    APF_FAKE_HTCONDOR='jobs=attic/condor_q_long.xml,copies=1000' apf-condor-q
+
+Any non empty value, like APF_FAKE_HTCONDOR=1, uses the defaults.
+
+The tools call installfromenv( ) before importing htcondor,
+so "import htcondor" gets this module instead.
+"""
+
+import os
+import re
+import sys
+import time
+from xml.etree import cElementTree as ElementTree
+
+
+ENVIRONMENT = 'APF_FAKE_HTCONDOR'
+
+DEFAULTS = {'jobs'    : '10000',
+            'slots'   : '1000',
+            'schedds' : '1',
+            'copies'  : '1',
+            'latency' : '0',
+            'rate'    : '0',
+            'seed'    : '0'}
+
+LOCAL_SCHEDD = 'factory.example.com'
+
+config = dict(DEFAULTS)
+
+# the ClassAds are created only once per process
+# schedd name -> list of ClassAds
+_jobs = {}
+_slots = []
+
+
+param = {'COLLECTOR_HOST' : 'collector.example.com',
+         'SCHEDD_NAME'    : LOCAL_SCHEDD}
+
+
+class AdTypes(object):
+    Any = 'Any'
+    Collector = 'Collector'
+    Schedd = 'Schedd'
+    Startd = 'Startd'
+
+
+class DaemonTypes(object):
+    Any = 'Any'
+    Collector = 'Collector'
+    Schedd = 'Schedd'
+    Startd = 'Startd'
+
+
+def configure(spec):
+    """
+    sets the configuration from a string like 'jobs=1000,latency=1'
+    """
+    config.clear()
+    config.update(DEFAULTS)
+    for item in spec.split(','):
+        if '=' not in item:
+            continue
+        key, value = item.split('=', 1)
+        key = key.strip()
+        if key not in DEFAULTS:
+            raise ValueError('unknown option %s in %s' %(key, ENVIRONMENT))
+        config[key] = value.strip()
+    _jobs.clear()
+    del _slots[:]
+
+
+def install(spec=None):
+    """
+    makes "import htcondor" return this module
+    """
+    if spec is not None:
+        configure(spec)
+    sys.modules['htcondor'] = sys.modules[__name__]
+
+
+def installfromenv():
+    """
+    calls install( ) if the environment variable is set.
+    Returns True in that case
+    """
+    spec = os.environ.get(ENVIRONMENT)
+    if not spec:
+        return False
+    install(spec)
+    return True
+
+
+# =============================================================================
+
+class ClassAd(dict):
+    """
+    dictionary with case insensitive keys,
+    like the attribute names of real ClassAds
+    """
+
+    def __getitem__(self, key):
+        try:
+            return dict.__getitem__(self, key)
+        except KeyError:
+            lower = key.lower()
+            for k in self.iterkeys():
+                if k.lower() == lower:
+                    return dict.__getitem__(self, k)
+            raise
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+
+class Schedd(object):
+
+    def __init__(self, location=None):
+        if location is None:
+            self.name = param['SCHEDD_NAME']
+        else:
+            self.name = location['Name']
+
+    def query(self, constraint='true', attr_list=[]):
+        return list(self.xquery(constraint, attr_list))
+
+    def xquery(self, constraint='true', attr_list=[]):
+        return _select(_getjobs(self.name), constraint, attr_list)
+
+
+class Collector(object):
+
+    def __init__(self, pool=None):
+        self.pool = pool or param['COLLECTOR_HOST']
+
+    def query(self, ad_type=AdTypes.Any, constraint='true', attrs=[]):
+        if ad_type == AdTypes.Schedd:
+            return list(_select(_schedds(), constraint, attrs))
+        return list(_select(_getslots(), constraint, attrs))
+
+    def locateAll(self, daemon_type):
+        return _schedds()
+
+    def locate(self, daemon_type, name=None):
+        for ad in _schedds():
+            if name is None or ad['Name'] == name:
+                return ad
+        raise ValueError('Unable to locate daemon %s' %name)
+
+
+# =============================================================================
+
+def _schedds():
+    names = [param['SCHEDD_NAME']]
+    for i in range(1, int(config['schedds'])):
+        names.append('factory%02d.example.com' %i)
+    return [ClassAd(Name=name, MyType='Scheduler', ScheddIpAddr='<127.0.0.1:9618>') for name in names]
+
+
+def _getjobs(name):
+    if name not in _jobs:
+        source = config['jobs']
+        if source.isdigit():
+            from autopyfactory_tools.lib import synthlib
+            index = [ad['Name'] for ad in _schedds()].index(name)
+            seed = int(config['seed']) + index
+            ads = [ClassAd(job) for job in synthlib.jobs(int(source), seed=seed, schedd=name)]
+        else:
+            ads = list(_copies(readxml(source), 'ClusterId'))
+        _jobs[name] = ads
+    return _jobs[name]
+
+
+def _getslots():
+    if not _slots:
+        source = config['slots']
+        if source.isdigit():
+            from autopyfactory_tools.lib import synthlib
+            _slots.extend([ClassAd(slot) for slot in synthlib.slots(int(source), seed=int(config['seed']))])
+        else:
+            _slots.extend(_copies(readxml(source), 'Name'))
+    return _slots
+
+
+def _copies(classads, key):
+    """
+    repeats the ClassAds read from a dump,
+    changing key, so all of them are different
+    """
+    classads = list(classads)
+    for ad in classads:
+        yield ad
+    for copy in range(1, int(config['copies'])):
+        for ad in classads:
+            ad = ClassAd(ad)
+            if key == 'ClusterId':
+                ad['ClusterId'] = ad.get('ClusterId', 0) + copy * 1000000
+            else:
+                ad[key] = '%s-%d' %(ad.get(key), copy)
+            yield ad
+
+
+def _select(classads, constraint, attributes):
+    """
+    generator of the ClassAds matching the constraint,
+    with only the requested attributes,
+    paced by the latency and rate in the configuration
+    """
+    match = compileconstraint(constraint)
+    latency = float(config['latency'])
+    rate = float(config['rate'])
+
+    if latency:
+        time.sleep(latency)
+    start = time.time()
+    n = 0
+    for ad in classads:
+        if not match(ad):
+            continue
+        if attributes:
+            ad = ClassAd([(attr, ad[attr]) for attr in attributes if attr in ad])
+        if rate and n % 1000 == 0:
+            ahead = start + n / rate - time.time()
+            if ahead > 0:
+                time.sleep(ahead)
+        n += 1
+        yield ad
+
+
+# =============================================================================
+
+TOKEN_RE = re.compile(r'"(?:[^"\\]|\\.)*"|=\?=|=!=|&&|\|\||==|!=|>=|<=|[A-Za-z_][A-Za-z0-9_.]*|\d+(?:\.\d*)?|\S')
+
+TOKENS = {'&&'  : ' and ',
+          '||'  : ' or ',
+          '!'   : ' not ',
+          '=?=' : ' == ',
+          '=!=' : ' != ',
+          'is'  : ' == ',
+          'isnt': ' != ',
+          'true'      : ' True ',
+          'false'     : ' False ',
+          'undefined' : ' None '}
+
+
+def compileconstraint(constraint):
+    """
+    converts a constraint into a python function of the ClassAd.
+    Only the simple subset of the ClassAd language used by the tools
+    is understood: attributes, literals, comparisons, && || !
+    An undefined attribute is None.
+    """
+    python = []
+    for token in TOKEN_RE.findall(constraint or 'true'):
+        if token.lower() in TOKENS:
+            python.append(TOKENS[token.lower()])
+        elif token[0].isalpha() or token[0] == '_':
+            python.append('_ad.get(%r)' %token)
+        else:
+            python.append(token)
+    try:
+        function = eval('lambda _ad: ' + ''.join(python))
+    except SyntaxError:
+        raise ValueError('unsupported constraint: %s' %constraint)
+
+    def match(ad):
+        try:
+            return function(ad)
+        except TypeError:
+            return False
+    return match
+
+
+def readxml(path):
+    """
+    generator of the ClassAds in a XML dump,
+    like the output of condor_q -xml or condor_status -xml
+    """
+    for event, element in ElementTree.iterparse(path):
+        if element.tag != 'c':
+            continue
+        ad = ClassAd()
+        for attribute in element.findall('a'):
+            if len(attribute):
+                ad[attribute.get('n')] = xmlvalue(attribute[0])
+        element.clear()
+        yield ad
+
+
+def xmlvalue(element):
+    """
+    value of one of the XML elements <i>, <r>, <b>, <s>, <e>
+    """
+    if element.tag == 'i':
+        return int(element.text)
+    if element.tag == 'r':
+        return float(element.text)
+    if element.tag == 'b':
+        return element.get('v') == 't'
+    # strings and expressions
+    return element.text or ''
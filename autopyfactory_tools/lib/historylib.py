@@ -0,0 +1,173 @@
+#!/bin/env python
+
+"""
+Rolling history of the status of each queue, kept between runs
+in a small binary file, accessed through mmap.
+
+Each queue has a fixed size ring buffer with the last nsamples samples,
+so the file, and the memory needed, do not grow with time:
+
+    header:  MAGIC, nsamples, nqueues, time of the last update
+    queues:  name, position of the next sample, number of samples
+             nsamples x (time, nidle, nrunning, nstarted,
+                         age of the oldest idle job,
+                         age of the newest running job)
+
+with -1 for the values that are not known.
+A new queue is appended at the end of the file the first time it is seen.
+Updates are done with the file locked, so several processes can share it.
+"""
+
+import fcntl
+import mmap
+import os
+import struct
+
+
+MAGIC = 'APFHIST1'
+HEADER = struct.Struct('<8sIId')
+QUEUE = struct.Struct('<128sII')
+SAMPLE = struct.Struct('<diiiii')
+
+# fields of each sample
+FIELDS = ('time', 'nidle', 'nrunning', 'nstarted', 'oldestidle', 'newestrunning')
+
+# longer queue names are truncated
+MAXNAME = 128
+
+
+class History(object):
+    """
+    usage:
+
+        history = History(path)
+        history.open()
+        try:
+            since = history.lastupdate()
+            history.append('BNL_CLOUD-sl6', (now, 10, 200, 3, 600, 45))
+            samples = history.samples('BNL_CLOUD-sl6')
+        finally:
+            history.close()
+
+    The file is locked between open( ) and close( ).
+    """
+
+    def __init__(self, path, nsamples=60):
+        """
+        nsamples is only used when the file is created.
+        Existing files keep their own number of samples per queue.
+        """
+        self.path = path
+        self.nsamples = nsamples
+        self.f = None
+        self.mm = None
+        # queue name -> offset of its block in the file
+        self.offsets = {}
+
+
+    def open(self):
+        # not in append mode, so blocks are written where _addqueue( ) 
+        # seeks to, even if the file is longer than the header says
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0644)
+        self.f = os.fdopen(fd, 'r+b')
+        fcntl.flock(self.f, fcntl.LOCK_EX)
+        self.f.seek(0, os.SEEK_END)
+        if self.f.tell() == 0:
+            self.f.write(HEADER.pack(MAGIC, self.nsamples, 0, 0.0))
+            self.f.flush()
+        self._map()
+        magic, self.nsamples, nqueues, last = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise IOError('%s is not a history file' %self.path)
+        offset = HEADER.size
+        for i in range(nqueues):
+            name = QUEUE.unpack_from(self.mm, offset)[0].rstrip('\0')
+            self.offsets[name] = offset
+            offset += self._blocksize()
+
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.flush()
+            self.mm.close()
+            self.mm = None
+        if self.f is not None:
+            fcntl.flock(self.f, fcntl.LOCK_UN)
+            self.f.close()
+            self.f = None
+        self.offsets = {}
+
+
+    def lastupdate(self):
+        """
+        time of the last update, 0 if there has been none
+        """
+        return HEADER.unpack_from(self.mm, 0)[3]
+
+
+    def setlastupdate(self, t):
+        magic, nsamples, nqueues, last = HEADER.unpack_from(self.mm, 0)
+        HEADER.pack_into(self.mm, 0, magic, nsamples, nqueues, t)
+
+
+    def append(self, queue, sample):
+        """
+        adds a sample, a tuple with the values in FIELDS,
+        overwriting the oldest one when the buffer is full
+        """
+        queue = queue[:MAXNAME]
+        offset = self.offsets.get(queue)
+        if offset is None:
+            offset = self._addqueue(queue)
+        name, head, count = QUEUE.unpack_from(self.mm, offset)
+        SAMPLE.pack_into(self.mm, offset + QUEUE.size + head * SAMPLE.size, *sample)
+        head = (head + 1) % self.nsamples
+        count = min(count + 1, self.nsamples)
+        QUEUE.pack_into(self.mm, offset, name, head, count)
+
+
+    def samples(self, queue):
+        """
+        list of samples of a queue, from oldest to newest
+        """
+        offset = self.offsets.get(queue[:MAXNAME])
+        if offset is None:
+            return []
+        name, head, count = QUEUE.unpack_from(self.mm, offset)
+        first = (head - count) % self.nsamples
+        out = []
+        for i in range(count):
+            position = (first + i) % self.nsamples
+            out.append(SAMPLE.unpack_from(self.mm, offset + QUEUE.size + position * SAMPLE.size))
+        return out
+
+
+    def queues(self):
+        return self.offsets.keys()
+
+
+    def _blocksize(self):
+        return QUEUE.size + self.nsamples * SAMPLE.size
+
+
+    def _addqueue(self, queue):
+        """
+        writes an empty block for a new queue, right after the last one, 
+        and maps the file again
+        """
+        magic, nsamples, nqueues, last = HEADER.unpack_from(self.mm, 0)
+        offset = HEADER.size + nqueues * self._blocksize()
+        self.mm.flush()
+        self.mm.close()
+        self.f.seek(offset)
+        self.f.write(QUEUE.pack(queue, 0, 0) + '\0' * (self.nsamples * SAMPLE.size))
+        self.f.flush()
+        self._map()
+        HEADER.pack_into(self.mm, 0, magic, nsamples, nqueues + 1, last)
+        self.offsets[queue] = offset
+        return offset
+
+
+    def _map(self):
+        self.mm = mmap.mmap(self.f.fileno(), 0)
@@ -0,0 +1,280 @@
+#!/bin/env python
+
+"""
+Inverted index of the error messages in the pilot logs,
+kept in a SQLite database:
+
+    signatures:  id, signature
+    postings:    signature id, queue, date, job, suffix, offset
+    files:       path, date, inode, offset already indexed
+    meta:        pattern of the lines indexed, time of the last update
+
+The lines of the .out and .err files matching the pattern
+(by default, anything that looks like an error) are indexed
+by their signature, see logslib.normalize( ).
+So the jobs, queues and dates of an error can be found
+without reading the logs again.
+
+Updates are incremental: only the files modified since the previous
+update are read, from the offset where the previous update stopped.
+A partial last line is indexed too, and indexed again, complete,
+in the next update.
+"""
+
+import os
+import re
+import sqlite3
+import time
+
+from autopyfactory_tools.lib import logslib
+
+
+PATTERN = r'(?i)error|fail|exception|fatal|traceback|abort|killed|denied|timed? ?out|refused'
+
+SUFFIXES = ('.out', '.err')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS signatures (id INTEGER PRIMARY KEY, signature TEXT UNIQUE);
+CREATE TABLE IF NOT EXISTS postings (signature INTEGER, queue TEXT, date TEXT, job TEXT, suffix TEXT, offset INTEGER);
+CREATE INDEX IF NOT EXISTS postings_signature ON postings (signature);
+CREATE INDEX IF NOT EXISTS postings_file ON postings (date, queue, job);
+CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, date TEXT, inode INTEGER, offset INTEGER);
+'''
+
+# characters that make STRING a regular expression and not a plain string
+REGEX_CHARS = set('.^$*+?{}[]\\|()')
+
+
+class LogIndex(object):
+
+    def __init__(self, path, pattern=PATTERN):
+        """
+        pattern is only used when the index is created.
+        Existing indexes keep their own pattern.
+        """
+        self.path = path
+        self.db = sqlite3.connect(path)
+        # the messages are not always valid UTF-8
+        self.db.text_factory = str
+        self.db.execute('PRAGMA synchronous = NORMAL')
+        self.db.executescript(SCHEMA)
+        self.pattern = self._getmeta('pattern')
+        if self.pattern is None:
+            self.pattern = pattern
+            self._setmeta('pattern', pattern)
+            self.db.commit()
+
+
+    def close(self):
+        self.db.close()
+
+
+    def lastupdate(self):
+        return float(self._getmeta('lastupdate') or 0)
+
+
+    def update(self, tree, budget=None):
+        """
+        indexes the lines written in the logs since the previous update.
+        tree is a logslib.LogTree.
+        Returns the number of new postings.
+        """
+        start = time.time()
+        since = self.lastupdate()
+
+        files = {}
+        for date, queue, path in tree.candidates(since, SUFFIXES):
+            files[path] = (date, queue)
+
+        offsets = {}
+        for path, inode, offset in self.db.execute('SELECT path, inode, offset FROM files'):
+            if path in files:
+                offsets[path] = (inode, offset)
+
+        signatures = dict([(signature, id) for id, signature in self.db.execute('SELECT id, signature FROM signatures')])
+        scanner = logslib.Scanner(self.pattern, budget)
+
+        def follow(path):
+            st = os.stat(path)
+            inode, offset = offsets.get(path, (st.st_ino, 0))
+            reset = inode != st.st_ino or st.st_size < offset
+            if reset:
+                # not the same file anymore
+                offset = 0
+            matches, end = scanner.scanfrom(path, offset)
+            return st.st_ino, offset, end, matches
+
+        n = 0
+        for path, (inode, offset, end, matches) in logslib.pool(follow, files.keys(), scanner.budget.maxworkers):
+            date, queue = files[path]
+            job, suffix = os.path.basename(path).rsplit('.', 1)
+            # the postings of the partial last line of the previous update,
+            # or all of them when the file is not the same anymore
+            self.db.execute('DELETE FROM postings WHERE queue = ? AND date = ? AND job = ? AND suffix = ? AND offset >= ?', (queue, date, job, suffix, offset))
+            rows = []
+            for position, line in matches:
+                signature = logslib.normalize(line)
+                id = signatures.get(signature)
+                if id is None:
+                    id = self.db.execute('INSERT INTO signatures (signature) VALUES (?)', (signature,)).lastrowid
+                    signatures[signature] = id
+                rows.append((id, queue, date, job, suffix, position))
+            self.db.executemany('INSERT INTO postings VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self.db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)', (path, date, inode, end))
+            n += len(rows)
+
+        self._forget(tree)
+        # files modified while updating are read again in the next update
+        self._setmeta('lastupdate', repr(start))
+        self.db.commit()
+        return n
+
+
+    def signatures(self, text=None, since=None, queue=None):
+        """
+        list of (signature, number of postings, number of queues, first date, last date)
+        of the signatures including text, most frequent first
+        """
+        where, values = self._where(text, since, queue)
+        query = 'SELECT s.signature, COUNT(*), COUNT(DISTINCT p.queue), MIN(p.date), MAX(p.date) ' \
+                'FROM postings p JOIN signatures s ON s.id = p.signature %s ' \
+                'GROUP BY s.id ORDER BY COUNT(*) DESC' %where
+        return self.db.execute(query, values).fetchall()
+
+
+    def queues(self, text=None, since=None, queue=None):
+        """
+        list of (queue, number of postings, first date, last date)
+        for the signatures including text
+        """
+        where, values = self._where(text, since, queue)
+        query = 'SELECT p.queue, COUNT(*), MIN(p.date), MAX(p.date) ' \
+                'FROM postings p JOIN signatures s ON s.id = p.signature %s ' \
+                'GROUP BY p.queue ORDER BY MIN(p.date) DESC, p.queue' %where
+        return self.db.execute(query, values).fetchall()
+
+
+    def postings(self, text=None, since=None, queue=None):
+        """
+        generator of (queue, date, job, suffix, offset, signature)
+        for the signatures including text
+        """
+        where, values = self._where(text, since, queue)
+        query = 'SELECT p.queue, p.date, p.job, p.suffix, p.offset, s.signature ' \
+                'FROM postings p JOIN signatures s ON s.id = p.signature %s ' \
+                'ORDER BY p.date, p.queue, p.job, p.suffix, p.offset' %where
+        return self.db.execute(query, values)
+
+
+    def search(self, string, files):
+        """
+        like logslib.Scanner.scan( ) for the lines including string,
+        but using the index: only the lines at the offsets in the index
+        are read, to check they include string.
+        The lines are not selected by their signatures, as the masks
+        may have replaced part of string, or the text around it.
+        When covers(string), all the lines including it are indexed.
+        files is a dictionary path -> (date, queue)
+        """
+        if not files:
+            return
+        # (date, queue, filename) -> path
+        paths = dict([((date, queue, os.path.basename(path)), path) for path, (date, queue) in files.iteritems()])
+        since = min([date for date, queue in files.itervalues()])
+        offsets = {}
+        for queue, date, job, suffix, offset, signature in self.postings(since=since):
+            path = paths.get((date, queue, '%s.%s' %(job, suffix)))
+            if path is not None:
+                offsets.setdefault(path, []).append(offset)
+
+        for path in sorted(offsets.keys()):
+            matches = []
+            try:
+                f = open(path, 'rb')
+            except IOError:
+                continue
+            try:
+                for offset in offsets[path]:
+                    f.seek(offset)
+                    line = f.readline().rstrip('\n')
+                    if string in line:
+                        matches.append((offset, line))
+            finally:
+                f.close()
+            if matches:
+                yield path, matches
+
+
+    def covers(self, string):
+        """
+        True if all the lines including string are in the index,
+        so search( ) finds the same lines as a scan.
+        Only when string is not a regular expression, and it is 
+        exactly one of the words of the pattern, like  Traceback, 
+        or one of the signatures indexed.
+        For anything else the logs are scanned.
+        """
+        if not string or REGEX_CHARS.intersection(string):
+            return False
+        if re.match(r'(?:%s)\Z' %self.pattern, string):
+            return True
+        if re.search(self.pattern, string) is None:
+            return False
+        row = self.db.execute('SELECT 1 FROM signatures WHERE signature = ?', (string,)).fetchone()
+        return row is not None
+
+
+    def _where(self, text, since, queue):
+        conditions = []
+        values = []
+        if text:
+            # the text may have been masked in the signatures too.
+            # LIKE, and not instr( ), which is not in old SQLite versions
+            conditions.append("(s.signature LIKE ? ESCAPE '\\' OR s.signature LIKE ? ESCAPE '\\')")
+            values += [like(text), like(logslib.normalize(text))]
+        if since:
+            conditions.append('p.date >= ?')
+            values.append(since)
+        if queue:
+            conditions.append('p.queue = ?')
+            values.append(queue)
+        if not conditions:
+            return '', values
+        return 'WHERE ' + ' AND '.join(conditions), values
+
+
+    def _forget(self, tree):
+        """
+        removes the dates not in the tree anymore,
+        and the offsets of the files of dates that are closed,
+        as they will not be modified again
+        """
+        dates = set(tree.dates())
+        for (date,) in self.db.execute('SELECT DISTINCT date FROM files').fetchall():
+            if date not in dates or tree.closed(date):
+                self.db.execute('DELETE FROM files WHERE date = ?', (date,))
+        for (date,) in self.db.execute('SELECT DISTINCT date FROM postings').fetchall():
+            if date not in dates:
+                self.db.execute('DELETE FROM postings WHERE date = ?', (date,))
+        self.db.execute('DELETE FROM signatures WHERE id NOT IN (SELECT DISTINCT signature FROM postings)')
+
+
+    def _getmeta(self, key):
+        row = self.db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+
+    def _setmeta(self, key, value):
+        self.db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, value))
+
+
+def like(text):
+    """
+    LIKE pattern for the strings including text
+    """
+    for char in '\\%_':
+        text = text.replace(char, '\\' + char)
+    return '%' + text + '%'
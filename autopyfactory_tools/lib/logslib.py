@@ -0,0 +1,601 @@
+#!/bin/env python
+
+"""
+Search of the pilot logs of the factory, organized as
+
+    BASEDIR/YYYY-MM-DD/<queue>/<job>.out  (and .err, .log)
+
+The files are scanned in process, with a compiled regular expression
+over mmap, by a fixed pool of worker threads,
+instead of running one thread and one egrep per directory.
+
+The load on the factory host is bounded by a Budget:
+
+    nice        increment of the niceness of the process.
+                Without an explicit ionice, the IO priority follows it
+    maxworkers  number of worker threads
+    maxrate     bytes per second scanned by all the workers together, 0 is no limit
+
+With a ScanState, only the bytes appended to each file since
+the previous run are scanned.
+"""
+
+import fcntl
+import marshal
+import mmap
+import os
+import re
+import stat
+import sys
+import tempfile
+import threading
+import time
+import Queue as pyqueue
+
+# scandir is in os since python 3.5, and in the scandir package before.
+# Without it, listdir( ) is used
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+DATE_RE = re.compile(r"(\d{4})-(\d{2})-(\d{2})?$")
+
+# files are scanned in chunks of about this size,
+# so the rate limit is applied while scanning big files too
+CHUNK = 1024 * 1024
+
+# maximum number of days a job, and therefore the writing of its logs, lasts
+MAXJOBDAYS = 3
+
+
+class Budget(object):
+
+    def __init__(self, nice=0, maxworkers=4, maxrate=0):
+        self.nice = nice
+        self.maxworkers = max(1, maxworkers)
+        self.maxrate = maxrate
+        self.lock = threading.Lock()
+        # time when the next chunk can be scanned
+        self.next = 0.0
+
+
+    def apply(self):
+        """
+        lowers the priority of the process
+        """
+        if self.nice:
+            os.nice(self.nice)
+
+
+    def throttle(self, nbytes):
+        """
+        waits until nbytes more can be scanned without exceeding maxrate
+        """
+        if not self.maxrate:
+            return
+        self.lock.acquire()
+        try:
+            now = time.time()
+            start = max(self.next, now)
+            self.next = start + float(nbytes) / self.maxrate
+        finally:
+            self.lock.release()
+        if start > now:
+            time.sleep(start - now)
+
+
+class Scanner(object):
+    """
+    finds the lines of files matching a regular expression,
+    like egrep -H
+    """
+
+    def __init__(self, pattern, budget=None):
+        # ^ and $ match at the beginning and the end of every line, as in egrep
+        self.regex = re.compile(pattern, re.MULTILINE)
+        self.budget = budget or Budget()
+
+
+    def scanfile(self, path, start=0):
+        """
+        returns the list of (offset, line) of the lines matching,
+        from byte start to the end of the file
+        """
+        return self.scanfrom(path, start)[0]
+
+
+    def scanfrom(self, path, start):
+        """
+        returns the list of (offset, line) of the lines matching
+        from byte start, and the offset of the end of the last complete line
+        """
+        f = open(path, 'rb')
+        try:
+            size = os.fstat(f.fileno()).st_size
+            if size <= start:
+                return [], start
+            mm = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        try:
+            matches = self._scan(mm, start, size)
+            end = max(mm.rfind('\n', start, size) + 1, start)
+            return matches, end
+        finally:
+            mm.close()
+
+
+    def scan(self, paths):
+        """
+        scans the files concurrently, with budget.maxworkers threads.
+        Generator of (path, [(offset, line), ...]) for the files with matches,
+        in no particular order
+        """
+        for path, matches in pool(self.scanfile, paths, self.budget.maxworkers):
+            if matches:
+                yield path, matches
+
+
+    def _scan(self, mm, pos, size):
+        matches = []
+        search = self.regex.search
+        while pos < size:
+            # chunks end at the end of a line, so no line is split
+            end = mm.find('\n', min(pos + CHUNK, size) - 1)
+            end = size if end == -1 else end + 1
+            self.budget.throttle(end - pos)
+            while pos < end:
+                m = search(mm, pos, end)
+                if m is None:
+                    break
+                first = mm.rfind('\n', 0, m.start()) + 1
+                last = mm.find('\n', m.end(), size)
+                if last == -1:
+                    last = size
+                matches.append((first, mm[first:last]))
+                # one match per line
+                pos = last + 1
+            pos = max(pos, end)
+        return matches
+
+
+class ScanState(object):
+    """
+    Pilot stdout files are append-only, so the offset already scanned
+    of each file is kept in a state file, together with the lines matching
+    found so far. Each run only scans the bytes written since the previous one.
+
+    A partial last line is scanned, but it is scanned again,
+    complete, in the next run.
+    The state is only valid for the same pattern. With a different one,
+    all files are scanned from the beginning.
+    """
+
+    def __init__(self, statefile):
+        self.statefile = statefile
+        self.pattern = None
+        # path -> [inode, offset, [(offset, line), ...]]
+        self.files = {}
+
+
+    def scan(self, scanner, paths):
+        """
+        scans the new bytes of the files, and updates the state file.
+        Generator of (path, [(offset, line), ...]) for the files with matches,
+        including the ones found in previous runs.
+        Files not in paths are forgotten.
+        """
+        paths = set(paths)
+        lockfile = openlock(self.statefile + '.lock')
+        try:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            self._load()
+            if self.pattern != scanner.regex.pattern:
+                self.pattern = scanner.regex.pattern
+                self.files = {}
+            follow = lambda path: self._follow(scanner, path)
+            for path, state in pool(follow, paths, scanner.budget.maxworkers):
+                if state is None:
+                    continue
+                self.files[path] = state
+                if state[2]:
+                    yield path, state[2]
+            for path in self.files.keys():
+                if path not in paths:
+                    del self.files[path]
+            self._save()
+        finally:
+            fcntl.flock(lockfile, fcntl.LOCK_UN)
+            lockfile.close()
+
+
+    def _follow(self, scanner, path):
+        """
+        returns the new state of a file
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            # removed in the meantime
+            return None
+        inode, offset, matches = self.files.get(path, (st.st_ino, 0, []))
+        if inode != st.st_ino or st.st_size < offset:
+            # not the same file anymore
+            offset, matches = 0, []
+        if st.st_size > offset:
+            new, end = scanner.scanfrom(path, offset)
+            # a match in the partial last line of the previous run is found again
+            matches = [match for match in matches if match[0] < offset] + new
+            offset = end
+        return [st.st_ino, offset, matches]
+
+
+    def _load(self):
+        try:
+            f = open(self.statefile, 'rb')
+        except IOError:
+            return
+        try:
+            self.pattern, self.files = marshal.load(f)
+        except (EOFError, ValueError, TypeError):
+            # a broken state file: all files are scanned again
+            self.pattern, self.files = None, {}
+        finally:
+            f.close()
+
+
+    def _save(self):
+        # marshal, and not json, because the lines are not always valid UTF-8
+        dumpfile(self.statefile, (self.pattern, self.files))
+
+
+def openlock(path):
+    """
+    opens a lock file, without following a symlink put in its place
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND | os.O_NOFOLLOW, 0600)
+    return os.fdopen(fd, 'a')
+
+
+def dumpfile(path, data):
+    """
+    writes data with marshal into path.
+    The file is written with a temporary name in the same directory,
+    created by mkstemp( ), and then renamed, so a symlink is never
+    followed, and readers never see a partial file.
+    """
+    fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.' + os.path.basename(path))
+    try:
+        f = os.fdopen(fd, 'wb')
+        try:
+            marshal.dump(data, f)
+        finally:
+            f.close()
+        os.rename(tmppath, path)
+    except:
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+        raise
+
+
+def pool(function, items, maxworkers):
+    """
+    calls function(item) for each item with a fixed number of threads.
+    Generator of (item, output) as soon as each call finishes.
+    Failed calls are reported to stderr, and skipped.
+    """
+    tasks = pyqueue.Queue(maxsize=maxworkers * 4)
+    results = pyqueue.Queue()
+    done = object()
+
+    def worker():
+        while True:
+            item = tasks.get()
+            if item is done:
+                results.put(done)
+                return
+            try:
+                results.put((item, function(item)))
+            except Exception, ex:
+                sys.stderr.write('%s failed: %s\n' %(item, ex))
+
+    def feeder():
+        for item in items:
+            tasks.put(item)
+        for i in range(maxworkers):
+            tasks.put(done)
+
+    threads = [threading.Thread(target=feeder)]
+    threads += [threading.Thread(target=worker) for i in range(maxworkers)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    running = maxworkers
+    while running:
+        # a finite timeout keeps the main thread responsive to Ctrl-C
+        try:
+            result = results.get(True, 3600)
+        except pyqueue.Empty:
+            continue
+        if result is done:
+            running -= 1
+        else:
+            yield result
+
+
+def entries(path, suffix=''):
+    """
+    generator of (name, mtime) of the files in a directory ending with suffix.
+    Only those files are stat'ed
+    """
+    if scandir is not None:
+        for entry in scandir(path):
+            if entry.name.endswith(suffix) and entry.is_file():
+                try:
+                    yield entry.name, entry.stat().st_mtime
+                except OSError:
+                    # removed in the meantime
+                    pass
+    else:
+        for name in os.listdir(path):
+            if not name.endswith(suffix):
+                continue
+            try:
+                st = os.stat(os.path.join(path, name))
+            except OSError:
+                continue
+            if stat.S_ISREG(st.st_mode):
+                yield name, st.st_mtime
+
+
+# masks applied, in this order, to get the signature of a message
+MASKS = [(re.compile(r'\b[a-zA-Z][a-zA-Z0-9+.-]*://[^\s\'"()\[\]<>]+'), '<URL>'),
+         (re.compile(r'(?<![\w.])(?:/[^\s/:,;\'"()\[\]<>]+)+/?'), '<PATH>'),
+         (re.compile(r'\b\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?\b'), '<IP>'),
+         (re.compile(r'\b[a-zA-Z0-9-]+(?:\.[a-zA-Z0-9-]+)*\.[a-zA-Z]{2,}\b'), '<HOST>'),
+         (re.compile(r'\b\d+\.\d+(?:\.\d+)?\b'), '<JOB>'),
+         (re.compile(r'\b0x[0-9a-fA-F]+\b|\b[0-9a-fA-F]*\d[0-9a-fA-F]*[a-fA-F][0-9a-fA-F]*\b'), '<HEX>'),
+         (re.compile(r'\d+'), '<N>'),
+         (re.compile(r'\s+'), ' ')]
+
+
+def normalize(line):
+    """
+    signature of a message: the line with URLs, paths, IPs, hostnames,
+    job ids, hexadecimal ids and numbers masked,
+    so the same error in different jobs and hosts looks the same.
+
+        2013-06-07 10:04:42 job 57368.0 FAILED on wn042.example.com
+        <N>-<N>-<N> <N>:<N>:<N> job <JOB> FAILED on <HOST>
+    """
+    for regex, mask in MASKS:
+        line = regex.sub(mask, line)
+    return line.strip()
+
+
+class HeavyHitters(object):
+    """
+    Approximate counts of the most frequent messages, with bounded memory
+    (the space-saving algorithm):
+    at most capacity signatures are counted. When a new one arrives,
+    and there is no room, it replaces the one with the lowest count,
+    inheriting that count as its maximum error.
+    The counts of the signatures more frequent than 1/capacity
+    of the messages are always kept.
+
+    The signatures are grouped by count (a stream-summary), so the one
+    with the lowest count is found without looking at the others.
+    A few different examples of each signature are kept.
+    """
+
+    def __init__(self, capacity=100, nexamples=3):
+        self.capacity = capacity
+        self.nexamples = nexamples
+        # number of messages added
+        self.total = 0
+        # signature -> [count, error, [example, ...]]
+        self.counters = {}
+        # count -> set of signatures with that count
+        self.buckets = {}
+        # lowest count of the signatures
+        self.mincount = 0
+
+
+    def add(self, signature, example):
+        self.total += 1
+        counter = self.counters.get(signature)
+        if counter is None:
+            if len(self.counters) < self.capacity:
+                counter = self.counters[signature] = [0, 0, []]
+            else:
+                # the least frequent one is replaced
+                count = self.mincount
+                old = self._unbucket(self.buckets[count].pop(), count)
+                del self.counters[old]
+                counter = self.counters[signature] = [count, count, []]
+        else:
+            self._unbucket(signature, counter[0])
+        count = counter[0] = counter[0] + 1
+        self.buckets.setdefault(count, set()).add(signature)
+        # counts only grow by one, so the lowest one is either
+        # the same, or the one just incremented
+        if count == 1 or self.mincount not in self.buckets:
+            self.mincount = count
+        if len(counter[2]) < self.nexamples and example not in counter[2]:
+            counter[2].append(example)
+
+
+    def top(self, n):
+        """
+        list of the n most frequent (signature, count, error, [example, ...]).
+        The real count is between count - error and count
+        """
+        counters = sorted(self.counters.iteritems(), key=lambda item: item[1][0], reverse=True)
+        return [(signature, count, error, examples) for signature, (count, error, examples) in counters[:n]]
+
+
+    def _unbucket(self, signature, count):
+        """
+        removes signature from the bucket of count, and returns it
+        """
+        bucket = self.buckets[count]
+        bucket.discard(signature)
+        if not bucket:
+            del self.buckets[count]
+        return signature
+
+
+def subdirs(path):
+    """
+    list of the names of the subdirectories of a directory
+    """
+    if scandir is not None:
+        return [entry.name for entry in scandir(path) if entry.is_dir()]
+    return [name for name in os.listdir(path) if os.path.isdir(os.path.join(path, name))]
+
+
+def dayend(date):
+    """
+    seconds since epoch at the end of a date YYYY-MM-DD, in local time.
+    None if date is not a complete date
+    """
+    try:
+        return time.mktime(time.strptime(date, '%Y-%m-%d')) + 24*3600
+    except ValueError:
+        return None
+
+
+class LogTree(object):
+    """
+    Walker of the tree of logs, pruning the directories
+    that cannot have files modified after a given time.
+
+    The files of a job are created in the directory of the date
+    it is submitted, and written until it finishes,
+    at most maxjobdays after. Therefore nothing is written anymore in
+
+        - a date directory after the end of that date + maxjobdays
+        - a queue directory after its mtime + maxjobdays,
+          as its mtime is the creation time of the newest file in it
+
+    Dates after which nothing is written anymore are closed.
+    For them, the list of queues, and the newest mtime of the files
+    of each queue, once calculated, never change.
+    They are kept in an index file, so the closed dates
+    are not listed again. The index is updated with save( ).
+
+    The dates that are not closed yet -the last maxjobdays days-
+    are listed every time, as their files are still written.
+    A search of the last hours only looks at those, so the index
+    only helps when since is more than maxjobdays ago:
+    apf-reverse-logstree, or a search with a large NHOURS.
+    """
+
+    def __init__(self, basedir, indexfile=None, maxjobdays=MAXJOBDAYS):
+        self.basedir = basedir
+        self.indexfile = indexfile
+        self.slack = maxjobdays * 24*3600
+        self.now = time.time()
+        # closed date -> {queue -> newest mtime of its files, or None if unknown}
+        self.index = {}
+        self._load()
+
+
+    def dates(self):
+        """
+        sorted list of date directories
+        """
+        dates = sorted([date for date in os.listdir(self.basedir) if DATE_RE.match(date)])
+        # removed dates are forgotten
+        for date in self.index.keys():
+            if date not in dates:
+                del self.index[date]
+        return dates
+
+
+    def queues(self, date):
+        """
+        list of queue directories of a date
+        """
+        return self._queues(date).keys()
+
+
+    def candidates(self, since, suffix='.out'):
+        """
+        generator of (date, queue, path) of the files ending with suffix
+        modified after since
+        """
+        for date in self.dates():
+            end = dayend(date)
+            if end is not None and end + self.slack < since:
+                continue
+            closed = self.closed(date)
+            queues = self._queues(date)
+            datedir = os.path.join(self.basedir, date)
+            for queue, newest in queues.items():
+                if newest is not None and newest <= since:
+                    continue
+                queuedir = os.path.join(datedir, queue)
+                try:
+                    if newest is None and os.stat(queuedir).st_mtime + self.slack < since:
+                        continue
+                    if closed:
+                        # all files are listed once, to know the newest one
+                        files = list(entries(queuedir))
+                        queues[queue] = max([mtime for name, mtime in files] or [0])
+                    else:
+                        files = entries(queuedir, suffix)
+                    for name, mtime in files:
+                        if mtime > since and name.endswith(suffix):
+                            yield date, queue, os.path.join(queuedir, name)
+                except OSError:
+                    # removed in the meantime
+                    continue
+
+
+    def save(self):
+        if not self.indexfile:
+            return
+        dumpfile(self.indexfile, self.index)
+
+
+    def closed(self, date):
+        """
+        True if nothing is written anymore in the directory of date
+        """
+        end = dayend(date)
+        return end is not None and end + self.slack < self.now
+
+
+    def _queues(self, date):
+        """
+        queue -> newest mtime for a date, from the index when it is closed
+        """
+        if date in self.index:
+            return self.index[date]
+        queues = dict([(queue, None) for queue in subdirs(os.path.join(self.basedir, date))])
+        if self.closed(date):
+            self.index[date] = queues
+        return queues
+
+
+    def _load(self):
+        if not self.indexfile:
+            return
+        try:
+            f = open(self.indexfile, 'rb')
+        except IOError:
+            return
+        try:
+            self.index = marshal.load(f)
+        except (EOFError, ValueError, TypeError):
+            # not a valid index, it is rebuilt
+            self.index = {}
+        finally:
+            f.close()
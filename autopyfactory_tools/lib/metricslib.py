@@ -0,0 +1,159 @@
+#!/bin/env python
+
+"""
+Prometheus / OpenMetrics exporter for the status of the APF queues.
+
+The status is calculated by queuestatus in a background thread,
+every interval seconds, and rendered once into a text buffer.
+HTTP requests are answered with that buffer, so the number of
+scrapers does not change the number of queries to the schedd.
+"""
+
+import BaseHTTPServer
+import SocketServer
+import logging
+import threading
+import time
+
+from autopyfactory_tools.lib.querylib import queuestatus, QUEUE_STATUSES
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class QueueStatusExporter(object):
+
+    def __init__(self, args, interval=60):
+        """
+        args: the options for queuestatus
+        interval: seconds between refreshes
+        """
+        self.log = logging.getLogger()
+        self.args = args
+        # the longest idle and running times are always exported
+        self.args.longest = True
+        # and so are the timings of each phase of the query
+        self.args.timing = True
+        # and every queue, whatever --limit says
+        self.args.limit = None
+        self.interval = interval
+        self.buffer = '# no data yet\n'
+
+
+    def refresh(self):
+        """
+        queries the status of the queues, and renders the metrics
+        """
+        start = time.time()
+        qs = queuestatus(self.args)
+        rows = list(qs.records())
+        duration = time.time() - start
+        # the hooks in timinglib get the timings too
+        phases = qs.timer.finish()
+
+        nstatus = len(QUEUE_STATUSES)
+        lines = []
+        lines.append('# HELP apf_queue_jobs Number of jobs by APF queue and job status.')
+        lines.append('# TYPE apf_queue_jobs gauge')
+        for row in rows:
+            queue = escape(row[0])
+            for i in range(nstatus):
+                lines.append('apf_queue_jobs{queue="%s",status="%s"} %d' %(queue, QUEUE_STATUSES[i], row[1+i]))
+        lines.append('# HELP apf_queue_longest_idle_seconds Time the oldest idle job has been idle, by APF queue.')
+        lines.append('# TYPE apf_queue_longest_idle_seconds gauge')
+        for row in rows:
+            lines.append('apf_queue_longest_idle_seconds{queue="%s"} %d' %(escape(row[0]), row[1+nstatus]))
+        lines.append('# HELP apf_queue_longest_running_seconds Time the oldest running job has been running, by APF queue.')
+        lines.append('# TYPE apf_queue_longest_running_seconds gauge')
+        for row in rows:
+            lines.append('apf_queue_longest_running_seconds{queue="%s"} %d' %(escape(row[0]), row[2+nstatus]))
+        lines.append('# HELP apf_exporter_last_refresh_timestamp_seconds Time of the last refresh of the metrics.')
+        lines.append('# TYPE apf_exporter_last_refresh_timestamp_seconds gauge')
+        lines.append('apf_exporter_last_refresh_timestamp_seconds %.3f' %start)
+        lines.append('# HELP apf_exporter_refresh_duration_seconds Time spent in the last refresh of the metrics.')
+        lines.append('# TYPE apf_exporter_refresh_duration_seconds gauge')
+        lines.append('apf_exporter_refresh_duration_seconds %.3f' %duration)
+        lines.append('# HELP apf_exporter_phase_seconds Wall time of each phase of the last refresh.')
+        lines.append('# TYPE apf_exporter_phase_seconds gauge')
+        for phase in phases:
+            lines.append('apf_exporter_phase_seconds{phase="%s"} %.3f' %(escape(phase['phase']), phase['wall']))
+        lines.append('# HELP apf_exporter_phase_cpu_seconds CPU time of each phase of the last refresh.')
+        lines.append('# TYPE apf_exporter_phase_cpu_seconds gauge')
+        for phase in phases:
+            lines.append('apf_exporter_phase_cpu_seconds{phase="%s"} %.3f' %(escape(phase['phase']), phase['cpu']))
+        lines.append('# HELP apf_exporter_phase_items Number of items processed in each phase of the last refresh.')
+        lines.append('# TYPE apf_exporter_phase_items gauge')
+        for phase in phases:
+            lines.append('apf_exporter_phase_items{phase="%s"} %d' %(escape(phase['phase']), phase['count']))
+
+        # replacing the reference is atomic,
+        # requests get either the old or the new buffer
+        self.buffer = '\n'.join(lines) + '\n'
+
+
+    def run(self):
+        """
+        refreshes the metrics forever
+        """
+        while True:
+            start = time.time()
+            try:
+                self.refresh()
+            except Exception, ex:
+                self.log.error('refreshing the metrics failed: %s' %ex)
+            time.sleep(max(self.interval - (time.time() - start), 1))
+
+
+
+class ExporterHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        buffer = self.server.exporter.buffer
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(buffer)))
+        self.end_headers()
+        self.wfile.write(buffer)
+
+    def log_message(self, format, *args):
+        # one line per scrape would be too verbose
+        pass
+
+
+class ExporterServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, exporter):
+        BaseHTTPServer.HTTPServer.__init__(self, address, ExporterHandler)
+        self.exporter = exporter
+
+
+def serve(args, address, interval=60):
+    """
+    starts the background refreshes, and serves the metrics forever.
+    address is [host:]port
+    """
+    if ':' in address:
+        host, port = address.rsplit(':', 1)
+    else:
+        host, port = '', address
+    exporter = QueueStatusExporter(args, interval)
+    server = ExporterServer((host, int(port)), exporter)
+
+    t = threading.Thread(target=exporter.run)
+    t.daemon = True
+    t.start()
+
+    server.serve_forever()
+
+
+def escape(value):
+    """
+    escapes a label value
+    """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
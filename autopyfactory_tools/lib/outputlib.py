@@ -0,0 +1,151 @@
+#!/bin/env python
+
+"""
+Writers for the output of the query classes in querylib.
+Rows are written one by one, as they are produced,
+so the whole output never needs to be in memory.
+
+TableWriter is for humans. The other writers keep the type
+of the values, for other programs:
+
+    ndjson: one JSON object per line
+    csv:    comma separated values, with a first line with the field names
+    bin:    the snapshot format from cachelib, 
+            which can be read with cachelib.readheader( ) and readstream( )
+"""
+
+import csv
+import json
+
+from autopyfactory_tools.lib import cachelib
+
+
+class TableWriter(object):
+    """
+    writes rows, lists of strings, as aligned columns:
+    each field is followed by two white spaces,
+    plus the ones needed to reach the width of its column.
+
+    When the widths are known in advance -for example, calculated
+    by the Container- they can be given to the constructor.
+    Otherwise, they are calculated from the first rows,
+    which are kept in memory until there are sample of them.
+    After that, a field longer than its column makes it wider
+    from that row on.
+
+    With align=False, fields are just separated by a tab,
+    which is easier to parse by other programs.
+    """
+
+    def __init__(self, out, widths=None, align=True, sample=1000):
+
+        self.out = out
+        self.align = align
+        self.sample = sample
+        self.buffer = []
+        self.format = None
+        self.linelength = None
+        if widths is not None:
+            self._setwidths(widths)
+
+
+    def write(self, row):
+
+        if not self.align:
+            self.out.write('\t'.join(row) + '\n')
+            return
+
+        if self.format is None:
+            self.buffer.append(row)
+            if len(self.buffer) >= self.sample:
+                self._flushbuffer()
+            return
+
+        line = self.format %tuple(row)
+        if len(line) > self.linelength:
+            # some field is longer than its column
+            widths = [max(width, len(field)) for width, field in zip(self.widths, row)]
+            self._setwidths(widths)
+            line = self.format %tuple(row)
+        self.out.write(line)
+
+
+    def close(self):
+        """
+        writes the rows still in memory, if any
+        """
+        if self.buffer:
+            self._flushbuffer()
+
+
+    def _flushbuffer(self):
+
+        widths = [0] * len(self.buffer[0])
+        for row in self.buffer:
+            for i, field in enumerate(row):
+                if len(field) > widths[i]:
+                    widths[i] = len(field)
+        if self.format is not None:
+            widths = [max(w1, w2) for w1, w2 in zip(widths, self.widths)]
+        self._setwidths(widths)
+
+        buffer = self.buffer
+        self.buffer = []
+        write = self.out.write
+        format = self.format
+        for row in buffer:
+            write(format %tuple(row))
+
+
+    def _setwidths(self, widths):
+
+        self.widths = widths
+        self.format = ''.join(['%%-%ds  ' %width for width in widths]) + '\n'
+        self.linelength = sum(widths) + 2*len(widths) + 1
+
+
+
+class NdjsonWriter(object):
+
+    def __init__(self, out, fields):
+        self.out = out
+        self.fields = fields
+
+    def write(self, row):
+        self.out.write(json.dumps(dict(zip(self.fields, row)), separators=(',', ':')) + '\n')
+
+    def close(self):
+        pass
+
+
+class CsvWriter(object):
+
+    def __init__(self, out, fields):
+        self.writer = csv.writer(out)
+        self.writer.writerow(fields)
+
+    def write(self, row):
+        row = [value.encode('utf-8') if isinstance(value, unicode) else value for value in row]
+        self.writer.writerow(row)
+
+    def close(self):
+        pass
+
+
+class BinWriter(object):
+
+    def __init__(self, out, fields):
+        self.out = out
+        cachelib.writeheader(out, fields)
+
+    def write(self, row):
+        cachelib.writevalues(self.out, row)
+
+    def close(self):
+        pass
+
+
+# writers for typed rows, by name of the format
+RECORD_WRITERS = {'ndjson' : NdjsonWriter,
+                  'csv'    : CsvWriter,
+                  'bin'    : BinWriter}
@@ -1,10 +1,64 @@
 #!/bin/env python
 
-import copy
+import array
+import cStringIO
+import heapq
+import itertools
+import operator
+import os
+import re
 import subprocess
+import sys
+import tempfile
+import threading
 import time
+# the module Queue is renamed, as there is a class Queue in this file
+import Queue as pyqueue
 
-import htcondor
+from autopyfactory_tools.lib import brokerlib, fakehtcondor, timinglib
+from autopyfactory_tools.lib.cachelib import SnapshotCache, typedvalue
+from autopyfactory_tools.lib.eventloglib import EventLogState
+from autopyfactory_tools.lib.outputlib import TableWriter, RECORD_WRITERS
+
+
+class LazyModule(object):
+    """
+    the module is only imported the first time one of its 
+    attributes is used. 
+    When the query broker answers, htcondor is never needed.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = __import__(self._name)
+        return getattr(self._module, attr)
+
+# with APF_FAKE_HTCONDOR set, htcondor is the in-process fake
+fakehtcondor.installfromenv()
+htcondor = LazyModule('htcondor')
+
+
+# letter of each JobStatus in the condorq output
+JOB_STATUS_CODES = {'0': 'U', 
+                    '1': 'I',
+                    '2': 'R',
+                    '3': 'X',
+                    '4': 'C',
+                    '5': 'H',
+                    '6': 'E'}
+
+# names of the job status, indexed by the value of JobStatus
+QUEUE_STATUSES = ['unsub',
+                  'idle',
+                  'running',
+                  'removed',
+                  'completed',
+                  'held',
+                  'error']
 
 # =============================================================================
 #                        CONDOR CLASSES
@@ -36,93 +90,271 @@ class CondorQuery(object):
         self.args = args
         self.container = Container(self)
 
+        # ClassAd expression sent to HTCondor together with the query,
+        # so the filtering is done on the server side
+        self.constraint = getattr(args, 'constraint', None) or 'true'
+
+        # timings of each phase, with --timing or when there are hooks
+        self.timer = timinglib.timer(self.__class__.__name__, args)
+        if self.timer is not None:
+            self._clean = self.timer.function('_clean', self._clean)
+
 
     def run(self):
 
-        self._query()
-        self._store()
-        self._sort()
+        with self._phase('query'):
+            self._query()
+        with self._phase('_store'):
+            self._store()
+        with self._phase('_sort'):
+            self._sort()
+
+
+    def stream(self):
+        """
+        generator equivalent to run( ) + get( )
+
+        Each line is yielded as soon as the corresponding ClassAd 
+        has been received from HTCondor. 
+        Nothing is stored in self.container, 
+        so memory usage does not depend on the size of the query output. 
+        Lines are not sorted.
+
+        The rows come from _iterstore( ), and each value 
+        is formatted by the column of self.item it would be stored in.
+        """
+
+        with self._phase('query'):
+            self._query()
+        first = True
+        fields, columns = self.item.columns(self.args)
+        rows = self._timed('_store', self._iterstore())
+        if getattr(self.args, 'limit', None):
+            # lines are not sorted, these are just the first ones
+            rows = itertools.islice(rows, self.args.limit)
+        for row in rows:
+            if first:
+                first = False
+                if self.args.headers == True:
+                    yield fields
+            yield [column.format(value) for column, value in zip(columns, row)]
+
+
+    def fields(self):
+        """
+        names of the values in each row from records( )
+        """
+        return self.query_attributes
+
+
+    def records(self):
+        """
+        generator of the output of the query, one row per ClassAd, 
+        with the values of the attributes in fields( ).
+        Values keep their type -integers, floats, booleans, strings,
+        or None when undefined-, as they do not go through _clean( ).
+        Like stream( ), nothing is kept in memory. 
+        """
+
+        with self._phase('query'):
+            self._query()
+        fields = self.fields()
+        classads = self.out
+        if getattr(self.args, 'limit', None):
+            classads = itertools.islice(classads, self.args.limit)
+        for classad in classads:
+            yield [typedvalue(classad.get(attr)) for attr in fields]
+
+
+    def writerecords(self, format, out=sys.stdout):
+        """
+        writes the output of records( ) into out, 
+        in one of the formats in outputlib.RECORD_WRITERS
+        """
+
+        with self._phase('write'):
+            out = self._output(out)
+            writer = RECORD_WRITERS[format](out, self.fields())
+            for row in self.records():
+                writer.write(row)
+            writer.close()
+
+
+    def iterprintable(self):
+        """
+        generator version of printable( ), one line at a time.
+        As the lenght of the fields is not known in advance, 
+        they are just separated by two white spaces.
+        """
+
+        for line in self.stream():
+            yield '  '.join(line)
 
     def _query(self):
         raise NotImplementedError
 
 
-    def _store(self):
+    def _phase(self, name):
         """
-        The code for this method is always almost the same. 
-        It will look like this
-
-            def _store(self):
-                for job_classad in self.out:
-                    dict_attr = self._clean(job_classad)
-                    new_item = XYZ(dict_attr)
-                    self.container.add(new_item)
-
-        where XYZ is the actual kind of objects being stored:
-        Job()'s, Slot()'s, ...
-     
-        We force this method to be implemented by the child classes
-        because if will add objects to the self.container list,
-        but these objects are of different classes each time:
-           Job, Slot, ...
-        So, to have it implemented here, we would need a way to pass
-        it somehow. For example, passing the class to the __init__
-        via the super( ) call. Something like this
-
-           class Child:
-               def __init__(self):
-                   super(Child, self).__init__(Job)
-     
-        and this class will receive it, like this
-
-           class CondorQuery:
-               def __init__(self, ItemType):
-                   self.ItemType = ItemType
-
-               def _store(self):
-                   for job_classad in self.out:
-                       dict_attr = self._clean(job_classad)
-                       new_item = ItemType(dict_attr)
-                       self.container.add(new_item)
-
-        Another way would be passing a string, and from there
-        getting the right object like a plugin. 
-
-        In any case, forcing it to be re-implemented on every child
-        class seems to be a little bit cleaner
+        context manager timing a phase, when there is a timer
         """
-        raise NotImplementedError
+        if self.timer is None:
+            return timinglib.NOPHASE
+        return self.timer.phase(name)
 
 
-    def _clean(self, job_classad):
+    def _timed(self, name, iterable):
+        """
+        iterable, timing how long it takes to get each item 
+        when there is a timer.
+        Used for the lazy phases, like receiving the ClassAds 
+        from xquery( )
         """
-        this method is to clean the dictionary in the classad
+        if self.timer is None:
+            return iterable
+        return self.timer.wrap(name, iterable)
 
-        The output returned by htcondor python query( ) methods 
-        may contain more key:value pairs that we want
 
-        Also, some of them could be missing, so we add a 
-             "undefined"
-        string in it.
+    def _output(self, out):
+        """
+        out, counting the bytes written when there is a timer
+        """
+        if self.timer is None:
+            return out
+        return self.timer.output('write', out)
+
 
-        Also, we force all values to be strings. 
-        The output of query( ) methods sometimes include integers
-        and floats. 
-        We convert them to strings. 
-        It is up to the class to digest the output to treat them
-        in a different way if needed.    
+    def _schedds(self):
+        """
+        list of (name, location ClassAd) of the schedds to be queried.
+        By default, only the local schedd. 
+        With --pool or --all-schedds, all schedds 
+        located through the collector.
+        """
+        if not multischedd(self.args):
+            return [('local', None)]
+
+        pool = getattr(self.args, 'pool', None) or ''
+        function = lambda: self._collector(pool).locateAll(htcondor.DaemonTypes.Schedd)
+        schedd_ads = self._fetch('locate', pool, 'true', ['Name'], function)
+        return [(ad['Name'], ad) for ad in schedd_ads]
+
+
+    def _collector(self, pool):
+        if pool:
+            return htcondor.Collector(pool)
+        else:
+            return htcondor.Collector()
+
+
+    def _schedd(self, name, ad):
+        """
+        htcondor.Schedd object for a schedd from _schedds( )
+        """
+        if ad is None:
+            return htcondor.Schedd()
+        if isinstance(ad, dict):
+            # the location came from the broker or the cache,
+            # and only includes the name
+            pool = getattr(self.args, 'pool', None) or ''
+            ad = self._collector(pool).locate(htcondor.DaemonTypes.Schedd, name)
+        return htcondor.Schedd(ad)
 
-        And finally, we force all variables and values to be lower case
+
+    def _fanout_query(self, constraint, attributes):
+        """
+        queries all schedds from _schedds( ) concurrently.
+        Returns an iterator with the ClassAds from all of them, 
+        in the order they are received.
+        """
+        sources = []
+        for name, ad in self._schedds():
+            if getattr(self.args, 'delta', False):
+                function = lambda name=name, ad=ad: self._delta(name, self._schedd(name, ad), constraint, attributes)
+            else:
+                query = lambda name=name, ad=ad: self._schedd(name, ad).xquery(constraint, attributes)
+                function = lambda name=name, query=query: self._fetch('schedd', name, constraint, attributes, query)
+            sources.append((name, function))
+        timeout = getattr(self.args, 'timeout', None)
+        return fanout(sources, timeout)
+
+
+    def _fetch(self, daemon, name, constraint, attributes, function):
+        """
+        returns the output of function( ), which performs the actual query
+        to the HTCondor daemon (schedd, collector) called name.
+
+        If the query broker is running, the output is requested to it,
+        and function( ) is not called.
+        Otherwise, if the cache is enabled, with --cache-ttl, the output 
+        is read from a recent enough snapshot of the same query, when there is one.
         """
+        if not getattr(self.args, 'no_broker', False):
+            request = {'daemon'     : daemon,
+                       'name'       : name,
+                       'constraint' : constraint,
+                       'attributes' : attributes}
+            if daemon == 'schedd' and multischedd(self.args):
+                request['pool'] = getattr(self.args, 'pool', None) or ''
+            out = brokerlib.query(request, getattr(self.args, 'broker', None))
+            if out is not None:
+                return out
+
+        ttl = getattr(self.args, 'cache_ttl', None)
+        if not ttl:
+            return function()
+        cache = SnapshotCache(getattr(self.args, 'cache_dir', None), ttl)
+        source = '%s %s' %(daemon, name)
+        return cache.get(source, constraint, attributes, function)
+
+
+    def _delta(self, name, schedd, constraint, attributes):
+        """
+        returns the jobs of the schedd called name, 
+        from a snapshot refreshed only with the jobs that changed 
+        since the previous call. The snapshot is not refreshed 
+        if it is more recent than --cache-ttl. 
+        The query broker is not used.
+        """
+        ttl = getattr(self.args, 'cache_ttl', None) or 0
+        cache = SnapshotCache(getattr(self.args, 'cache_dir', None), ttl)
+        query = lambda constraint, attributes: schedd.xquery(constraint, attributes)
+        return cache.delta('schedd %s' %name, constraint, attributes, query)
 
-        dict_attr = {}
-        for attr in self.query_attributes:
-            key = attr.lower()
-            value = job_classad.get(attr, "undefined")
-            value = str(value)
-            value = value.lower() 
-            dict_attr[key] = value
-        return dict_attr
+
+    def _store(self):
+        """
+        stores the rows from _iterstore( ) in the Container, 
+        in the columns of self.item, the kind of Item of the query: 
+        Job, Slot, ...
+        """
+        self.container.addrows(self.item, self._iterstore())
+
+
+    def _iterstore(self):
+        """
+        generator of the rows, one per ClassAd, from _clean( )
+        """
+        for classad in self.out:
+            yield self._clean(classad)
+
+
+    def _clean(self, classad):
+        """
+        this method is to clean a ClassAd from the query output.
+
+        The output returned by htcondor python query( ) methods 
+        may contain more key:value pairs that we want, 
+        and some of them could be missing.
+
+        It returns a list with one value per field of self.item, 
+        in the order of its list_attr, as it is stored in its columns:
+        usually strings, like from cleanvalue( ), in lower case 
+        and "undefined" when missing, but also integers 
+        for the fields kept in a NumberColumn. 
+        No object is created for each row.
+        """
+        raise NotImplementedError
 
     def _sort(self):
         self.container.sort()
@@ -136,41 +368,53 @@ class CondorQuery(object):
         this method is just to get a printable version of the content
         being handle
     
-        We calculate, the maximum lenght for each field 
-        -in other words, each item at position i for each list-.
-        Then we just double loop over the list of lists, 
-        print each field, and the needed number of white spaces to 
-        reach the maximum previously calculated for that field.
+        The maximum lenght for each field 
+        -in other words, each item at position i for each list-
+        is calculated by the Container, column by column.
+        Then each field is printed with the needed number 
+        of white spaces to reach that maximum. 
         That way, all fields are always displayed well aligned. 
         """
 
-        matrix = self.get()
-
-        if len(matrix) == 0:
-            return ""
-        
-        # if there is actual content in the matrix...
-    
-        # 1. first we calculate the maximum lengths
-        maxs = []
-        for i in range(len(matrix[0])):
-            # max length for field i on every line in out:
-            max_i = max(len(line[i]) for line in matrix)
-            maxs.append(max_i)
-    
-        # 2. then we double loop over the matrix 
-    
-        s = ""
-        for line in matrix:
-            for i in range(len(line)):
-                s += "%s  " %line[i]
-                s += " " * (maxs[i] - len(line[i]))
-            s += '\n'
-    
+        out = cStringIO.StringIO()
+        self.write(out)
+        s = out.getvalue()
         s = s[:-1] # to remove the last \n
         return s
 
 
+    def write(self, out=sys.stdout):
+        """
+        same output as printable( ), but written directly into out,
+        line by line. 
+        With --no-align, fields are separated by tabs, not aligned.
+        """
+
+        with self._phase('write'):
+            align = not getattr(self.args, 'no_align', False)
+            widths = None
+            if align:
+                widths = self.container.widths()
+            writer = TableWriter(self._output(out), widths, align)
+            for line in self.container.iterget():
+                writer.write(line)
+            writer.close()
+
+
+    def writestream(self, out=sys.stdout):
+        """
+        same as write( ), but from stream( ) instead of run( ).
+        Widths of the columns are calculated from the first lines.
+        """
+
+        with self._phase('write'):
+            align = not getattr(self.args, 'no_align', False)
+            writer = TableWriter(self._output(out), None, align)
+            for line in self.stream():
+                writer.write(line)
+            writer.close()
+
+
 
 
 
@@ -178,6 +422,9 @@ class condorq(CondorQuery):
 
     def __init__(self, args=None):
 
+        # the kind of rows of the output
+        self.item = Job
+
         # this is the list of HTCondor Job's ClassAds to query 
         self.query_attributes = ['ClusterId', 
                                 'ProcId', 
@@ -189,24 +436,66 @@ class condorq(CondorQuery):
                                 'EC2AmiID', 
                                 'MATCH_APF_QUEUE']
 
+        if multischedd(args):
+            # the schedd name is part of GlobalJobId
+            self.query_attributes.append('GlobalJobId')
+
         super(condorq, self).__init__(args)
 
 
     def _query(self):
-        schedd = htcondor.Schedd()
-        self.out = schedd.query('true', self.query_attributes)
+        if multischedd(self.args):
+            out = self._fanout_query(self.constraint, self.query_attributes)
+        elif getattr(self.args, 'delta', False):
+            out = self._delta('local', htcondor.Schedd(), self.constraint, self.query_attributes)
+        else:
+            if streaming(self.args):
+                # xquery( ) returns an iterator, 
+                # ClassAds are received from the schedd on demand
+                function = lambda: htcondor.Schedd().xquery(self.constraint, self.query_attributes)
+            else:
+                function = lambda: htcondor.Schedd().query(self.constraint, self.query_attributes)
+            out = self._fetch('schedd', 'local', self.constraint, self.query_attributes, function)
+        self.out = self._timed('receive', out)
 
-    def _store(self):
-        for job_classad in self.out:
-            dict_attr = self._clean(job_classad)
-            new_item = Job(dict_attr, self.args)
-            self.container.add(new_item)
+    def _clean(self, job_classad):
+        """
+        the job id as (clusterid, procid), qdate as seconds since epoch, 
+        and the time in the current status, for running jobs, as seconds.
+        The rest as strings
+        """
+        try:
+            qdate = int(float(job_classad.get('QDate', -1)))
+        except ValueError:
+            qdate = -1
+        jobstatus = cleanvalue(job_classad, 'JobStatus')
+        timecurrentstatus = 0
+        if jobstatus == '2':
+            try:
+                timecurrentstatus = int(time.time() - float(job_classad.get('EnteredCurrentStatus')))
+            except (TypeError, ValueError):
+                pass
+        row = [(int(job_classad.get('ClusterId', -1)), int(job_classad.get('ProcId', -1))),
+               cleanvalue(job_classad, 'Owner'),
+               qdate,
+               cleanvalue(job_classad, 'Cmd'),
+               JOB_STATUS_CODES.get(jobstatus, jobstatus),
+               timecurrentstatus,
+               cleanvalue(job_classad, 'EC2AmiID'),
+               cleanvalue(job_classad, 'MATCH_APF_QUEUE')]
+        if multischedd(self.args):
+            # GlobalJobId looks like  <schedd name>#<clusterid>.<procid>#<qdate>
+            row.append(cleanvalue(job_classad, 'GlobalJobId').split('#')[0])
+        return row
 
 
 class condorstatus(CondorQuery):
 
     def __init__(self, args=None):
 
+        # the kind of rows of the output
+        self.item = Slot
+
         # this is the list of HTCondor startd's ClassAds to query 
         self.query_attributes = ['Name',
                                  'SlotID',
@@ -223,17 +512,90 @@ class condorstatus(CondorQuery):
         super(condorstatus, self).__init__(args)
 
     def _query(self):
+        """
+        all pools are queried concurrently. 
+        Pools not answering within --timeout seconds are ignored.
+        """
+        sources = []
+        for collectors in self._pools():
+            function = lambda collectors=collectors: self._query_pool(collectors)
+            sources.append((','.join(collectors), function))
+        timeout = getattr(self.args, 'timeout', None)
+        self.out = self._timed('receive', self._unique(fanout(sources, timeout)))
 
-        collector_name = htcondor.param.get('COLLECTOR_HOST')
-        collector = htcondor.Collector(collector_name)
-        self.out = collector.query(htcondor.AdTypes.Startd, "true", self.query_attributes)
 
+    def _pools(self):
+        """
+        list of pools to query. 
+        Each pool is a list of high availability collectors, 
+        like the value of COLLECTOR_HOST:
 
-    def _store(self):
-        for job_classad in self.out:
-            dict_attr = self._clean(job_classad)
-            new_item = Slot(dict_attr, self.args)
-            self.container.add(new_item)
+            [ ['cm1.domain', 'cm2.domain'], ['cm.otherdomain:9619'] ]
+        """
+        pools = getattr(self.args, 'pool', None)
+        if not pools:
+            # COLLECTOR_HOST is only needed when no pool is given 
+            pools = [htcondor.param.get('COLLECTOR_HOST', '')]
+        out = []
+        for pool in pools:
+            collectors = [name.strip() for name in pool.split(',') if name.strip()]
+            out.append(collectors)
+        return out
+
+
+    def _query_pool(self, collectors):
+        """
+        queries the collectors of a pool in order, until one answers.
+        A collector not answering within --ha-timeout seconds
+        is skipped, without waiting for the TCP timeout.
+        """
+        hatimeout = getattr(self.args, 'ha_timeout', None)
+        if not collectors:
+            # no COLLECTOR_HOST, the default collector is used
+            collectors = [None]
+        for collector_name in collectors:
+            function = lambda collector_name=collector_name: self._query_collector(collector_name)
+            try:
+                return timedcall(function, hatimeout)
+            except Exception, ex:
+                sys.stderr.write('query to collector %s failed: %s\n' %(collector_name, ex))
+        raise Exception('no collector answered')
+
+
+    def _query_collector(self, collector_name):
+        function = lambda: self._collector(collector_name).query(htcondor.AdTypes.Startd, 
+                                                                 self.constraint, 
+                                                                 self.query_attributes)
+        return self._fetch('collector', collector_name or '', self.constraint, self.query_attributes, function)
+
+
+    def _unique(self, slots):
+        """
+        a slot may be reported by more than one pool.
+        Only the first ClassAd for each Name is kept.
+        """
+        names = set()
+        for slot in slots:
+            name = slot.get('Name')
+            if name in names:
+                continue
+            names.add(name)
+            yield slot
+
+
+    def _clean(self, slot_classad):
+        """
+        the name as  machine:slot, indented for dynamic slots.
+        The rest as strings
+        """
+        name = cleanvalue(slot_classad, 'Name')
+        if '@' in name:
+            (slot, machine) = name.split('@', 1)
+            name = '%s:%s' %(machine, slot)
+        if cleanvalue(slot_classad, 'SlotType') == 'dynamic':
+            name = '      %s' %name
+        # the other fields are the attributes queried, but SlotType
+        return [name] + [cleanvalue(slot_classad, attr) for attr in self.query_attributes[1:-1]]
 
 
 
@@ -242,6 +604,9 @@ class queuestatus(CondorQuery):
 
     def __init__(self, args=None):
 
+        # the kind of rows of the output
+        self.item = Queue
+
         self.args = args
 
         # this is the list of HTCondor Job's ClassAds to query 
@@ -262,370 +627,777 @@ class queuestatus(CondorQuery):
 
 
     def _query(self):
-        schedd = htcondor.Schedd()
-        queryout = schedd.query('true', self.query_attributes)
+        # jobs not submitted by APF are filtered out by the schedd
+        constraint = 'MATCH_APF_QUEUE =!= undefined'
+        if self.constraint != 'true':
+            constraint = '(%s) && (%s)' %(constraint, self.constraint)
+
+        logsdir = getattr(self.args, 'from_logs', None)
+        if logsdir:
+            # the schedd is not queried at all, 
+            # jobs status comes from their event logs
+            statefile = getattr(self.args, 'logs_state', None) or default_logs_state()
+            state = EventLogState(logsdir, statefile)
+            state.update()
+            queryout = state.classads()
+        elif multischedd(self.args):
+            # jobs from all schedds are aggregated together 
+            queryout = self._fanout_query(constraint, self.query_attributes)
+        else:
+            function = lambda: htcondor.Schedd().xquery(constraint, self.query_attributes)
+            queryout = self._fetch('schedd', 'local', constraint, self.query_attributes, function)
 
         # we now need to aggregate the output by queues
-        self._aggregateinfo(queryout)
+        with self._phase('_aggregateinfo'):
+            self._aggregateinfo(self._timed('receive', queryout))
 
 
     def _aggregateinfo(self, queryout):
+        """
+        aggregates the jobs by queue in a single pass. 
+        queryout can be an iterator, it is never stored.
 
-        status_mappings = {'0': 'unsub',
-                           '1': 'idle',
-                           '2': 'running',
-                           '3': 'removed',
-                           '4': 'completed',
-                           '5': 'held',
-                           '6': 'error'}
+        For each queue we only keep a list of integers:
 
-        if self.args.longest:
-            emptydict = {'unsub'          : 0,
-                         'idle'           : 0,
-                         'running'        : 0,
-                         'removed'        : 0,
-                         'completed'      : 0,
-                         'held'           : 0,
-                         'error'          : 0,
-                         'longestidle'    : 0,
-                         'longestrunning' : 0,}
-        else:
-            emptydict = {'unsub'     : 0,
-                         'idle'      : 0,
-                         'running'   : 0,
-                         'removed'   : 0,
-                         'completed' : 0,
-                         'held'      : 0,
-                         'error'     : 0}
-
-        # just in case self.args.longest is True
-        longestidle = 0     
-        longestrunning = 0  
-        now = float(time.time())
+            [ unsub, idle, running, removed, completed, held, error,
+              EnteredCurrentStatus of the oldest idle job,
+              EnteredCurrentStatus of the oldest running job ]
+
+        the first ones indexed directly by JobStatus. 
+        Therefore memory depends only on the number of queues. 
+        """
+
+        nstatus = len(QUEUE_STATUSES)
+        longest = self.args.longest
 
         queues = {}
         for job in queryout:
-            if not 'MATCH_APF_QUEUE' in job.keys():
+            apfqname = job.get('MATCH_APF_QUEUE')
+            if apfqname is None:
                 # This job is not managed by APF. Ignore...
                 continue
-            apfqname = job['match_apf_queue']
-            if apfqname not in queues.keys():
-                queues[apfqname] = copy.copy(emptydict)
-
-            jobstatus = str(job['jobstatus'])
-            jobstatus = status_mappings[jobstatus]
-
-            queues[apfqname][jobstatus] += 1
+            counters = queues.get(apfqname)
+            if counters is None:
+                counters = [0] * nstatus + [None, None]
+                queues[apfqname] = counters
 
-            if self.args.longest:
-            # we calculate the longest idle time and longest running time               
-               if jobstatus == 'running':
-                   newrunningtime = now - float(job['enteredcurrentstatus'])
-                   queues[apfqname]['longestrunning'] = max(newrunningtime, queues[apfqname]['longestrunning'])
-               if jobstatus == 'idle':
-                   newidletime = now - float(job['enteredcurrentstatus'])
-                   queues[apfqname]['longestidle'] = max(newidletime, queues[apfqname]['longestidle'])
+            jobstatus = int(job['JobStatus'])
+            if jobstatus >= nstatus:
+                continue
+            counters[jobstatus] += 1
 
+            if longest and (jobstatus == 1 or jobstatus == 2):
+                # we keep the earliest time a job became idle or running
+                i = nstatus + jobstatus - 1
+                entered = int(float(job['EnteredCurrentStatus']))
+                if counters[i] is None or entered < counters[i]:
+                    counters[i] = entered
 
+        self.aggregates = queues
 
         # now we convert integers into strings 
-        for k,v in queues.iteritems():
-            for k2, v2 in v.iteritems():
-                queues[k][k2] = str(v2)
-
-        # if needed, we convert longest idle and running time into friendly format
-        if self.args.longest:
-            for queue in queues.keys():
-                t = int(float( queues[queue]['longestrunning'] ))
-                newt = formattime(t)
-                queues[queue]['longestrunning'] = newt
-
-                t = int(float( queues[queue]['longestidle'] ))
-                newt = formattime(t)
-                queues[queue]['longestidle'] = newt
+        now = int(time.time())
+        out = {}
+        for apfqname, counters in queues.iteritems():
+            dict_attr = {}
+            for i in range(nstatus):
+                dict_attr[QUEUE_STATUSES[i]] = str(counters[i])
+            if longest:
+                # we convert longest idle and running time into friendly format
+                for i, key in [(nstatus, 'longestidle'), (nstatus+1, 'longestrunning')]:
+                    if counters[i] is None:
+                        dict_attr[key] = formattime(0)
+                    else:
+                        dict_attr[key] = formattime(max(now - counters[i], 0))
+            out[apfqname] = dict_attr
 
         # for backwards compatibility
         if not self.args.new:
-            for q in queues.keys():
-                for status in queues[q]:
-                    queues[q][status] = '%s = %s' %(status.upper(), queues[q][status])
+            for q in out.keys():
+                for status in out[q]:
+                    out[q][status] = '%s = %s' %(status.upper(), out[q][status])
 
-        self.out = queues
+        self.out = out
 
 
-    def _store(self):
+    def fields(self):
+        fields = ['MATCH_APF_QUEUE'] + QUEUE_STATUSES
+        if self.args.longest:
+            fields += ['longestidle', 'longestrunning']
+        return fields
+
 
+    def records(self):
+        """
+        one row per queue, with the number of jobs in each status, 
+        and, with --longest, the longest idle and running times 
+        in seconds.
+        Rows are sorted like in the text output, by --sort-by 
+        or by name, and only the first --limit ones are returned.
+        """
+
+        with self._phase('query'):
+            self._query()
+        nstatus = len(QUEUE_STATUSES)
+        now = int(time.time())
+        rows = []
+        for apfqname, counters in self.aggregates.iteritems():
+            row = [apfqname] + counters[:nstatus]
+            if self.args.longest:
+                for entered in counters[nstatus:]:
+                    if entered is None:
+                        row.append(0)
+                    else:
+                        row.append(max(now - entered, 0))
+            rows.append(row)
+
+        # the values are integers already, so they are compared directly.
+        # One stable sort per field, from the last one to the first
+        fields = self.item.fields(self.args)
+        for field, descending in reversed(sortfields(self.item, self.args)):
+            rows.sort(key=operator.itemgetter(fields.index(field)), reverse=descending)
+        if getattr(self.args, 'limit', None):
+            rows = itertools.islice(rows, self.args.limit)
+        for row in rows:
+            yield row
+
+
+    def _iterstore(self):
+        fields = self.item.fields(self.args)
         for qname in self.out.keys():
             dict_attr = self.out[qname] 
             dict_attr['qname'] = qname
-            new_item = Queue(dict_attr, self.args)
-            self.container.add(new_item)
+            yield [dict_attr[field] for field in fields]
 
 
 
 # =============================================================================
-#                        INFO TYPE CLASSES
+#                        SORTING UTILS
 # =============================================================================
 
+TIME_RE = re.compile(r'(\d+)\+(\d+):(\d+):(\d+)$')
 
-class Container(object):
+def sortkey(value):
     """
-    This class is just a container of objects.
-    It is actually a completely abstract class
-    so it can handle any kind of objects.
+    typed version of a displayed value, so fields are sorted 
+    by what they mean: numbers as numbers, and times like 
+    D+HH:MM:SS, from formattime( ), as seconds.
+    Anything else is sorted as a string.
+    """
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    m = TIME_RE.match(value)
+    if m:
+        days, hours, minutes, seconds = [int(x) for x in m.groups()]
+        return ((days*24 + hours)*60 + minutes)*60 + seconds
+    return value
+
 
-    NOTE: this is just legacy code, most probably it can be eliminated
+def queuekey(value):
     """
+    sortkey( ) of a value of apf-queue-status in the old format, 
+    like  IDLE = 73, so it is sorted as 73
+    """
+    return sortkey(value.split(' = ', 1)[-1])
 
-    def __init__(self, query):
 
-        self.query = query
-        self.objs = []
-        self.headers = []
+def parsesortby(sortby):
+    """
+    converts a --sort-by value, like  qdate,-enteredcurrentstatus
+    into a list of (field, descending)
+    """
+    out = []
+    for field in (sortby or '').split(','):
+        field = field.strip().lower()
+        if not field:
+            continue
+        if field.startswith('-'):
+            out.append((field[1:], True))
+        else:
+            out.append((field.lstrip('+'), False))
+    return out
 
-    def add(self, obj):
 
-        obj.container = self
-        self.objs.append(obj)
-        if not self.headers:
-            # this is the first object being added
-            self.headers = obj.list_attr
+def sortfields(item, args):
+    """
+    list of (field, descending) to sort the rows of item, 
+    an Item class, from --sort-by in args, 
+    or by default from the field sortby of item.
+    Raises ValueError for fields that item does not have.
+    """
+    sortby = parsesortby(getattr(args, 'sort_by', None))
+    if not sortby and item.sortby is not None:
+        sortby = [(item.sortby, False)]
+    fields = item.fields(args)
+    for field, descending in sortby:
+        if field not in fields:
+            raise ValueError('cannot sort by %s, it must be one of %s' %(field, ', '.join(fields)))
+    return sortby
 
 
-    def sort(self):
+class Descending(object):
+    """
+    wrapper reversing the comparisons of a value,
+    for descending order when the value cannot be negated
+    """
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __cmp__(self, other):
+        return cmp(other.value, self.value)
+
+
+# =============================================================================
+#                        INFO TYPE CLASSES
+# =============================================================================
+
+
+class Column(object):
+    """
+    This class stores all values of a given field.
+
+    The values are dictionary-encoded: 
+    each distinct value is stored only once, in self.values,
+    and for each row we only keep its position in that list, 
+    in a compact array of integers. 
+    Fields like owner, jobstatus or match_apf_queue have 
+    very few distinct values, even for millions of rows.
+    Fields with one distinct value per row are kept 
+    in a NumberColumn, an IdColumn or a ListColumn instead.
+    """
+
+    __slots__ = ('codes', 'values', 'index')
+
+    def __init__(self):
+
+        self.codes = array.array('i')
+        self.values = []
+        self.index = {}
+
+    def append(self, value):
+
+        code = self.index.get(value)
+        if code is None:
+            code = len(self.values)
+            self.index[value] = code
+            self.values.append(value)
+        self.codes.append(code)
+
+    def __getitem__(self, i):
+        return self.values[self.codes[i]]
+
+    def __len__(self):
+        return len(self.codes)
+
+    def format(self, value):
         """
-        For this method to work, 
-        the objects being stored are expected
-        to have a method __cmp__( ) implemented
+        displayed version of a value, as it is stored
         """
-        self.objs.sort()
+        return value
 
+    def width(self):
+        """
+        maximum length of all values in the column.
+        Only the distinct values need to be checked
+        """
+        if not self.values:
+            return 0
+        return max(len(value) for value in self.values)
 
-    def get(self):
+    def ranks(self, key=None):
+        """
+        returns an array with the position of each distinct value
+        after sorting them. 
+        Comparing ranks is equivalent to comparing values,
+        so rows can be sorted by integers.
+        """
+        ranks = array.array('i', [0] * len(self.values))
+        sortedcodes = sorted(range(len(self.values)), 
+                             key=lambda code: key(self.values[code]) if key else self.values[code])
+        for rank, code in enumerate(sortedcodes):
+            ranks[code] = rank
+        return ranks
+
+    def keyof(self, key, descending=False):
+        """
+        function returning the sort key of row i, 
+        from the values converted with key
+        """
+        ranks = self.ranks(key)
+        if descending:
+            ranks = array.array('i', [-rank for rank in ranks])
+        codes = self.codes
+        return lambda i: ranks[codes[i]]
 
-        out = []
-        if self.query.args.headers == True:
-            out.append(self.headers)
-        for obj in self.objs:
-           out.append(obj.get())
-        return out
+    def rowkey(self, value, key):
+        """
+        sort key of a value before it is stored
+        """
+        return key(value)
 
 
-class Item(object):
+class ListColumn(object):
+    """
+    strings with one distinct value per row, like slot names. 
+    They are kept in a plain list, 
+    as a dictionary would be as big as the list itself.
+    """
 
-    def __init__(self, dict_attr):
+    __slots__ = ('values',)
 
-        self.dict_attr = dict_attr
+    def __init__(self):
+        self.values = []
 
-        self._create_attributes()
-        self._format()
+    def append(self, value):
+        self.values.append(value)
 
+    def __getitem__(self, i):
+        return self.values[i]
 
-    def _format(self):
-        raise NotImplementedError
+    def __len__(self):
+        return len(self.values)
 
+    def format(self, value):
+        return value
 
-    def __cmp__(self):
-        raise NotImplementedError
+    def width(self):
+        if not self.values:
+            return 0
+        return max(len(value) for value in self.values)
+
+    def keyof(self, key, descending=False):
+        values = self.values
+        order = sorted(xrange(len(values)), key=lambda i: key(values[i]))
+        # equal values get the same rank, 
+        # so the next fields in --sort-by decide between them
+        ranks = array.array('i', [0] * len(values))
+        rank = 0
+        previous = None
+        for n, i in enumerate(order):
+            value = key(values[i])
+            if n and value != previous:
+                rank = n
+            ranks[i] = -rank if descending else rank
+            previous = value
+        return ranks.__getitem__
+
+    def rowkey(self, value, key):
+        return key(value)
+
+
+class NumberColumn(object):
+    """
+    numbers, like times, kept as they are received 
+    in a compact array, and formatted only when they are read.
+    Fields like qdate have one distinct value per row,
+    so dictionary-encoding their displayed values saves nothing.
+    Rows are sorted by the numbers themselves.
+    """
 
+    __slots__ = ('values', 'formatter')
 
-    def _create_attributes(self):
-        """ 
-        add a class attribute for each item in self.dict_attr
-        For example:
+    def __init__(self, formatter=str, typecode='l'):
+        self.values = array.array(typecode)
+        self.formatter = formatter
 
-              self.clusterid = self.attr_dict['clusterId']
-              self.procid = self.attr_dict['procid'] 
-              self.owner = self.attr_dict['owner'] 
-              Self.qdate = self.attr_dict['qdate'] 
-              self.cmd = self.attr_dict['cmd'] 
-              self.jobstatus = self.attr_dict['jobstatus']
-              self.enteredcurrentstatus = self.attr_dict['enteredcurrentstatus'] 
-              self.ec2amiid = self.attr_dict['ec2amiid'] 
-              self.match_apf_queue = self.attr_dict['match_apf_queue']
-              ...
+    def append(self, value):
+        self.values.append(value)
 
-        NOTE: this is not striclty needed.
-              We can manage directly dict_attr dictionary, 
-              but then the rest of the code is filled with stuff like
- 
-                 self.dict_attr[key] 
+    def __getitem__(self, i):
+        return self.formatter(self.values[i])
 
-              instead of
+    def __len__(self):
+        return len(self.values)
 
-                 self.key
+    def format(self, value):
+        return self.formatter(value)
 
-              Using class attributes seems to be a little bit cleaner.
-              That is the ONLY reason to do it this way.
-        """ 
-        for key, value in self.dict_attr.iteritems():
-             setattr(self, key, value)
+    def width(self):
+        """
+        the displayed values are longer for larger numbers,
+        so only the lowest and the highest ones are formatted
+        """
+        if not self.values:
+            return 0
+        return max(len(self.formatter(min(self.values))), len(self.formatter(max(self.values))))
 
+    def keyof(self, key, descending=False):
+        values = self.values
+        if descending:
+            return lambda i: -values[i]
+        return values.__getitem__
 
-    def get(self):
-        return [getattr(self,att) for att in self.list_attr]
+    def rowkey(self, value, key):
+        return value
 
 
+class IdColumn(object):
+    """
+    job ids, clusterid.procid, kept as two arrays of integers,
+    and sorted by them, so 57368.10 goes after 57368.9
+    """
 
-class Job(Item):
+    __slots__ = ('clusterids', 'procids')
+
+    def __init__(self):
+        self.clusterids = array.array('l')
+        self.procids = array.array('l')
+
+    def append(self, value):
+        clusterid, procid = value
+        self.clusterids.append(clusterid)
+        self.procids.append(procid)
+
+    def __getitem__(self, i):
+        return '%d.%d' %(self.clusterids[i], self.procids[i])
+
+    def __len__(self):
+        return len(self.clusterids)
+
+    def format(self, value):
+        return '%d.%d' %value
+
+    def width(self):
+        if not self.clusterids:
+            return 0
+        return max(len(str(clusterid)) + len(str(procid)) for clusterid, procid in itertools.izip(self.clusterids, self.procids)) + 1
+
+    def keyof(self, key, descending=False):
+        # one integer per id, and not a tuple, while sorting
+        clusterids = self.clusterids
+        procids = self.procids
+        factor = max(procids or [0]) + 1
+        if descending:
+            return lambda i: -(clusterids[i]*factor + procids[i])
+        return lambda i: clusterids[i]*factor + procids[i]
+
+    def rowkey(self, value, key):
+        return value
+
+
+class Container(object):
     """
-    This is the class to handle each Job.
+    This class is a columnar store for the output of the queries.
+    It is actually a completely abstract class
+    so it can handle any kind of Item.
+
+    There are no objects per row. 
+    Each row is a list with the values of the fields of the Item
+    -the ones in list_attr-, as returned by the _clean( ) method 
+    of the query, and they are appended to one column per field, 
+    the ones from the columns( ) method of the Item class.
+    The rows can be retrieved as lists with get( ),
+    or as Row objects with rows( ).
+
+    Rows are sorted by the fields in --sort-by, like
+
+        qdate,-enteredcurrentstatus
+
+    (a leading - means descending order), or by default 
+    by the field sortby of the Item class.
     """
 
-    def __init__(self, dict_attr, args):
+    def __init__(self, query):
+
+        self.query = query
+        self.headers = []
+        self.columns = []
+        # list of (field, descending)
+        self.sortby = []
+        self.sortkeys = {}
+        # order of the rows, after sorting 
+        self.order = None
+
+    def setup(self, item):
         """
-        attr_dict is each one of the objects returned by HTCondor query
+        headers, columns and sorting, from the Item class
         """
+        self.headers, self.columns = item.columns(self.query.args)
+        self.sortkeys = item.sortkeys
+        self.sortby = sortfields(item, self.query.args)
 
-        # this is the list of attributes, or fields,  
-        # we want to display in the output
-        self.list_attr = ['id', 
-                          'owner', 
-                          'qdate', 
-                          'cmd', 
-                          'jobstatus', 
-                          'enteredcurrentstatus', 
-                          'ec2amiid', 
-                          'match_apf_queue']
-  
-        super(Job, self).__init__(dict_attr)
+    def append(self, row):
 
-    
-    def _format(self):
+        for column, value in zip(self.columns, row):
+            column.append(value)
+        self.order = None
+
+    def addrows(self, item, rows):
         """
-        in this method we manipulate the content 
-        of the attr_dict input variables
-        to build the final output with the format we want
+        adds all rows from an iterable, 
+        with the columns of item, an Item class.
+
+        With --limit N, only the first N after sorting are kept. 
+        They are selected with a heap of N rows, 
+        compared by the sort keys of their stored values,
+        so the rows that will not be displayed are never 
+        stored or sorted.
         """
+        self.setup(item)
+        limit = getattr(self.query.args, 'limit', None)
+        if limit:
+            if self.sortby:
+                fields = []
+                for field, descending in self.sortby:
+                    i = self.headers.index(field)
+                    fields.append((i, self.columns[i], self.sortkeys.get(field, sortkey), descending))
+                key = lambda row: [descending and Descending(column.rowkey(row[i], k)) or column.rowkey(row[i], k)
+                                   for i, column, k, descending in fields]
+                rows = heapq.nsmallest(limit, rows, key=key)
+            else:
+                rows = itertools.islice(rows, limit)
+        for row in rows:
+            self.append(row)
+
+    def __len__(self):
+        if not self.columns:
+            return 0
+        return len(self.columns[0])
 
-        self.id = '%s.%s' %(self.clusterid, self.procid)
 
-        status_mappings = {'0': 'U', 
-                           '1': 'I',
-                           '2': 'R',
-                           '3': 'X',
-                           '4': 'C',
-                           '5': 'H',
-                           '6': 'E'}
-        self.jobstatus = status_mappings[self.jobstatus]
+    def sort(self):
+        """
+        sorts the rows by the fields in self.sortby. 
+        Values are compared by their typed version: 
+        numbers and job ids as they are stored, 
+        and strings converted with the sortkeys of the Item class, 
+        or sortkey( ).
+        The rows are not moved, only self.order is calculated.
+        """
+        if not self.sortby or not len(self):
+            return
+        keys = []
+        for field, descending in self.sortby:
+            column = self.columns[self.headers.index(field)]
+            keys.append(column.keyof(self.sortkeys.get(field, sortkey), descending))
+        if len(keys) == 1:
+            key = keys[0]
+            # rows are often received already sorted, by id for example
+            if all(key(i) <= key(i + 1) for i in xrange(len(self) - 1)):
+                self.order = None
+                return
+        # one stable sort per field, from the last one to the first,
+        # so no list of keys is built per row
+        order = range(len(self))
+        for key in reversed(keys):
+            order.sort(key=key)
+        self.order = array.array('i', order)
+
+
+    def _indexes(self):
+        if self.order is None:
+            return range(len(self))
+        return self.order
+
+
+    def rows(self):
+        """
+        generator of Row objects
+        """
+        for i in self._indexes():
+            yield Row(self, i)
 
-        if self.jobstatus == 'R':
-            self.timecurrentstatus = float(time.time()) - float(self.enteredcurrentstatus)
-            self.timecurrentstatus = int(self.timecurrentstatus)
-        else:
-            self.timecurrentstatus = 0
 
+    def widths(self):
+        """
+        maximum length of each field, 
+        including the headers when they are going to be displayed
+        """
+        widths = [column.width() for column in self.columns]
+        if self.query.args.headers == True:
+            widths = [max(width, len(header)) for width, header in zip(widths, self.headers)]
+        return widths
 
-        self.qdate = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(float(self.qdate)))
 
-        newt = formattime(self.timecurrentstatus)
-        self.enteredcurrentstatus = newt
+    def get(self):
+        return list(self.iterget())
 
 
-    def __cmp__(self, other):
+    def iterget(self):
         """
-        to sort all jobs by id number
+        generator version of get( )
         """
+        if self.query.args.headers == True and len(self):
+            yield self.headers
+        columns = self.columns
+        for i in self._indexes():
+            yield [column[i] for column in columns]
 
-        if self.id < other.id:
-            return -1
-        elif self.id > other.id:
-            return 1
-        else:
-            return 0
 
+class Row(object):
+    """
+    read-only view of a single row in a Container.
+    Fields are accessible as attributes:
 
-class Slot(Item):
+        row.id
+        row.match_apf_queue
     """
-    This is the class to handle each Slot
+
+    __slots__ = ('container', 'index')
+
+    def __init__(self, container, index):
+        self.container = container
+        self.index = index
+
+    def __getattr__(self, name):
+        try:
+            i = self.container.headers.index(name)
+        except ValueError:
+            raise AttributeError(name)
+        return self.container.columns[i][self.index]
+
+    def get(self):
+        return [column[self.index] for column in self.container.columns]
+
+
+class Item(object):
     """
+    Each kind of Item describes the rows of one query. 
+    There are no Item objects: the query converts each ClassAd, 
+    with _clean( ), into a list with the values of the fields, 
+    and they are stored directly in the columns of a Container.
+
+    Child classes define
+        list_attr: the fields to display
+        sortby:    the field used to sort the rows by default, or None
+        sortkeys:  functions to convert the displayed values 
+                   of some fields before comparing them. 
+                   By default, sortkey( ) is used.
+    and can override columns( ), to keep some fields 
+    in other kinds of columns than the dictionary-encoded Column.
+    """
+
+    list_attr = []
+    sortby = None
+    sortkeys = {}
 
-    def __init__(self, dict_attr, args):
+    @classmethod
+    def fields(cls, args):
         """
-        attr_dict is each one of the objects returned by HTCondor query
+        the fields to display, for the options in args
         """
+        return cls.list_attr
 
-        # this is the list of attributes, or fields,  
-        # we want to display in the output
-        self.list_attr = ['name',
-                          'slotid',
-                          'state',
-                          'activity',
-                          'nodetype',
-                          'loadavg',
-                          'remotegroup',
-                          'ec2instanceid',
-                          'ec2publicdns',
-                          'ec2amiid']
-  
-        super(Slot, self).__init__(dict_attr)
-
+    @classmethod
+    def columns(cls, args):
+        """
+        (fields, list of one column per field)
+        """
+        fields = cls.fields(args)
+        return fields, [Column() for field in fields]
 
-    def _format(self):
 
-        (slot, machine) = self.name.split("@")
-        self.name = '%s:%s' %(machine, slot)
-        if self.slottype == 'dynamic':
-            self.name = '      %s' %self.name
 
+class Job(Item):
+    """
+    This is the class to handle each Job.
+    """
 
-    def __cmp__(self, other):
+    # this is the list of attributes, or fields,  
+    # we want to display in the output
+    list_attr = ['id', 
+                 'owner', 
+                 'qdate', 
+                 'cmd', 
+                 'jobstatus', 
+                 'enteredcurrentstatus', 
+                 'ec2amiid', 
+                 'match_apf_queue']
+
+    # when several schedds are queried, we also display 
+    # which one each job belongs to
+    list_attr_schedd = list_attr + ['schedd']
+
+    # to sort all jobs by id number
+    sortby = 'id'
+
+    @classmethod
+    def fields(cls, args):
+        if multischedd(args):
+            return cls.list_attr_schedd
+        return cls.list_attr
+
+    @classmethod
+    def columns(cls, args):
         """
-        for the time being, we just leave things as they are
+        the id, qdate and the time in the current status are different 
+        for almost every job, so they are kept as integers
         """
-        return 1
+        fields, columns = super(Job, cls).columns(args)
+        columns[fields.index('id')] = IdColumn()
+        columns[fields.index('qdate')] = NumberColumn(formatdate)
+        columns[fields.index('enteredcurrentstatus')] = NumberColumn(formattime)
+        return fields, columns
 
 
-class Queue(Item):
+class Slot(Item):
     """
     This is the class to handle each Slot
     """
 
-    def __init__(self, dict_attr, args):
-        """
-        attr_dict is each one of the objects returned by HTCondor query
-        """
+    # this is the list of attributes, or fields,  
+    # we want to display in the output
+    list_attr = ['name',
+                 'slotid',
+                 'state',
+                 'activity',
+                 'nodetype',
+                 'loadavg',
+                 'remotegroup',
+                 'ec2instanceid',
+                 'ec2publicdns',
+                 'ec2amiid']
+
+    # for the time being, we just leave things as they are
+    sortby = None
+
+    @classmethod
+    def columns(cls, args):
+        # every slot has its own name
+        fields, columns = super(Slot, cls).columns(args)
+        columns[fields.index('name')] = ListColumn()
+        return fields, columns
 
-        # this is the list of attributes, or fields,  
-        # we want to display in the output
-        if args.longest:
-            self.list_attr = ['qname',
-                              'unsub', 
-                              'idle',
-                              'running',
-                              'removed',
-                              'completed',
-                              'held',
-                              'error',
-                              'longestidle',
-                              'longestrunning']
-        else:
-            self.list_attr = ['qname',
-                              'unsub', 
-                              'idle',
-                              'running',
-                              'removed',
-                              'completed',
-                              'held',
-                              'error']
 
-        super(Queue, self).__init__(dict_attr)
+class Queue(Item):
+    """
+    This is the class to handle each Queue
+    """
 
+    # this is the list of attributes, or fields,  
+    # we want to display in the output
+    list_attr = ['qname',
+                 'unsub', 
+                 'idle',
+                 'running',
+                 'removed',
+                 'completed',
+                 'held',
+                 'error']
 
-    def _format(self):
-        pass
+    list_attr_longest = list_attr + ['longestidle',
+                                     'longestrunning']
 
-    def __cmp__(self, other):
-        """
-        sort by queue name
-        """
+    # sort by queue name
+    sortby = 'qname'
 
-        if self.qname < other.qname:
-            return -1
-        elif self.qname > other.qname:
-            return 1
-        else:
-            return 0
+    # in the old format the values look like  IDLE = 73
+    sortkeys = dict((field, queuekey) for field in list_attr_longest[1:])
+
+    @classmethod
+    def fields(cls, args):
+        if args.longest:
+            return cls.list_attr_longest
+        return cls.list_attr
 
 
 # =============================================================================
@@ -649,3 +1421,132 @@ def formattime(secs):
     newformat = '%d+%02d:%02d:%02d' %(days, h, m, s)
     return newformat
 
+
+def formatdate(t):
+    """
+    convert seconds since epoch into 
+       YYYY-MM-DD HH:MM:SS
+    """
+    if t < 0:
+        return 'undefined'
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t))
+
+
+def cleanvalue(classad, attr):
+    """
+    value of an attribute of a ClassAd as a lower case string,
+    "undefined" when it is missing
+    """
+    return str(classad.get(attr, "undefined")).lower()
+
+
+def default_logs_state():
+    return os.path.join(tempfile.gettempdir(), 'apf-eventlog-state-%d.json' %os.getuid())
+
+
+def streaming(args):
+    """
+    True if the query output is going to be processed as it is received,
+    so there is no point in getting it all first
+    """
+    return getattr(args, 'stream', False) or getattr(args, 'format', 'text') != 'text'
+
+
+def multischedd(args):
+    """
+    True if the query must be done on all schedds 
+    known by the collector, and not only on the local one
+    """
+    return bool(getattr(args, 'pool', None) or getattr(args, 'all_schedds', False))
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+def timedcall(function, timeout=None):
+    """
+    calls function( ) in a separate thread, and returns its output
+    or raises its exception. 
+    If it does not finish within timeout seconds, QueryTimeout is raised
+    and the thread is abandoned.
+    """
+
+    result = []
+    def worker():
+        try:
+            result.append((True, function()))
+        except Exception, ex:
+            result.append((False, ex))
+
+    t = threading.Thread(target=worker)
+    t.daemon = True
+    t.start()
+    t.join(timeout)
+    if not result:
+        raise QueryTimeout('no answer after %s seconds' %timeout)
+    ok, value = result[0]
+    if not ok:
+        raise value
+    return value
+
+
+def fanout(sources, timeout=None):
+    """
+    iterates concurrently over several sources,
+    each one in its own thread, 
+    and yields their items as soon as they are received.
+
+    sources is a list of pairs (name, function), 
+    where function( ) returns an iterable.
+
+    Sources not finished after timeout seconds are abandoned,
+    and a message is written to stderr. 
+    The total time is therefore the time of the slowest source,
+    and never more than timeout.
+    """
+
+    queue = pyqueue.Queue(maxsize=1000)
+    done = object()
+
+    def worker(name, function):
+        try:
+            for item in function():
+                queue.put((name, item))
+        except Exception, ex:
+            queue.put((name, ex))
+        queue.put((name, done))
+
+    for name, function in sources:
+        t = threading.Thread(target=worker, args=(name, function))
+        # abandoned sources must not block the exit
+        t.daemon = True
+        t.start()
+
+    if timeout:
+        deadline = time.time() + timeout
+    else:
+        deadline = None
+
+    pending = set([name for name, function in sources])
+    while pending:
+        if deadline is None:
+            # a finite timeout keeps the main thread responsive to Ctrl-C
+            wait = 3600
+        else:
+            wait = deadline - time.time()
+            if wait <= 0:
+                break
+        try:
+            name, item = queue.get(True, wait)
+        except pyqueue.Empty:
+            continue
+        if item is done:
+            pending.discard(name)
+        elif isinstance(item, Exception):
+            sys.stderr.write('query to %s failed: %s\n' %(name, item))
+        else:
+            yield item
+
+    for name in pending:
+        sys.stderr.write('query to %s timed out after %s seconds\n' %(name, timeout))
@@ -0,0 +1,138 @@
+#!/bin/env python
+
+"""
+Synthetic HTCondor ClassAds, shaped like the ones in
+attic/condor_q_long.xml and attic/condor_status_long.xml,
+to test and benchmark the tools without a real pool.
+
+The ads are plain dictionaries, generated one by one,
+and are always the same for the same seed.
+"""
+
+import bisect
+import random
+import time
+
+
+# fraction of jobs in each JobStatus, as seen on a busy factory
+JOB_STATUS_WEIGHTS = [(1, 0.30),   # idle
+                      (2, 0.60),   # running
+                      (3, 0.02),   # removed
+                      (4, 0.03),   # completed
+                      (5, 0.05)]   # held
+
+QUEUE_SUFFIXES = ['sl6', 'sl7', 'cloud', 'ec2-xle1-sl6', 'gridgk07.racf.bnl.gov', 'ce01.cern.ch']
+
+
+def queuenames(nqueues, seed=0):
+    """
+    list of nqueues realistic APF queue names, like
+        ANALY_BNL_CLOUD-sl6
+        BNL_CLOUD-sl6
+    """
+    r = random.Random(seed)
+    names = []
+    for i in range(nqueues):
+        prefix = r.choice(['', 'ANALY_'])
+        site = 'SITE%03d_%s' %(i, r.choice(['CLOUD', 'SHORT', 'LONG', 'MCORE', 'HIMEM']))
+        names.append('%s%s-%s' %(prefix, site, r.choice(QUEUE_SUFFIXES)))
+    return names
+
+
+def queueweights(nqueues):
+    """
+    cumulative weights for a Zipf-like distribution:
+    a few queues have most of the jobs
+    """
+    weights = [1.0 / (i + 1) for i in range(nqueues)]
+    total = sum(weights)
+    cumulative = []
+    acc = 0.0
+    for weight in weights:
+        acc += weight / total
+        cumulative.append(acc)
+    return cumulative
+
+
+def jobs(njobs, nqueues=None, seed=0, now=None, schedd='factory.example.com'):
+    """
+    generator of njobs job ClassAds
+    """
+    if nqueues is None:
+        # roughly one queue per 500 jobs, between 10 and 2000
+        nqueues = min(max(njobs // 500, 10), 2000)
+    if now is None:
+        now = int(time.time())
+
+    r = random.Random(seed)
+    names = queuenames(nqueues, seed)
+    cumulative = queueweights(nqueues)
+    statuses = []
+    acc = 0.0
+    for status, weight in JOB_STATUS_WEIGHTS:
+        acc += weight
+        statuses.append((acc, status))
+
+    clusterid = 100000
+    procid = 0
+    for i in xrange(njobs):
+        # APF submits clusters of a few jobs
+        if i == 0 or r.random() < 0.2:
+            clusterid += 1
+            procid = 0
+        else:
+            procid += 1
+
+        x = r.random()
+        jobstatus = 1
+        for threshold, status in statuses:
+            if x <= threshold:
+                jobstatus = status
+                break
+
+        j = bisect.bisect_left(cumulative, r.random())
+        queue = names[min(j, nqueues - 1)]
+
+        qdate = now - r.randint(60, 3*24*3600)
+        entered = r.randint(qdate, now)
+        job = {'ClusterId'            : clusterid,
+               'ProcId'               : procid,
+               'Owner'                : 'apf',
+               'QDate'                : qdate,
+               'Cmd'                  : '/usr/libexec/wrapper-0.9.7.sh',
+               'JobStatus'            : jobstatus,
+               'EnteredCurrentStatus' : entered,
+               'MATCH_APF_QUEUE'      : queue,
+               'GlobalJobId'          : '%s#%d.%d#%d' %(schedd, clusterid, procid, qdate),
+               'ServerTime'           : now,
+               'MyType'               : 'Job',
+               'TargetType'           : 'Machine'}
+        if 'ec2' in queue:
+            job['EC2AmiID'] = 'ami-b7d3b8de'
+        yield job
+
+
+def slots(nslots, seed=0):
+    """
+    generator of nslots startd ClassAds.
+    Hosts have 8 static slots, like the ones in condor_status_long.xml
+    """
+    r = random.Random(seed)
+    for i in xrange(nslots):
+        host, slotid = divmod(i, 8)
+        slotid += 1
+        claimed = r.random() < 0.9
+        slot = {'Name'          : 'slot%d@ip-10-%d-%d-%d' %(slotid, host >> 16 & 255, host >> 8 & 255, host & 255),
+                'SlotID'        : slotid,
+                'State'         : claimed and 'Claimed' or 'Unclaimed',
+                'Activity'      : claimed and 'Busy' or 'Idle',
+                'NodeType'      : 'atlas',
+                'LoadAvg'       : round(r.random() * 1.2, 2),
+                'SlotType'      : 'Static',
+                'EC2InstanceID' : 'i-%08x' %host,
+                'EC2PublicDNS'  : 'ec2-54-%d-%d-%d.compute-1.amazonaws.com' %(host >> 16 & 255, host >> 8 & 255, host & 255),
+                'EC2AMIID'      : 'ami-b7d3b8de',
+                'MyType'        : 'Machine'}
+        if claimed:
+            slot['RemoteGroup'] = r.choice(['group_prod.apf', 'group_analy.apf'])
+        yield slot
@@ -0,0 +1,245 @@
+#!/bin/env python
+
+"""
+Timing of the phases of the queries: wall time, CPU time,
+number of items and bytes for each one.
+
+Many phases are lazy -xquery( ) returns an iterator, and the ClassAds
+are received while _store( ) consumes them-, so besides timing blocks
+of code, a Timer can wrap iterators and functions.
+Phases can be nested. The time of each phase does not include
+the time of the phases nested in it, so the times add up.
+
+When a Timer finishes, the list of phases is passed to the hooks,
+functions registered with addhook( ) and called like
+
+    hook(name, phases)
+
+where name is the name of the Timer ('condorq', 'queuestatus', ...)
+and phases is a list of dictionaries
+
+    {'phase': '_store', 'wall': 0.8, 'cpu': 0.79, 'count': 20000, 'bytes': 0}
+
+That way the timings can be printed (report( ) is such a hook),
+or sent to a metrics system from the daemons.
+"""
+
+import cProfile
+import sys
+import time
+
+
+HOOKS = []
+
+
+def addhook(hook):
+    if hook not in HOOKS:
+        HOOKS.append(hook)
+
+
+def removehook(hook):
+    if hook in HOOKS:
+        HOOKS.remove(hook)
+
+
+def timer(name, args=None):
+    """
+    returns a Timer if the timings are needed,
+    because of --timing or because there are hooks.
+    None otherwise, so there is no overhead at all.
+    """
+    if getattr(args, 'timing', False) or HOOKS:
+        return Timer(name)
+    return None
+
+
+class Timer(object):
+
+    def __init__(self, name):
+        self.name = name
+        # phase name -> dictionary, in order of creation
+        self.phases = {}
+        self.order = []
+        # one entry per active phase:
+        #   [name, wall at start, cpu at start, wall of nested phases, cpu of nested phases]
+        self.stack = []
+
+
+    def phase(self, name):
+        """
+        context manager timing a block of code
+
+            with timer.phase('_sort'):
+                self._sort()
+        """
+        return Phase(self, name)
+
+
+    def wrap(self, name, iterable):
+        """
+        generator yielding the items of iterable,
+        timing how long it takes to get each of them
+        """
+        iterator = iter(iterable)
+        while True:
+            self._enter(name)
+            try:
+                item = iterator.next()
+            except StopIteration:
+                self._exit()
+                return
+            except:
+                self._exit()
+                raise
+            self._exit()
+            self.phases[name]['count'] += 1
+            yield item
+
+
+    def function(self, name, function):
+        """
+        returns function, timing each call to it
+        """
+        def timed(*args, **kwargs):
+            self._enter(name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._exit()
+                self.phases[name]['count'] += 1
+        return timed
+
+
+    def output(self, name, out):
+        """
+        returns out, a file object, counting the bytes written
+        and timing each write
+        """
+        return TimedFile(self, name, out)
+
+
+    def records(self):
+        """
+        list of dictionaries, one per phase
+        """
+        return [self.phases[name] for name in self.order]
+
+
+    def finish(self):
+        """
+        calls the hooks with the timings, and returns them
+        """
+        phases = self.records()
+        for hook in list(HOOKS):
+            try:
+                hook(self.name, phases)
+            except Exception, ex:
+                sys.stderr.write('timing hook %s failed: %s\n' %(hook, ex))
+        return phases
+
+
+    def _stats(self, name):
+        if name not in self.phases:
+            self.phases[name] = {'phase': name, 'wall': 0.0, 'cpu': 0.0, 'count': 0, 'bytes': 0}
+            self.order.append(name)
+        return self.phases[name]
+
+
+    def _enter(self, name):
+        # phases are listed in the order they start
+        self._stats(name)
+        self.stack.append([name, time.time(), time.clock(), 0.0, 0.0])
+
+
+    def _exit(self):
+        name, wall0, cpu0, nestedwall, nestedcpu = self.stack.pop()
+        wall = time.time() - wall0
+        cpu = time.clock() - cpu0
+        stats = self._stats(name)
+        stats['wall'] += wall - nestedwall
+        stats['cpu'] += cpu - nestedcpu
+        if self.stack:
+            self.stack[-1][3] += wall
+            self.stack[-1][4] += cpu
+
+
+
+class Phase(object):
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.timer._enter(self.name)
+        return self.timer._stats(self.name)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.timer._exit()
+
+
+
+class NoPhase(object):
+    """
+    context manager doing nothing, when there is no Timer
+    """
+
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+NOPHASE = NoPhase()
+
+
+
+class TimedFile(object):
+
+    def __init__(self, timer, name, out):
+        self.timer = timer
+        self.name = name
+        self.out = out
+
+    def write(self, data):
+        self.timer._enter(self.name)
+        try:
+            self.out.write(data)
+        finally:
+            self.timer._exit()
+        stats = self.timer.phases[self.name]
+        stats['bytes'] += len(data)
+        stats['count'] += 1
+
+    def __getattr__(self, attr):
+        return getattr(self.out, attr)
+
+
+
+def report(name, phases, out=sys.stderr):
+    """
+    hook printing the timings as a table
+    """
+    out.write('%-12s %-16s %10s %10s %10s %12s\n' %('query', 'phase', 'wall(s)', 'cpu(s)', 'count', 'bytes'))
+    totalwall = totalcpu = 0.0
+    for phase in phases:
+        out.write('%-12s %-16s %10.3f %10.3f %10d %12d\n' %(name, phase['phase'], phase['wall'], phase['cpu'], phase['count'], phase['bytes']))
+        totalwall += phase['wall']
+        totalcpu += phase['cpu']
+    out.write('%-12s %-16s %10.3f %10.3f\n' %(name, 'total', totalwall, totalcpu))
+
+
+def profiled(path, function, *args):
+    """
+    calls function(*args).
+    When path is not None, the call is done under cProfile,
+    and the stats are written into path,
+    to be read with pstats or any other tool
+    """
+    if not path:
+        return function(*args)
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args)
+    finally:
+        profiler.dump_stats(path)
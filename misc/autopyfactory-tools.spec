@@ -31,6 +31,8 @@ python setup.py build
 
 %install
 python setup.py install -O1 --root=$RPM_BUILD_ROOT --record=INSTALLED_FILES
+# state files of the tools run from cron
+mkdir -p $RPM_BUILD_ROOT/var/lib/apf
 
 %clean
 rm -rf $RPM_BUILD_ROOT
@@ -49,9 +51,15 @@ rm -rf $RPM_BUILD_ROOT
 
 %files -f INSTALLED_FILES
 %defattr(-,root,root)
+%dir /var/lib/apf
 %attr(755,root,root) /usr/sbin/apf-condor-q
 %attr(755,root,root) /usr/sbin/apf-condor-status
+%attr(755,root,root) /usr/sbin/apf-isfull-whatif
+%attr(755,root,root) /usr/sbin/apf-log-index
 %attr(755,root,root) /usr/sbin/apf-queue-status
+%attr(755,root,root) /usr/sbin/apf-query-broker
+%attr(755,root,root) /usr/sbin/apf-querylib-bench
 %attr(755,root,root) /usr/sbin/apf-reverse-logstree
+%attr(755,root,root) /usr/sbin/apf-search-failed
 %attr(755,root,root) /usr/sbin/apf-simulate-scheds
 
@@ -34,8 +34,13 @@ etc_files = [ ]
 
 sbin_scripts = ['sbin/apf-condor-q',
                 'sbin/apf-condor-status',
+                'sbin/apf-isfull-whatif',
+                'sbin/apf-log-index',
                 'sbin/apf-queue-status',
+                'sbin/apf-query-broker',
+                'sbin/apf-querylib-bench',
                 'sbin/apf-reverse-logstree',
+                'sbin/apf-search-failed',
                 'sbin/apf-simulate-scheds',
                ]
 